@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from data_loader import get_documents_revision_key
+
+# Questions whose embeddings are at least this similar (cosine) share an answer
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Entries persist in GCS, or in a local directory when ANSWER_CACHE_DIR is set
+BUCKET_NAME = "sullstice"
+FOLDER_NAME = "answer_cache"
+LOCAL_DIR = os.getenv("ANSWER_CACHE_DIR")
+
+# Set SULLSTICE_ANSWER_CACHE=False to always call the model
+ENABLED = os.getenv("SULLSTICE_ANSWER_CACHE") != "False"
+
+# Longest a lookup waits for the question's embedding, in one attempt, before the
+# request goes on to generate an answer as if there were no cache
+LOOKUP_EMBED_SECONDS = float(os.getenv("ANSWER_CACHE_EMBED_SECONDS", "1.5"))
+
+# Attempts to merge an entry when another instance updates the cache object at the same time
+WRITE_ATTEMPTS = 5
+
+# In-memory view of the cache for the current document revision
+_state = {"revision_key": None, "entries": [], "exact": {}, "matrix": None}
+_lock = threading.Lock()
+
+# Stores run here, one at a time, so persisting never delays a response
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache")
+_local_write_lock = threading.Lock()
+
+def normalize_question(question):
+    """
+    Normalize a question for exact matching: lowercase, no punctuation, single spaces
+
+    Args:
+        question: String containing the question
+
+    Returns:
+        Normalized string
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+def _embed(text, deadline=None):
+    """
+    Get a unit-length embedding vector for a piece of text
+
+    Args:
+        text: String to embed
+        deadline: Optional seconds to wait, in a single attempt without retries
+
+    Returns:
+        numpy float32 array
+    """
+    import numpy as np
+    from openai_client import call_openai
+    if deadline is None:
+        response = call_openai("questions", "embeddings", model=EMBEDDING_MODEL, input=text)
+    else:
+        response = call_openai(
+            "questions", "embeddings", max_retries=0, deadline=deadline, model=EMBEDDING_MODEL, input=text
+        )
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def _object_name(revision_key):
+    return f"{FOLDER_NAME}/{revision_key}.json"
+
+def _read_entries(revision_key):
+    """
+    Read the persisted entries for a document revision
+
+    Returns:
+        List of entry dictionaries with question, normalized, answer and embedding
+    """
+    try:
+        if LOCAL_DIR:
+            path = os.path.join(LOCAL_DIR, _object_name(revision_key))
+            if not os.path.exists(path):
+                return []
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        from clients import get_storage_client
+        blob = get_storage_client().bucket(BUCKET_NAME).blob(_object_name(revision_key))
+        if not blob.exists():
+            return []
+        return json.loads(blob.download_as_text())
+    except Exception as e:
+        logging.error(f"Error reading answer cache: {e}")
+        return []
+
+def _merge(entries, entry):
+    return [existing for existing in entries if existing["normalized"] != entry["normalized"]] + [entry]
+
+def _write_entry(revision_key, entry):
+    """
+    Add an entry to the persisted entries for a document revision
+
+    In GCS the object is only replaced if nobody else wrote it since it was
+    read (if_generation_match), and the merge is retried otherwise, so
+    concurrent instances never drop each other's entries.
+
+    Returns:
+        The persisted entries including the new one, or None if writing failed
+    """
+    try:
+        if LOCAL_DIR:
+            path = os.path.join(LOCAL_DIR, _object_name(revision_key))
+            with _local_write_lock:
+                entries = _merge(_read_entries(revision_key), entry)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(json.dumps(entries))
+                os.replace(path + ".tmp", path)
+            return entries
+
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+        from clients import get_storage_client
+        bucket = get_storage_client().bucket(BUCKET_NAME)
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            blob = bucket.get_blob(_object_name(revision_key))
+            try:
+                if blob is None:
+                    # Generation 0 means the object must not exist yet
+                    blob, generation, entries = bucket.blob(_object_name(revision_key)), 0, []
+                else:
+                    generation = blob.generation
+                    entries = json.loads(blob.download_as_text(if_generation_match=generation))
+                entries = _merge(entries, entry)
+                blob.upload_from_string(json.dumps(entries), content_type="application/json", if_generation_match=generation)
+                return entries
+            except (NotFound, PreconditionFailed):
+                logging.info(f"Answer cache changed while storing (attempt {attempt}), merging again")
+        logging.warning(f"Gave up storing answer cache entry after {WRITE_ATTEMPTS} attempts")
+    except Exception as e:
+        logging.error(f"Error writing answer cache: {e}")
+    return None
+
+def _set_entries(revision_key, entries):
+    """
+    Replace the in-memory cache, rebuilding the exact-match map and embedding matrix
+    """
+    import numpy as np
+    _state["revision_key"] = revision_key
+    _state["entries"] = entries
+    _state["exact"] = {entry["normalized"]: entry for entry in entries}
+    _state["matrix"] = np.asarray([entry["embedding"] for entry in entries], dtype=np.float32) if entries else None
+
+def _load(revision_key):
+    """
+    Make sure the in-memory cache holds the entries for a document revision
+    """
+    with _lock:
+        if _state["revision_key"] == revision_key:
+            return
+    entries = _read_entries(revision_key)
+    with _lock:
+        if _state["revision_key"] != revision_key:
+            _set_entries(revision_key, entries)
+
+def lookup(question):
+    """
+    Find a cached answer for a question under the current document revision
+
+    Tries an exact match on the normalized question first, then the most
+    similar cached question by embedding, if it clears SIMILARITY_THRESHOLD.
+
+    Args:
+        question: String containing the question
+
+    Returns:
+        Tuple of (answer or None, lookup context). Pass the context to store()
+        so the answer is filed under the same revision and the embedding is
+        not computed twice.
+    """
+    context = {"revision_key": None, "embedding": None}
+    if not ENABLED:
+        return None, context
+
+    context["revision_key"] = get_documents_revision_key()
+    if context["revision_key"] is None:
+        return None, context
+    _load(context["revision_key"])
+
+    normalized = normalize_question(question)
+    with _lock:
+        entry = _state["exact"].get(normalized)
+        if entry:
+            return entry["answer"], context
+        matrix = _state["matrix"]
+        entries = _state["entries"]
+
+    # Nothing to compare against; store() embeds the question off the request path
+    if matrix is None:
+        return None, context
+
+    try:
+        context["embedding"] = _embed(normalized, LOOKUP_EMBED_SECONDS)
+    except Exception as e:
+        logging.warning(f"Skipping answer cache, could not embed question in time: {e}")
+        return None, context
+
+    import numpy as np
+
+    # Rows and query are unit length, so the dot product is the cosine similarity
+    scores = matrix @ context["embedding"]
+    best = int(np.argmax(scores))
+    if scores[best] >= SIMILARITY_THRESHOLD:
+        logging.info(f"Answer cache hit ({scores[best]:.3f}) for: {question}")
+        return entries[best]["answer"], context
+    return None, context
+
+def store(question, answer, context):
+    """
+    Add an answer to the cache under the document revision it was generated from
+
+    The answer is embedded (if lookup() did not already) and persisted on a
+    background thread, so the caller's response is not held up.
+
+    Args:
+        question: String containing the question
+        answer: String containing the answer
+        context: Lookup context returned by lookup()
+    """
+    revision_key = context.get("revision_key")
+    if not ENABLED or revision_key is None:
+        return
+    _writer.submit(_store, question, answer, revision_key, context.get("embedding"))
+
+def _store(question, answer, revision_key, embedding):
+    """
+    Embed and persist one answer, then refresh the in-memory cache
+    """
+    normalized = normalize_question(question)
+    try:
+        if embedding is None:
+            embedding = _embed(normalized)
+    except Exception as e:
+        logging.error(f"Error embedding question for answer cache: {e}")
+        return
+
+    entry = {
+        "question": question,
+        "normalized": normalized,
+        "answer": answer,
+        "embedding": [round(float(value), 6) for value in embedding],
+    }
+
+    # Also picks up entries other instances wrote since we loaded
+    entries = _write_entry(revision_key, entry)
+    with _lock:
+        # Leave the cache alone if the documents changed while this was stored
+        if _state["revision_key"] not in (None, revision_key):
+            return
+        if entries is None:
+            entries = _merge(_state["entries"], entry)
+        _set_entries(revision_key, entries)
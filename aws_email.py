@@ -1,6 +1,9 @@
-import boto3
 import os
 import json
+from clients import get_client
+import cloud_tasks
+import email_outbox
+from email_outbox import get_outbox
 
 def is_development_environment():
     """Check if we're running in a development environment"""
@@ -12,70 +15,145 @@ def is_development_environment():
         # Default to assuming we're in development if we can't determine
         return True
 
-# Load AWS credentials
-AWS_ACCESS_KEY = None
-AWS_SECRET_KEY = None
 AWS_REGION = "us-east-1"  # Change if using another region
 
-# Try to load credentials from JSON file if in development
-if is_development_environment():
-    try:
-        json_path = os.path.join(os.path.dirname(__file__), 'aws_access_keys.json')
-        with open(json_path, 'r') as f:
-            credentials = json.load(f)
-            AWS_ACCESS_KEY = credentials.get('aws_access_key')
-            AWS_SECRET_KEY = credentials.get('aws_secret_access_key')
-        print("✅ Loaded AWS credentials from local JSON file")
-    except Exception as e:
-        print(f"⚠️ Could not load AWS credentials from JSON: {str(e)}")
-
-# Fall back to environment variables if not set from JSON
-if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
-    AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
-    AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-    print("ℹ️ Using AWS credentials from environment variables")
-
 # Sender email
 SENDER_EMAIL = "sullhouse@sullstice.com"
 
-# Initialize AWS SES client
-ses_client = boto3.client(
-    "ses",
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=AWS_REGION,
-)
+# Set SES_LOCAL_DIR to record emails in local files instead of sending them
+SES_LOCAL_DIR = os.getenv("SES_LOCAL_DIR")
+
+def load_aws_credentials():
+    """Load AWS credentials from the local JSON file in development, else from environment variables"""
+    aws_access_key = None
+    aws_secret_key = None
+    
+    # Try to load credentials from JSON file if in development
+    if is_development_environment():
+        try:
+            json_path = os.path.join(os.path.dirname(__file__), 'aws_access_keys.json')
+            with open(json_path, 'r') as f:
+                credentials = json.load(f)
+                aws_access_key = credentials.get('aws_access_key')
+                aws_secret_key = credentials.get('aws_secret_access_key')
+            print("✅ Loaded AWS credentials from local JSON file")
+        except Exception as e:
+            print(f"⚠️ Could not load AWS credentials from JSON: {str(e)}")
+    
+    # Fall back to environment variables if not set from JSON
+    if not aws_access_key or not aws_secret_key:
+        aws_access_key = os.getenv("AWS_ACCESS_KEY")
+        aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+        print("ℹ️ Using AWS credentials from environment variables")
+    
+    return aws_access_key, aws_secret_key
+
+def _create_ses_client():
+    import boto3
+    aws_access_key, aws_secret_key = load_aws_credentials()
+    return boto3.client(
+        "ses",
+        aws_access_key_id=aws_access_key,
+        aws_secret_access_key=aws_secret_key,
+        region_name=AWS_REGION,
+    )
+
+def get_ses_client():
+    """Get the shared AWS SES client, or the local stand-in when SES_LOCAL_DIR is set"""
+    if SES_LOCAL_DIR:
+        from local_ses import LocalSESClient
+        return get_client("ses_local", lambda: LocalSESClient(SES_LOCAL_DIR))
+    return get_client("ses", _create_ses_client)
 
-def send_email(subject, body, recipient_email, cc_email=None, reply_to_email=None, sender_email=SENDER_EMAIL):
+def deliver_email(subject, body, recipient_email, cc_email=None, reply_to_email=None, sender_email=SENDER_EMAIL):
+    """
+    Send one email through SES now
+    
+    Raises the SES error if the send fails.
+    
+    Returns:
+        SES response with the MessageId
+    """
+    destination = {"ToAddresses": [recipient_email]}
+    if cc_email:
+        destination["CcAddresses"] = [cc_email]
+    
+    # Prepare the parameters for the send_email call
+    email_params = {
+        "Source": sender_email,
+        "Destination": destination,
+        "Message": {
+            "Subject": {"Data": subject},
+            "Body": {"Text": {"Data": body}},
+        },
+    }
+
+    # Add Reply-To header if provided
+    if reply_to_email:
+        email_params["ReplyToAddresses"] = [reply_to_email]
+    
+    # Send the email
+    response = get_ses_client().send_email(**email_params)
+    print(f"✅ Email sent! Message ID: {response['MessageId']}")
+    return response
+
+def send_email(subject, body, recipient_email, cc_email=None, reply_to_email=None, sender_email=SENDER_EMAIL, dedupe_key=None):
+    """
+    Queue an email in the outbox, which sends it through SES in the background
+    
+    The outbox keeps to the SES send rate, retries throttling and other
+    transient errors with backoff, and records the SES message ID.
+    
+    Args:
+        dedupe_key: Optional key; an email already queued under it is not queued again
+        
+    Returns:
+        Dictionary with the OutboxId (TEST_MODE_NO_EMAIL_SENT in test mode),
+        or None if the email could not be queued
+    """
     # Check if we're in test mode
     if os.getenv("SULLSTICE_TEST_MODE") == "True":
         print(f"⚠️ Test mode: Email sending suppressed")
         print(f"   To: {recipient_email}")
         print(f"   Subject: {subject}")
         print(f"   Body length: {len(body)} characters")
-        return {"MessageId": "TEST_MODE_NO_EMAIL_SENT"}
+        return {"OutboxId": "TEST_MODE_NO_EMAIL_SENT"}
         
     try:
-        destination = {"ToAddresses": [recipient_email]}
-        if cc_email:
-            destination["CcAddresses"] = [cc_email]
-        
-        # Prepare the parameters for the send_email call
-        email_params = {
-            "Source": sender_email,
-            "Destination": destination,
-            "Message": {
-                "Subject": {"Data": subject},
-                "Body": {"Text": {"Data": body}},
-            },
-        }
+        outbox_id = get_outbox(deliver_email).enqueue({
+            "subject": subject,
+            "body": body,
+            "recipient_email": recipient_email,
+            "cc_email": cc_email,
+            "reply_to_email": reply_to_email,
+            "sender_email": sender_email,
+        }, dedupe_key=dedupe_key)
+        return {"OutboxId": outbox_id}
+    except Exception as e:
+        print(f"❌ Error queueing email: {str(e)}")
+        return None
 
-        # Add Reply-To header if provided
-        if reply_to_email:
-            email_params["ReplyToAddresses"] = [reply_to_email]
+def run_task(request):
+    """
+    Send a queued email on behalf of Cloud Tasks
+    
+    Raises if the send failed transiently or the token could not be checked,
+    so Cloud Tasks sees an error and retries. Calls without a valid OIDC token
+    from the queue's service account get a 401.
+    
+    Args:
+        request: Flask request object with {"id": email_id, "params": {...}} as JSON
         
-        # Send the email
-        response = ses_client.send_email(**email_params)
-        print(f"✅ Email sent! Message ID: {response['MessageId']}")
-    except Exception as e:
-        print(f"❌ Error sending email: {str(e)}")
+    Returns:
+        Dictionary with the email ID and its status
+    """
+    outbox = get_outbox(deliver_email)
+    if not isinstance(outbox, email_outbox.CloudTasksOutbox):
+        return {"error": "Emails are sent in-process", "status": "error"}
+    if not outbox.verify_request(request.headers):
+        return cloud_tasks.unauthorized_response()
+    task = request.get_json(silent=True) or {}
+    if not task.get("id") or not isinstance(task.get("params"), dict):
+        return {"error": "Invalid email task", "status": "error"}
+    attempts = int(request.headers.get("X-CloudTasks-TaskRetryCount", "0")) + 1
+    return outbox.handle(task["id"], task["params"], attempts)
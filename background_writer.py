@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+import time
+import shutdown
+
+class BackgroundWriter:
+    """
+    Bounded queue drained in batches by a daemon thread, flushed on shutdown
+
+    The module using it supplies two callables, both only ever called on the
+    writer thread:
+
+    - add(item) takes one queued item into the module's buffers.
+    - write(flushing) writes whatever is due (everything when flushing) and
+      returns the seconds until it should be called again, or None to wait
+      for the next item.
+
+    Cloud Run stops instances with SIGTERM, which skips atexit handlers, so
+    the writer registers its flush with shutdown.on_shutdown.
+    """
+
+    # Put on the queue to ask the writer to flush immediately
+    _FLUSH = object()
+
+    def __init__(self, name, add, write, max_items):
+        """
+        Args:
+            name: Thread name, also used in log messages, e.g. "bigquery-writer"
+            add: Callable taking one queued item
+            write: Callable taking whether to flush, returning the next wake-up in seconds or None
+            max_items: Most items waiting in the queue; put() fails beyond that
+        """
+        self.name = name
+        self._add = add
+        self._write = write
+        self._queue = queue.Queue(maxsize=max_items)
+        self._thread = None
+        self._lock = threading.Lock()
+        shutdown.on_shutdown(self.flush)
+
+    def _run(self):
+        timeout = 0.0
+        while True:
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None and item is not self._FLUSH:
+                    self._add(item)
+                timeout = self._write(item is self._FLUSH)
+            except Exception as e:
+                logging.error(f"{self.name} failed: {e}")
+                timeout = None
+            finally:
+                if item is not None:
+                    self._queue.task_done()
+
+    def start(self):
+        """
+        Start the writer thread if it is not running yet
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def put(self, item):
+        """
+        Queue an item without blocking, starting the writer on first use
+
+        Raises:
+            queue.Full: The queue already holds max_items
+        """
+        self.start()
+        self._queue.put_nowait(item)
+
+    def flush(self, timeout=None):
+        """
+        Write all queued items now and wait for the writer to finish them
+
+        Args:
+            timeout: Seconds to wait at most, or None to wait until done
+        """
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(self._FLUSH, timeout=timeout)
+        except queue.Full:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                logging.warning(f"Timed out flushing {self.name}")
+                return
+            time.sleep(0.05)
+
+    def waiting(self):
+        """
+        Count items queued but not yet taken by the writer
+        """
+        return self._queue.qsize()
@@ -0,0 +1,355 @@
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from background_writer import BackgroundWriter
+
+# Send a table's rows when this many are buffered or the oldest has waited this long
+BATCH_MAX_ROWS = int(os.getenv("BIGQUERY_BATCH_ROWS", "500"))
+BATCH_MAX_SECONDS = float(os.getenv("BIGQUERY_BATCH_SECONDS", "5"))
+
+# Attempts per batch before its rows are spilled, and the first retry delay (doubled each time)
+MAX_ATTEMPTS = int(os.getenv("BIGQUERY_MAX_ATTEMPTS", "4"))
+RETRY_SECONDS = float(os.getenv("BIGQUERY_RETRY_SECONDS", "1"))
+
+# Set BIGQUERY_LOCAL_DIR to write to local NDJSON files instead of BigQuery
+LOCAL_DIR = os.getenv("BIGQUERY_LOCAL_DIR")
+
+# Rows that could not be written are spilled to GCS, where any instance replays them once
+# BigQuery accepts rows again. BIGQUERY_SPILL_DIR (default: under BIGQUERY_LOCAL_DIR when
+# that is set) spills to a local directory instead.
+SPILL_BUCKET = "sullstice"
+SPILL_FOLDER = "bigquery_spill"
+SPILL_DIR = os.getenv("BIGQUERY_SPILL_DIR") or (os.path.join(LOCAL_DIR, "spill") if LOCAL_DIR else None)
+REPLAY_SECONDS = float(os.getenv("BIGQUERY_REPLAY_SECONDS", "60"))
+
+# Rows BigQuery rejects as invalid are never retried; they are kept under this
+# subfolder of the spill location for inspection instead
+DEAD_LETTER_FOLDER = "dead_letter"
+
+# Per-row error reasons that retrying cannot fix
+PERMANENT_REASONS = {"invalid", "invalidQuery"}
+
+# Rows beyond this many waiting in memory are spilled straight away
+QUEUE_MAX_ROWS = int(os.getenv("BIGQUERY_QUEUE_SIZE", "10000"))
+
+_stats = {"queued": 0, "written": 0, "retried": 0, "spilled": 0, "replayed": 0, "dead_lettered": 0, "lost": 0}
+_stats_lock = threading.Lock()
+_spill_lock = threading.Lock()
+
+# Whether there may be spilled rows to replay; checked once when the writer starts
+_spill_pending = True
+
+# Rows buffered by the writer thread per table, when each table's oldest row
+# arrived (monotonic) and when spilled rows were last replayed
+_buffers = {}
+_oldest = {}
+_last_replay = None
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def get_writer_client():
+    """
+    Get the BigQuery client, or the local stand-in when BIGQUERY_LOCAL_DIR is set
+    """
+    if LOCAL_DIR:
+        from clients import get_client
+        from local_bigquery import LocalBigQueryClient
+        return get_client("bigquery_local", lambda: LocalBigQueryClient(LOCAL_DIR))
+    from clients import get_bigquery_client
+    return get_bigquery_client()
+
+def _is_permanent(error):
+    """
+    Check whether a failed insert call can never succeed, e.g. a bad request or a missing table
+    """
+    return getattr(error, "code", None) in (400, 404)
+
+def _insert(table, entries):
+    """
+    Stream rows into a table once
+
+    Args:
+        table: Table ID such as "guests.rsvp"
+        entries: List of (row, row_id) tuples
+
+    Returns:
+        Tuple of (entries to retry, (entry, errors) pairs BigQuery rejected for good)
+    """
+    rows = [row for row, _ in entries]
+    row_ids = [row_id for _, row_id in entries]
+    if all(row_id is None for row_id in row_ids):
+        row_ids = None
+    errors = get_writer_client().insert_rows_json(table, rows, row_ids=row_ids)
+    if not errors:
+        return [], []
+    logging.error(f"BigQuery rejected rows in {table}: {errors}")
+    retry = []
+    rejected = []
+    for error in errors:
+        entry = entries[error["index"]]
+        # Rows only "stopped" because another row in the call was invalid go in on retry
+        if {detail.get("reason") for detail in error.get("errors", [])} & PERMANENT_REASONS:
+            rejected.append((entry, error.get("errors")))
+        else:
+            retry.append(entry)
+    return retry, rejected
+
+def _spill_name(table):
+    return f"{table}.{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')}_{uuid.uuid4().hex[:8]}.ndjson"
+
+def _save_spill(name, data):
+    if SPILL_DIR:
+        path = os.path.join(SPILL_DIR, name)
+        with _spill_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        return path
+    from clients import get_storage_client
+    blob = get_storage_client().bucket(SPILL_BUCKET).blob(f"{SPILL_FOLDER}/{name}")
+    blob.upload_from_string(data, content_type="application/x-ndjson")
+    return f"gs://{SPILL_BUCKET}/{blob.name}"
+
+def _list_spills():
+    """
+    List spilled files waiting to be replayed, oldest first (dead letters are not included)
+    """
+    if SPILL_DIR:
+        try:
+            return sorted(name for name in os.listdir(SPILL_DIR) if name.endswith(".ndjson"))
+        except FileNotFoundError:
+            return []
+    from clients import get_storage_client
+    prefix = f"{SPILL_FOLDER}/"
+    blobs = get_storage_client().bucket(SPILL_BUCKET).list_blobs(prefix=prefix, delimiter="/")
+    return sorted(blob.name[len(prefix):] for blob in blobs if blob.name.endswith(".ndjson"))
+
+def _load_spill(name):
+    if SPILL_DIR:
+        with open(os.path.join(SPILL_DIR, name), "r", encoding="utf-8") as f:
+            data = f.read()
+    else:
+        from clients import get_storage_client
+        data = get_storage_client().bucket(SPILL_BUCKET).blob(f"{SPILL_FOLDER}/{name}").download_as_text()
+    return [(entry["row"], entry["row_id"]) for entry in map(json.loads, data.splitlines()) if entry]
+
+def _delete_spill(name):
+    if SPILL_DIR:
+        os.remove(os.path.join(SPILL_DIR, name))
+        return
+    from clients import get_storage_client
+    get_storage_client().bucket(SPILL_BUCKET).blob(f"{SPILL_FOLDER}/{name}").delete()
+
+def _spill(table, entries):
+    """
+    Save rows to the spill location to be replayed later
+    """
+    global _spill_pending
+    data = "".join(json.dumps({"row": row, "row_id": row_id}) + "\n" for row, row_id in entries)
+    try:
+        location = _save_spill(_spill_name(table), data)
+        _spill_pending = True
+        _count("spilled", len(entries))
+        logging.warning(f"Spilled {len(entries)} {table} rows to {location}")
+    except Exception as e:
+        _count("lost", len(entries))
+        logging.error(f"Lost {len(entries)} {table} rows, could not spill them: {e}")
+
+def _dead_letter(table, rejected):
+    """
+    Set aside rows BigQuery will never accept, with the errors it gave for them
+    """
+    if not rejected:
+        return
+    data = "".join(json.dumps({"row": row, "row_id": row_id, "errors": errors}, default=str) + "\n" for (row, row_id), errors in rejected)
+    try:
+        location = _save_spill(f"{DEAD_LETTER_FOLDER}/{_spill_name(table)}", data)
+        _count("dead_lettered", len(rejected))
+        logging.error(f"Dead-lettered {len(rejected)} {table} rows BigQuery rejected to {location}")
+    except Exception as e:
+        _count("lost", len(rejected))
+        logging.error(f"Lost {len(rejected)} rejected {table} rows, could not dead-letter them: {e}")
+
+def _insert_once(table, entries):
+    """
+    Insert rows once, dead-lettering the ones rejected for good
+
+    Returns:
+        Tuple of (entries still to be written, number of rows dead-lettered)
+    """
+    try:
+        remaining, rejected = _insert(table, entries)
+    except Exception as e:
+        if not _is_permanent(e):
+            logging.warning(f"BigQuery insert into {table} failed: {e}")
+            return entries, 0
+        remaining, rejected = [], [(entry, str(e)) for entry in entries]
+    _dead_letter(table, rejected)
+    _count("written", len(entries) - len(remaining) - len(rejected))
+    return remaining, len(rejected)
+
+def _write_batch(table, entries, spill=True):
+    """
+    Insert a batch, retrying with backoff, and spill whatever is still not written
+
+    Args:
+        table: Table ID such as "guests.rsvp"
+        entries: List of (row, row_id) tuples
+        spill: Whether to spill rows that could not be written, rather than leave them to the caller
+
+    Returns:
+        True if every row was written
+    """
+    delay = RETRY_SECONDS
+    written = True
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        entries, dead_lettered = _insert_once(table, entries)
+        written = written and not dead_lettered
+        if not entries:
+            return written
+        if attempt < MAX_ATTEMPTS:
+            _count("retried", len(entries))
+            time.sleep(delay)
+            delay *= 2
+    if spill:
+        _spill(table, entries)
+    return False
+
+def _replay_spilled():
+    """
+    Try to insert rows spilled earlier, oldest file first, stopping while BigQuery is unreachable
+
+    Rows BigQuery rejects for good are dead-lettered rather than spilled again.
+    """
+    global _spill_pending
+    try:
+        names = _list_spills()
+    except Exception as e:
+        logging.warning(f"Could not list spilled BigQuery rows: {e}")
+        return
+    for name in names:
+        table = name.rsplit(".", 2)[0]
+        try:
+            entries = _load_spill(name)
+        except Exception as e:
+            # Most likely another instance replayed it first
+            logging.warning(f"Could not read spilled BigQuery rows {name}: {e}")
+            continue
+        remaining, dead_lettered = _insert_once(table, entries)
+        # The same list comes back when BigQuery could not be reached at all
+        if remaining is entries:
+            return
+        try:
+            _delete_spill(name)
+        except Exception as e:
+            logging.warning(f"Could not remove replayed BigQuery rows {name}: {e}")
+        _count("replayed", len(entries) - len(remaining) - dead_lettered)
+        if remaining:
+            _spill(table, remaining)
+            return
+    _spill_pending = False
+
+def _add_row(item):
+    table, row, row_id = item
+    if table not in _buffers:
+        _buffers[table] = []
+        _oldest[table] = time.monotonic()
+    _buffers[table].append((row, row_id))
+
+def _write_due(flushing):
+    """
+    Write each table's batch by size or age, or all of them when flushing,
+    and replay spilled rows every REPLAY_SECONDS while there are any
+
+    Returns:
+        Seconds until the next batch or replay is due, or None if nothing is waiting
+    """
+    global _last_replay
+    now = time.monotonic()
+    replay_due = _spill_pending and (_last_replay is None or now - _last_replay >= REPLAY_SECONDS)
+    for table in list(_buffers):
+        if flushing or len(_buffers[table]) >= BATCH_MAX_ROWS or now - _oldest[table] >= BATCH_MAX_SECONDS:
+            entries = _buffers.pop(table)
+            del _oldest[table]
+            if not _write_batch(table, entries):
+                replay_due = False
+
+    if replay_due:
+        _replay_spilled()
+        _last_replay = now
+
+    now = time.monotonic()
+    timeout = max(0.0, min(_oldest.values()) + BATCH_MAX_SECONDS - now) if _oldest else None
+    if _spill_pending:
+        # Wake up to replay spilled rows even when nothing new arrives
+        replay_in = REPLAY_SECONDS if _last_replay is None else max(0.0, _last_replay + REPLAY_SECONDS - now)
+        timeout = replay_in if timeout is None else min(timeout, replay_in)
+    return timeout
+
+_writer = BackgroundWriter("bigquery-writer", _add_row, _write_due, QUEUE_MAX_ROWS)
+
+def insert_row(table, row, row_id=None):
+    """
+    Queue a row for the background BigQuery writer without blocking
+
+    If the queue is full the row is spilled and replayed later. Use
+    write_rows instead when the caller must know the row was written.
+
+    Args:
+        table: Table ID such as "guests.rsvp"
+        row: JSON-serializable row dictionary
+        row_id: ID BigQuery uses to drop a duplicate of this row, e.g. from
+            a replay; a random one is used if not given
+    """
+    row_id = row_id or str(uuid.uuid4())
+    try:
+        _writer.put((table, row, row_id))
+        _count("queued")
+    except queue.Full:
+        _spill(table, [(row, row_id)])
+
+def write_rows(table, entries):
+    """
+    Insert rows now, retrying with backoff, bypassing the background writer
+
+    Nothing is spilled: rows that could not be written are left to the
+    caller, e.g. a queued task that fails its step and is retried.
+
+    Args:
+        table: Table ID such as "guests.rsvp"
+        entries: List of (row, row_id) tuples
+
+    Returns:
+        True if every row was written
+    """
+    return _write_batch(table, list(entries), spill=False)
+
+def flush(timeout=None):
+    """
+    Write all queued rows now and wait for the writer to finish them
+
+    Args:
+        timeout: Seconds to wait at most, or None to wait until done
+    """
+    _writer.flush(timeout)
+
+def get_stats():
+    """
+    Get counters for the BigQuery writer
+
+    Returns:
+        Dictionary with queued, written, retried, spilled, replayed, dead_lettered
+        and lost row counts, and the rows waiting in memory
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["waiting"] = _writer.waiting()
+    return stats
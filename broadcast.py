@@ -0,0 +1,318 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import bigquery_writer
+from aws_email import SENDER_EMAIL, get_ses_client
+from email_outbox import SEND_BURST, get_send_limiter, is_transient
+
+# SES accepts at most 50 destinations per bulk templated send. Each destination
+# counts against the send rate, so a batch is also kept to one second's worth.
+BATCH_SIZE = min(50, SEND_BURST)
+
+# Bulk sends in flight at once; the shared SES rate limiter still keeps to the send rate
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "4"))
+
+# Attempts per batch on transient SES errors, and the first retry delay (doubled each attempt)
+MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+RETRY_SECONDS = float(os.getenv("BROADCAST_RETRY_SECONDS", "2"))
+
+# Checkpoints persist in GCS, or in a local directory when BROADCAST_CHECKPOINT_DIR is set
+BUCKET_NAME = "sullstice"
+FOLDER_NAME = "broadcasts"
+LOCAL_DIR = os.getenv("BROADCAST_CHECKPOINT_DIR")
+
+REPLY_TO_EMAIL = "sullhouse@gmail.com"
+
+# Per-destination bulk send statuses worth retrying
+TRANSIENT_STATUSES = {"AccountThrottled", "TransientFailure", "Failed"}
+
+# Latest RSVP per email address, then filtered by attendance and, optionally, arrival
+# day. The filters apply after picking the latest RSVP, so a guest who changed
+# their answer is matched on their current one only.
+ATTENDEES_SQL = """
+WITH latest AS (
+  SELECT name, email, can_attend, arriving, departing, camping
+  FROM `guests.rsvp`
+  WHERE email IS NOT NULL AND email != ''
+  QUALIFY ROW_NUMBER() OVER (PARTITION BY LOWER(email) ORDER BY timestamp DESC) = 1
+)
+SELECT name, email, arriving, departing, camping
+FROM latest
+WHERE (@can_attend IS NULL OR LOWER(can_attend) = @can_attend)
+  AND (@arriving IS NULL OR LOWER(arriving) = @arriving)
+"""
+
+ATTENDEE_FIELDS = ("name", "email", "arriving", "departing", "camping")
+
+def iter_attendees(can_attend="yes", arriving=None):
+    """
+    Stream attendees from the guests.rsvp table, one RSVP per email address
+
+    Args:
+        can_attend: "yes" or "no" to filter on attendance, or None for everyone
+        arriving: Arrival day to filter on, e.g. "friday", or None for any day
+
+    Yields:
+        Dictionaries with name, email, arriving, departing and camping
+    """
+    can_attend = can_attend.lower() if can_attend else None
+    arriving = arriving.lower() if arriving else None
+
+    if bigquery_writer.LOCAL_DIR:
+        latest = {}
+        for row in bigquery_writer.get_writer_client().list_rows("guests.rsvp"):
+            email = (row.get("email") or "").lower()
+            if not email:
+                continue
+            if email not in latest or row.get("timestamp", "") >= latest[email].get("timestamp", ""):
+                latest[email] = row
+        for row in latest.values():
+            if can_attend and (row.get("can_attend") or "").lower() != can_attend:
+                continue
+            if arriving and (row.get("arriving") or "").lower() != arriving:
+                continue
+            yield {field: row.get(field, "") for field in ATTENDEE_FIELDS}
+        return
+
+    from google.cloud import bigquery
+    from clients import get_bigquery_client
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("can_attend", "STRING", can_attend),
+            bigquery.ScalarQueryParameter("arriving", "STRING", arriving),
+        ]
+    )
+    # Rows are fetched a page at a time as the caller iterates
+    for row in get_bigquery_client().query(ATTENDEES_SQL, job_config=job_config).result(page_size=500):
+        yield {field: row[field] or "" for field in ATTENDEE_FIELDS}
+
+def save_template(name, subject, text):
+    """
+    Create or update an SES email template
+
+    Templates use {{name}}, {{arriving}}, {{departing}} and {{camping}}
+    for each attendee's details.
+
+    Args:
+        name: Template name
+        subject: Subject line template
+        text: Plain-text body template
+    """
+    template = {"TemplateName": name, "SubjectPart": subject, "TextPart": text}
+    ses = get_ses_client()
+    try:
+        ses.update_template(Template=template)
+    except Exception as e:
+        if getattr(e, "response", {}).get("Error", {}).get("Code") != "TemplateDoesNotExist":
+            raise
+        ses.create_template(Template=template)
+
+def _checkpoint_name(broadcast_id):
+    return f"{FOLDER_NAME}/{broadcast_id}.json"
+
+def read_checkpoint(broadcast_id):
+    """
+    Read the progress of a broadcast
+
+    Returns:
+        Dictionary with broadcast_id, template, sent (email to MessageId) and
+        failed (email to error), or None if the broadcast has not started
+    """
+    if LOCAL_DIR:
+        path = os.path.join(LOCAL_DIR, _checkpoint_name(broadcast_id))
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    from clients import get_storage_client
+    blob = get_storage_client().bucket(BUCKET_NAME).blob(_checkpoint_name(broadcast_id))
+    if not blob.exists():
+        return None
+    return json.loads(blob.download_as_text())
+
+def write_checkpoint(checkpoint):
+    """
+    Persist the progress of a broadcast
+    """
+    checkpoint["updated_at"] = datetime.now().isoformat()
+    data = json.dumps(checkpoint)
+    if LOCAL_DIR:
+        path = os.path.join(LOCAL_DIR, _checkpoint_name(checkpoint["broadcast_id"]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return
+    from clients import get_storage_client
+    blob = get_storage_client().bucket(BUCKET_NAME).blob(_checkpoint_name(checkpoint["broadcast_id"]))
+    blob.upload_from_string(data, content_type="application/json")
+
+def _send_batch(template, attendees, bucket):
+    """
+    Send one bulk templated email to up to BATCH_SIZE attendees
+
+    Transient failures, for the whole call or for single destinations, are
+    retried with backoff.
+
+    Returns:
+        Tuple of (sent, failed): dictionaries mapping email to MessageId and to error
+    """
+    sent = {}
+    failed = {}
+    pending = list(attendees)
+    delay = RETRY_SECONDS
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        # SES counts each destination against the send rate
+        bucket.acquire(len(pending))
+        try:
+            response = get_ses_client().send_bulk_templated_email(
+                Source=SENDER_EMAIL,
+                ReplyToAddresses=[REPLY_TO_EMAIL],
+                Template=template,
+                DefaultTemplateData=json.dumps({field: "" for field in ATTENDEE_FIELDS}),
+                Destinations=[
+                    {
+                        "Destination": {"ToAddresses": [attendee["email"]]},
+                        "ReplacementTemplateData": json.dumps(attendee),
+                    }
+                    for attendee in pending
+                ],
+            )
+        except Exception as e:
+            if not is_transient(e) or attempt == MAX_ATTEMPTS:
+                failed.update({attendee["email"]: str(e) for attendee in pending})
+                return sent, failed
+            logging.warning(f"Bulk send failed (attempt {attempt}), retrying in {delay:g} s: {e}")
+            time.sleep(delay)
+            delay *= 2
+            continue
+
+        retry = []
+        for attendee, status in zip(pending, response["Status"]):
+            if status["Status"] == "Success":
+                sent[attendee["email"]] = status["MessageId"]
+            elif status["Status"] in TRANSIENT_STATUSES and attempt < MAX_ATTEMPTS:
+                retry.append(attendee)
+            else:
+                failed[attendee["email"]] = f"{status['Status']}: {status.get('Error', '')}"
+        if not retry:
+            return sent, failed
+        pending = retry
+        time.sleep(delay)
+        delay *= 2
+    return sent, failed
+
+def _batches(attendees, skip):
+    batch = []
+    for attendee in attendees:
+        if attendee["email"].lower() in skip:
+            continue
+        skip.add(attendee["email"].lower())
+        batch.append(attendee)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_broadcast(broadcast_id, template, can_attend="yes", arriving=None):
+    """
+    Email every matching attendee with an SES template, resuming a broadcast that stopped part way
+
+    Attendees are streamed from BigQuery in batches of BATCH_SIZE. Up to
+    CONCURRENCY bulk sends run at once, kept to the SES send rate. The
+    checkpoint is saved after every batch, so running the same broadcast ID
+    again skips everyone already sent to.
+
+    Sends share this process's SES rate limiter with the email outbox. On
+    Cloud Run queued emails go through Cloud Tasks at the email queue's own
+    rate instead, so lower SES_MAX_SEND_RATE for the broadcast by that rate.
+
+    Args:
+        broadcast_id: Name for this broadcast, used for its checkpoint
+        template: SES template name, see save_template
+        can_attend: "yes" or "no" to filter on attendance, or None for everyone
+        arriving: Arrival day to filter on, or None for any day
+
+    Returns:
+        Dictionary with sent and failed counts and the elapsed seconds
+    """
+    checkpoint = read_checkpoint(broadcast_id) or {
+        "broadcast_id": broadcast_id,
+        "template": template,
+        "filters": {"can_attend": can_attend, "arriving": arriving},
+        "sent": {},
+        "failed": {},
+        "created_at": datetime.now().isoformat(),
+    }
+    # Failed addresses are tried again on resume
+    checkpoint["failed"] = {}
+    skip = {email.lower() for email in checkpoint["sent"]}
+
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(CONCURRENCY * 2)
+    # The limiter the email outbox uses, so queued emails and the broadcast share the rate
+    bucket = get_send_limiter()
+    started = time.perf_counter()
+
+    def send(batch):
+        try:
+            sent, failed = _send_batch(template, batch, bucket)
+            with lock:
+                checkpoint["sent"].update(sent)
+                checkpoint["failed"].update(failed)
+                write_checkpoint(checkpoint)
+        except Exception as e:
+            logging.error(f"Broadcast {broadcast_id} batch failed: {e}")
+            with lock:
+                checkpoint["failed"].update({attendee["email"]: str(e) for attendee in batch})
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="broadcast") as executor:
+        # The semaphore keeps only a few batches buffered ahead of the senders
+        for batch in _batches(iter_attendees(can_attend, arriving), skip):
+            slots.acquire()
+            executor.submit(send, batch)
+
+    write_checkpoint(checkpoint)
+    summary = {
+        "metric": "broadcast",
+        "broadcast_id": broadcast_id,
+        "sent": len(checkpoint["sent"]),
+        "failed": len(checkpoint["failed"]),
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+    logging.info(json.dumps(summary))
+    return summary
+
+# e.g. python broadcast.py template details-update "Sullstice update" body.txt
+#      python broadcast.py send details-update-1 details-update --arriving friday
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Email RSVPs with an SES template")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    template_command = commands.add_parser("template", help="Create or update a template")
+    template_command.add_argument("name")
+    template_command.add_argument("subject")
+    template_command.add_argument("body_file")
+
+    send_command = commands.add_parser("send", help="Send or resume a broadcast")
+    send_command.add_argument("broadcast_id")
+    send_command.add_argument("template")
+    send_command.add_argument("--can-attend", default="yes", help='"yes", "no" or "all"')
+    send_command.add_argument("--arriving", help="Only RSVPs arriving on this day")
+
+    args = parser.parse_args()
+    if args.command == "template":
+        with open(args.body_file, "r", encoding="utf-8") as f:
+            save_template(args.name, args.subject, f.read())
+        print(f"Saved template {args.name}")
+    else:
+        can_attend = None if args.can_attend == "all" else args.can_attend
+        print(json.dumps(run_broadcast(args.broadcast_id, args.template, can_attend, args.arriving)))
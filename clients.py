@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+
+# Heavy SDK clients, created on first use rather than at import time
+_clients = {}
+_lock = threading.Lock()
+
+def get_client(name, factory):
+    """
+    Get a process-wide client, creating it with factory on first use
+
+    Args:
+        name: Key the client is cached under
+        factory: Callable with no arguments that builds the client
+
+    Returns:
+        The cached client
+    """
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            started = time.perf_counter()
+            client = factory()
+            _clients[name] = client
+            logging.info(f"Created {name} client in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return client
+
+def get_bigquery_client():
+    """
+    Get the shared BigQuery client
+    """
+    def create():
+        from google.cloud import bigquery
+        return bigquery.Client()
+    return get_client("bigquery", create)
+
+def get_storage_client():
+    """
+    Get the shared Cloud Storage client
+    """
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return get_client("storage", create)
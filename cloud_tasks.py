@@ -0,0 +1,95 @@
+import json
+import logging
+from clients import get_client
+
+def _create_client():
+    from google.cloud import tasks_v2
+    return tasks_v2.CloudTasksClient()
+
+def create_http_task(queue, url, body, service_account, name=None):
+    """
+    Create a Cloud Tasks task that POSTs JSON to one of our endpoints
+
+    The call carries an OIDC token for service_account, which the endpoint
+    checks with verify_request.
+
+    Args:
+        queue: Queue path, "projects/<project>/locations/<location>/queues/<queue>"
+        url: Endpoint URL, also the token audience
+        body: JSON-serializable request body
+        service_account: Service account email the token is issued to
+        name: Optional task name (letters, digits, - and _); a second task with
+            the same name is not created
+
+    Returns:
+        True if the task was created, False if a task with that name already existed
+    """
+    from google.api_core.exceptions import AlreadyExists
+    task = {
+        "http_request": {
+            "http_method": "POST",
+            "url": url,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(body).encode("utf-8"),
+            "oidc_token": {"service_account_email": service_account, "audience": url},
+        }
+    }
+    if name:
+        task["name"] = f"{queue}/tasks/{name}"
+    try:
+        get_client("cloud_tasks", _create_client).create_task(parent=queue, task=task)
+    except AlreadyExists:
+        return False
+    return True
+
+def verify_request(headers, url, service_account):
+    """
+    Check that a call to one of our task endpoints came from Cloud Tasks
+
+    The endpoints are publicly reachable, so the OIDC token Cloud Tasks sends
+    must be signed by Google for the endpoint URL and issued to our service account.
+
+    Args:
+        headers: Request headers
+        url: Endpoint URL the token must be issued for
+        service_account: Service account email the token must belong to
+
+    Returns:
+        True if the call is authentic
+
+    Raises:
+        google.auth.exceptions.TransportError: Google's signing certificates
+            could not be fetched, so the token could not be checked. The
+            endpoint should fail with a 5xx so Cloud Tasks retries the call.
+    """
+    authorization = headers.get("Authorization", "")
+    if not authorization.startswith("Bearer "):
+        return False
+    from google.auth import exceptions as auth_exceptions
+    from google.auth.transport import requests as auth_requests
+    from google.oauth2 import id_token
+    try:
+        claims = id_token.verify_oauth2_token(
+            authorization[len("Bearer "):],
+            get_client("auth_request", auth_requests.Request),
+            audience=url,
+        )
+    except auth_exceptions.TransportError:
+        raise
+    except (ValueError, auth_exceptions.GoogleAuthError) as e:
+        logging.warning(f"Rejected task call to {url} with an invalid token: {e}")
+        return False
+    if claims.get("email") != service_account or not claims.get("email_verified"):
+        logging.warning(f"Rejected task call to {url} from {claims.get('email')}")
+        return False
+    return True
+
+def unauthorized_response():
+    """
+    Response for a task call that failed verify_request
+
+    It is a 401 rather than an error in a 200, which Cloud Tasks would count
+    as the task having been done.
+    """
+    from flask import Response
+    return Response(json.dumps({"error": "Unauthorized", "status": "error"}), status=401, mimetype="application/json")
@@ -0,0 +1,186 @@
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import data_loader
+from get_people_from_sheet import Person, get_people_from_sheet, get_sheet_modified_time
+
+# Bump when the bundle layout changes; older bundles are then ignored
+FORMAT_VERSION = 1
+
+# Bundle shipped with the deploy source, and its published copy in GCS
+SNAPSHOT_PATH = os.getenv(
+    "SULLSTICE_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "context_snapshot.json.gz")
+)
+BUCKET_NAME = "sullstice"
+SNAPSHOT_BLOB = "context_snapshots/latest.json.gz"
+
+# All documents captured in a snapshot, keyed by name
+SNAPSHOT_DOCUMENTS = dict(data_loader.EVENT_DOCUMENTS, updated_event_details=data_loader.UPDATED_EVENT_DETAILS_DOC_ID)
+
+# Field order of each people row in the bundle
+PEOPLE_FIELDS = Person.__slots__
+
+def build_snapshot():
+    """
+    Export all event documents and the people directory into one bundle
+
+    Returns:
+        Dictionary with format, version, created_at, documents, people and relationship_levels
+    """
+    documents = {}
+    for name, doc_id in SNAPSHOT_DOCUMENTS.items():
+        text = data_loader.get_doc_content(doc_id, force_refresh=True)
+        if not text:
+            raise RuntimeError(f"Could not load {name} document for snapshot")
+        documents[name] = {
+            "doc_id": doc_id,
+            "revision_id": data_loader.get_doc_revision(doc_id),
+            "text": text,
+        }
+
+    try:
+        people_modified_time = get_sheet_modified_time()
+    except Exception as e:
+        logging.warning(f"Could not read people sheet modified time: {e}")
+        people_modified_time = None
+    people_data, _, relationship_levels = get_people_from_sheet()
+    if not people_data:
+        raise RuntimeError("Could not load people directory for snapshot")
+
+    bundle = {
+        "format": FORMAT_VERSION,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "documents": documents,
+        "people_modified_time": people_modified_time,
+        "people": [[person[field] for field in PEOPLE_FIELDS] for person in people_data.values()],
+        "relationship_levels": relationship_levels,
+    }
+
+    # The version identifies the content, so identical exports get the same version
+    content = json.dumps({key: bundle[key] for key in ("documents", "people", "relationship_levels")}, sort_keys=True)
+    bundle["version"] = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    return bundle
+
+def encode_snapshot(bundle):
+    """
+    Serialize a bundle as compact gzip-compressed JSON
+    """
+    return gzip.compress(json.dumps(bundle, separators=(",", ":")).encode("utf-8"))
+
+def decode_snapshot(data):
+    """
+    Deserialize a bundle, returning None if it is from an unknown format
+    """
+    bundle = json.loads(gzip.decompress(data))
+    if bundle.get("format") != FORMAT_VERSION:
+        logging.warning(f"Ignoring context snapshot with format {bundle.get('format')}")
+        return None
+    return bundle
+
+def read_local_snapshot(path=SNAPSHOT_PATH):
+    """
+    Read the bundle shipped with the deploy source
+
+    Returns:
+        Bundle dictionary, or None if there is no usable bundle
+    """
+    try:
+        with open(path, "rb") as f:
+            return decode_snapshot(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Error reading context snapshot {path}: {e}")
+        return None
+
+def read_published_snapshot():
+    """
+    Read the latest bundle published to GCS
+
+    Returns:
+        Bundle dictionary, or None if there is no usable bundle
+    """
+    from clients import get_storage_client
+    try:
+        blob = get_storage_client().bucket(BUCKET_NAME).blob(SNAPSHOT_BLOB)
+        return decode_snapshot(blob.download_as_bytes())
+    except Exception as e:
+        logging.error(f"Error reading published context snapshot: {e}")
+        return None
+
+def apply_snapshot(bundle):
+    """
+    Seed the document and people caches from a bundle
+
+    Requests are then served from the bundle. The caches' usual revision and
+    modified-time checks roll each part forward when the live source changes.
+
+    Args:
+        bundle: Bundle dictionary
+    """
+    for document in bundle["documents"].values():
+        data_loader.seed_doc_cache(document["doc_id"], document["text"], document["revision_id"])
+
+    people_data = {}
+    people_by_email = {}
+    for row in bundle["people"]:
+        person_info = Person(*row)
+        person_info.they_call_me = sys.intern(person_info.they_call_me)
+        person_info.relationship = sys.intern(person_info.relationship)
+        person_info.relationship_level = sys.intern(person_info.relationship_level)
+        people_data[person_info.name.lower()] = person_info
+        if person_info.email:
+            people_by_email[person_info.email.lower()] = person_info
+    data_loader.seed_people_snapshot(
+        people_data, people_by_email, bundle["relationship_levels"], bundle["people_modified_time"]
+    )
+    logging.info(f"Applied context snapshot {bundle['version']} created {bundle['created_at']}")
+
+def load_snapshot():
+    """
+    Apply the newest available bundle
+
+    The shipped bundle is always read. With SULLSTICE_SNAPSHOT_FROM_GCS=True
+    the published one is read too, and whichever was created later is applied,
+    so a snapshot published after the deploy is not shadowed by the bundled one.
+
+    Returns:
+        The applied bundle's version, or None if no bundle was available
+    """
+    bundles = [read_local_snapshot()]
+    if os.getenv("SULLSTICE_SNAPSHOT_FROM_GCS") == "True":
+        bundles.append(read_published_snapshot())
+    bundles = [bundle for bundle in bundles if bundle is not None]
+    if not bundles:
+        return None
+    # created_at is an ISO timestamp in UTC, so it orders as a string
+    bundle = max(bundles, key=lambda bundle: bundle["created_at"])
+    apply_snapshot(bundle)
+    return bundle["version"]
+
+def publish_snapshot(bundle, path=SNAPSHOT_PATH, upload=True):
+    """
+    Write a bundle next to the deploy source and optionally publish it to GCS
+
+    Args:
+        bundle: Bundle dictionary
+        path: Local file to write
+        upload: Whether to also upload to GCS as the latest snapshot
+    """
+    data = encode_snapshot(bundle)
+    with open(path, "wb") as f:
+        f.write(data)
+    if upload:
+        from clients import get_storage_client
+        blob = get_storage_client().bucket(BUCKET_NAME).blob(SNAPSHOT_BLOB)
+        blob.upload_from_string(data, content_type="application/gzip")
+    print(f"Wrote context snapshot {bundle['version']} ({len(data)} bytes) to {path}" + (" and GCS" if upload else ""))
+
+# Build and publish a snapshot, e.g. python context_snapshot.py [--no-upload]
+if __name__ == "__main__":
+    publish_snapshot(build_snapshot(), upload="--no-upload" not in sys.argv)
@@ -1,9 +1,13 @@
 import logging
 import os
 import json
-from get_people_from_sheet import get_people_from_sheet
-from googleapiclient.discovery import build
-from google.auth import default
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from get_people_from_sheet import get_people_from_sheet, get_sheet_modified_time
+from google_services import get_docs_service
 
 def load_file(filepath, error_message):
     """
@@ -23,98 +27,449 @@ def load_file(filepath, error_message):
         logging.error(f"{error_message}: {e}")
         return ""
 
-def get_doc_content(doc_id):
+# Google Doc IDs for the event documents
+EVENT_DETAILS_DOC_ID = '1luRVbRCQOK31oI4mrfNDJUX7-Pc1yv6ZotgduwpKZ8A'
+UPDATED_EVENT_DETAILS_DOC_ID = '1rPJ1CGlilZ4EhdE_dXv_PRaZrufSoHZfVIXt3ps8Ey4'
+PREVIOUS_EVENT_DOC_ID = '1EnXvBT-ehH5eM2txjU5fG6aTofgw8MwvZ540UMOUWNs'
+CURRENT_LINEUP_DOC_ID = '1pVbeaffYThcj71rdIAi8AfcYCyv_UyuY_0ylUadTWyA'
+
+# Documents used to build the AI prompts, keyed by bundle name
+EVENT_DOCUMENTS = {
+    "event_details": EVENT_DETAILS_DOC_ID,
+    "previous_event": PREVIOUS_EVENT_DOC_ID,
+    "current_lineup": CURRENT_LINEUP_DOC_ID,
+}
+
+# Cache of Google Doc content keyed by doc ID. Entries hold the rendered text,
+# the document revision it came from and when that revision was last confirmed.
+DOC_CACHE_TTL_SECONDS = float(os.getenv("DOC_CACHE_TTL_SECONDS", "300"))
+
+_doc_cache = {}
+_doc_cache_lock = threading.Lock()
+_doc_cache_stats = {"hits": 0, "misses": 0, "revalidated": 0, "refetched": 0}
+
+def _document_to_text(document):
     """
-    Get content from a Google Doc and convert formatting to markdown
+    Convert a Google Docs API document into markdown text
     
     Args:
-        doc_id: The ID of the Google Doc
+        document: Document resource returned by the Docs API
         
     Returns:
         String containing the document content with formatting converted to markdown
     """
-    try:
-        # Configure the connection
-        SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
-        
-        # Use default credentials from environment
-        logging.info("Using default credentials for Google Docs access")
-        credentials, project = default(scopes=SCOPES)
-        
-        # Build the service with the appropriate credentials
-        docs_service = build('docs', 'v1', credentials=credentials)
+    doc_content = document.get('body').get('content')
+    
+    # Extract text with formatting from the document
+    # For updated_event_details, we'll assume the document contains plain markdown
+    # that already follows our expected formatting pattern
+    text = ""
+    for element in doc_content:
+        if 'paragraph' in element:
+            paragraph = element.get('paragraph')
+            
+            paragraph_text = ""
+            for paragraph_element in paragraph.get('elements', []):
+                if 'textRun' in paragraph_element:
+                    content = paragraph_element.get('textRun').get('content', '')
+                    paragraph_text += content
+            
+            # Add the paragraph text as-is, preserving markdown syntax
+            text += paragraph_text
+    
+    # Ensure consistent line endings
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def _fetch_doc_revision(doc_id):
+    """
+    Fetch only the revision ID of a Google Doc
+    
+    Args:
+        doc_id: The ID of the Google Doc
         
-        # Get the document content
-        document = docs_service.documents().get(documentId=doc_id).execute()
-        doc_content = document.get('body').get('content')
+    Returns:
+        String containing the document's current revision ID
+    """
+    document = get_docs_service().documents().get(documentId=doc_id, fields='revisionId').execute()
+    return document.get('revisionId')
+
+def _fetch_doc(doc_id):
+    """
+    Download a Google Doc and convert it to markdown
+    
+    Args:
+        doc_id: The ID of the Google Doc
         
-        # Extract text with formatting from the document
-        # For updated_event_details, we'll assume the document contains plain markdown
-        # that already follows our expected formatting pattern
-        text = ""
-        for element in doc_content:
-            if 'paragraph' in element:
-                paragraph = element.get('paragraph')
-                
-                paragraph_text = ""
-                for paragraph_element in paragraph.get('elements', []):
-                    if 'textRun' in paragraph_element:
-                        content = paragraph_element.get('textRun').get('content', '')
-                        paragraph_text += content
-                
-                # Add the paragraph text as-is, preserving markdown syntax
-                text += paragraph_text
+    Returns:
+        Tuple of (text, revision_id)
+    """
+    document = get_docs_service().documents().get(documentId=doc_id).execute()
+    return _document_to_text(document), document.get('revisionId')
+
+def get_doc_content(doc_id, force_refresh=False):
+    """
+    Get content from a Google Doc and convert formatting to markdown
+    
+    Content is cached in-process for DOC_CACHE_TTL_SECONDS. Once an entry is
+    stale only the document's revision ID is requested, and the full document
+    is downloaded again only if that revision has changed.
+    
+    Args:
+        doc_id: The ID of the Google Doc
+        force_refresh: If True, skip the cache and download the document
         
-        # Ensure consistent line endings
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    Returns:
+        String containing the document content with formatting converted to markdown
+    """
+    now = time.monotonic()
+    with _doc_cache_lock:
+        entry = _doc_cache.get(doc_id)
+        if entry and not force_refresh and now - entry["checked_at"] < DOC_CACHE_TTL_SECONDS:
+            _doc_cache_stats["hits"] += 1
+            return entry["text"]
+        _doc_cache_stats["misses"] += 1
+    
+    try:
+        if entry and not force_refresh:
+            # Stale entry: a cheap revision check decides whether to re-download
+            revision_id = _fetch_doc_revision(doc_id)
+            if revision_id and revision_id == entry["revision_id"]:
+                with _doc_cache_lock:
+                    entry["checked_at"] = time.monotonic()
+                    _doc_cache_stats["revalidated"] += 1
+                return entry["text"]
         
+        text, revision_id = _fetch_doc(doc_id)
+        with _doc_cache_lock:
+            _doc_cache[doc_id] = {
+                "text": text,
+                "revision_id": revision_id,
+                "checked_at": time.monotonic(),
+            }
+            _doc_cache_stats["refetched"] += 1
         return text
     except Exception as e:
         logging.error(f"Error fetching Google Doc content: {e}")
+        if entry:
+            # Serve the last good copy rather than an empty document
+            return entry["text"]
         return ""
 
+def get_doc_revision(doc_id):
+    """
+    Get the revision ID of the cached copy of a Google Doc
+    
+    Args:
+        doc_id: The ID of the Google Doc
+        
+    Returns:
+        String containing the revision ID, or None if the doc is not cached
+    """
+    with _doc_cache_lock:
+        entry = _doc_cache.get(doc_id)
+        return entry["revision_id"] if entry else None
+
+def invalidate_doc_cache(doc_id=None):
+    """
+    Drop cached Google Doc content so the next read downloads it again
+    
+    Args:
+        doc_id: The ID of the Google Doc to drop, or None to drop all docs
+    """
+    with _doc_cache_lock:
+        if doc_id is None:
+            _doc_cache.clear()
+        else:
+            _doc_cache.pop(doc_id, None)
+
+def seed_doc_cache(doc_id, text, revision_id):
+    """
+    Put known document content into the cache, e.g. from a context snapshot
+    
+    The entry is treated as fresh for DOC_CACHE_TTL_SECONDS and is then
+    revalidated against the live revision like any other entry.
+    
+    Args:
+        doc_id: The ID of the Google Doc
+        text: Document content in markdown
+        revision_id: Revision the content was taken from
+    """
+    with _doc_cache_lock:
+        _doc_cache[doc_id] = {
+            "text": text,
+            "revision_id": revision_id,
+            "checked_at": time.monotonic(),
+        }
+
+def get_doc_cache_stats():
+    """
+    Get hit/miss counters for the Google Doc cache
+    
+    Returns:
+        Dictionary with hits, misses, revalidated, refetched and cached entry count
+    """
+    with _doc_cache_lock:
+        stats = dict(_doc_cache_stats)
+        stats["entries"] = len(_doc_cache)
+    return stats
+
 def load_event_details():
     """
     Load current event details from Google Docs
     """
-    EVENT_DETAILS_DOC_ID = '1luRVbRCQOK31oI4mrfNDJUX7-Pc1yv6ZotgduwpKZ8A' # Replace with your actual Doc ID
-    content = get_doc_content(EVENT_DETAILS_DOC_ID)
-    return content
+    return get_doc_content(EVENT_DETAILS_DOC_ID)
 
 def load_updated_event_details():
     """
     Load updated event details from Google Docs
     """
-    UPDATED_EVENT_DETAILS_DOC_ID = '1rPJ1CGlilZ4EhdE_dXv_PRaZrufSoHZfVIXt3ps8Ey4'
-    content = get_doc_content(UPDATED_EVENT_DETAILS_DOC_ID)
-    return content
+    return get_doc_content(UPDATED_EVENT_DETAILS_DOC_ID)
 
 def load_previous_event():
     """
     Load information about the previous year's event from Google Docs
     """
-    PREVIOUS_EVENT_DOC_ID = '1EnXvBT-ehH5eM2txjU5fG6aTofgw8MwvZ540UMOUWNs' # Replace with your actual Doc ID
-    content = get_doc_content(PREVIOUS_EVENT_DOC_ID)
-    return content
+    return get_doc_content(PREVIOUS_EVENT_DOC_ID)
 
 def load_current_lineup():
     """
     Load information about the current year's lineup and activities from Google Docs
     """
-    CURRENT_LINEUP_DOC_ID = '1pVbeaffYThcj71rdIAi8AfcYCyv_UyuY_0ylUadTWyA' # Replace with your actual Doc ID
-    content = get_doc_content(CURRENT_LINEUP_DOC_ID)
-    return content
+    return get_doc_content(CURRENT_LINEUP_DOC_ID)
 
-def get_people_data():
+def load_event_documents(names=None):
+    """
+    Load several event documents from Google Docs concurrently
+    
+    Each document is fetched on its own thread, so the total time is close to
+    the slowest single fetch. A document that fails to load comes back as an
+    empty string without affecting the others.
+    
+    Args:
+        names: Iterable of keys from EVENT_DOCUMENTS, defaults to all of them
+        
+    Returns:
+        Dictionary mapping each requested name to the document content
     """
-    Get the latest people information directly from the Google Sheet
+    names = list(names) if names is not None else list(EVENT_DOCUMENTS)
     
+    documents = {}
+    with ThreadPoolExecutor(max_workers=len(names) or 1) as executor:
+        futures = {name: executor.submit(get_doc_content, EVENT_DOCUMENTS[name]) for name in names}
+        for name, future in futures.items():
+            try:
+                documents[name] = future.result()
+            except Exception as e:
+                logging.error(f"Error loading {name} document: {e}")
+                documents[name] = ""
+    
+    return documents
+
+def get_documents_revision_key(names=None, load=True):
+    """
+    Get one key identifying the current revisions of the event documents
+    
+    The documents are loaded (from the cache when fresh) so the key always
+    matches the content that prompts are built from.
+    
+    Args:
+        names: Iterable of keys from EVENT_DOCUMENTS, defaults to all of them
+        load: Set to False if the caller has just loaded the documents itself
+        
     Returns:
-        Tuple containing people data dictionaries and relationship levels
+        String key that changes whenever any of the documents is edited,
+        or None if a revision is unknown
+    """
+    names = list(names) if names is not None else list(EVENT_DOCUMENTS)
+    if load:
+        load_event_documents(names)
+    
+    revision_ids = [get_doc_revision(EVENT_DOCUMENTS[name]) for name in names]
+    if not all(revision_ids):
+        return None
+    return hashlib.sha256("|".join(revision_ids).encode("utf-8")).hexdigest()[:16]
+
+# Process-wide snapshot of the people directory. Requests are always served
+# from the current snapshot; a background thread replaces it when the sheet's
+# modified time changes or the snapshot is older than the max age.
+PEOPLE_CHANGE_CHECK_SECONDS = float(os.getenv("PEOPLE_CHANGE_CHECK_SECONDS", "60"))
+PEOPLE_CACHE_MAX_AGE_SECONDS = float(os.getenv("PEOPLE_CACHE_MAX_AGE_SECONDS", "3600"))
+
+# How long to serve without a directory after a failed first load before trying the sheet again
+PEOPLE_RETRY_SECONDS = float(os.getenv("PEOPLE_RETRY_SECONDS", "30"))
+
+_people_snapshot = None
+_people_lock = threading.Lock()
+_people_load_lock = threading.Lock()
+_people_refresh_thread = None
+_people_failed_at = None
+
+# Snapshot versions only ever go up, even across invalidations, so caches keyed on them never go stale
+_people_versions = itertools.count(1)
+
+def _load_people_snapshot(modified_time=None):
+    """
+    Read the people directory from the sheet and wrap it in a snapshot
+    
+    Args:
+        modified_time: Sheet modified time the data corresponds to, if known
+        
+    Returns:
+        Dictionary with the people data tuple and its bookkeeping, or None if the read failed
     """
     try:
         people_data, people_by_email, relationship_levels = get_people_from_sheet()
-        return people_data, people_by_email, relationship_levels
     except Exception as e:
         logging.error(f"Error loading people information from sheet: {e}")
+        return None
+    
+    if not people_data:
+        return None
+    
+    now = time.monotonic()
+    return {
+        "data": (people_data, people_by_email, relationship_levels),
+        "modified_time": modified_time,
+        "loaded_at": now,
+        "checked_at": now,
+        "version": next(_people_versions),
+    }
+
+def _read_sheet_modified_time():
+    try:
+        return get_sheet_modified_time()
+    except Exception as e:
+        logging.warning(f"Could not read people sheet modified time: {e}")
+        return None
+
+def _refresh_people_snapshot():
+    """
+    Check the sheet for changes and replace the people snapshot if needed
+    
+    Runs on a background thread so the sheet round-trips stay off the request path.
+    """
+    global _people_snapshot, _people_refresh_thread
+    try:
+        with _people_lock:
+            snapshot = _people_snapshot
+        if snapshot is None:
+            return
+        modified_time = _read_sheet_modified_time()
+        
+        changed = modified_time is not None and modified_time != snapshot["modified_time"]
+        expired = time.monotonic() - snapshot["loaded_at"] >= PEOPLE_CACHE_MAX_AGE_SECONDS
+        
+        if changed or expired:
+            new_snapshot = _load_people_snapshot(modified_time)
+            if new_snapshot:
+                with _people_lock:
+                    _people_snapshot = new_snapshot
+                logging.info(f"Refreshed people directory (version {new_snapshot['version']})")
+                return
+        
+        with _people_lock:
+            # The snapshot may have been invalidated or replaced while we checked
+            if _people_snapshot is snapshot:
+                snapshot["checked_at"] = time.monotonic()
+                if snapshot["modified_time"] is None:
+                    snapshot["modified_time"] = modified_time
+    finally:
+        with _people_lock:
+            _people_refresh_thread = None
+
+def _load_first_people_snapshot():
+    """
+    Load the people directory when there is no snapshot yet
+    
+    One thread reads the sheet while others wait for its result, and the
+    sheet is not read under _people_lock. After a failed read, callers get
+    None straight away for PEOPLE_RETRY_SECONDS instead of each trying again.
+    """
+    global _people_snapshot, _people_failed_at
+    with _people_load_lock:
+        with _people_lock:
+            if _people_snapshot is not None:
+                return _people_snapshot
+            if _people_failed_at is not None and time.monotonic() - _people_failed_at < PEOPLE_RETRY_SECONDS:
+                return None
+        
+        new_snapshot = _load_people_snapshot(_read_sheet_modified_time())
+        
+        with _people_lock:
+            if new_snapshot is None:
+                _people_failed_at = time.monotonic()
+            else:
+                _people_failed_at = None
+                if _people_snapshot is None:
+                    _people_snapshot = new_snapshot
+            return _people_snapshot
+
+def get_people_snapshot():
+    """
+    Get the current people directory snapshot, loading it on first use
+    
+    Only the very first call waits on the sheet. Afterwards the existing
+    snapshot is returned immediately and a background refresh is started
+    when the last change check is older than PEOPLE_CHANGE_CHECK_SECONDS.
+    
+    Returns:
+        Dictionary with keys data, modified_time, loaded_at, checked_at and version,
+        or None if the directory could not be loaded
+    """
+    global _people_refresh_thread
+    
+    with _people_lock:
+        snapshot = _people_snapshot
+        if snapshot is not None:
+            stale = time.monotonic() - snapshot["checked_at"] >= PEOPLE_CHANGE_CHECK_SECONDS
+            if stale and _people_refresh_thread is None:
+                _people_refresh_thread = threading.Thread(target=_refresh_people_snapshot, daemon=True)
+                _people_refresh_thread.start()
+    
+    if snapshot is None:
+        return _load_first_people_snapshot()
+    return snapshot
+
+def seed_people_snapshot(people_data, people_by_email, relationship_levels, modified_time):
+    """
+    Install a people directory loaded from elsewhere, e.g. a context snapshot
+    
+    The usual change check replaces it once the sheet's modified time differs.
+    
+    Args:
+        people_data: Dictionary of people indexed by name
+        people_by_email: Dictionary of people indexed by email
+        relationship_levels: Dictionary mapping level to description
+        modified_time: Sheet modified time the data was read at
+    """
+    global _people_snapshot
+    now = time.monotonic()
+    with _people_lock:
+        _people_snapshot = {
+            "data": (people_data, people_by_email, relationship_levels),
+            "modified_time": modified_time,
+            "loaded_at": now,
+            "checked_at": now,
+            "version": next(_people_versions),
+        }
+
+def invalidate_people_cache():
+    """
+    Drop the people directory snapshot so the next read loads it from the sheet
+    """
+    global _people_snapshot, _people_failed_at
+    with _people_lock:
+        _people_snapshot = None
+        _people_failed_at = None
+
+def get_people_data():
+    """
+    Get the latest people information from the cached Google Sheet snapshot
+    
+    Returns:
+        Tuple containing people data dictionaries and relationship levels
+    """
+    snapshot = get_people_snapshot()
+    if snapshot is None:
         return {}, {}, {}
+    return snapshot["data"]
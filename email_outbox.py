@@ -0,0 +1,337 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+import cloud_tasks
+
+# Which outbox sends email: "local" (SQLite and worker threads in this process) or
+# "cloud_tasks" (Cloud Tasks calls back into the email_task endpoint per email).
+# Cloud Run (K_SERVICE is set) defaults to cloud_tasks: its /tmp is per-instance
+# memory, so a local outbox would lose queued emails when the instance stops, and
+# each instance's rate limiter would allow the full SES rate on its own.
+IN_CLOUD_RUN = bool(os.getenv("K_SERVICE"))
+BACKEND = os.getenv("EMAIL_OUTBOX_BACKEND", "cloud_tasks" if IN_CLOUD_RUN else "local")
+
+# Cloud Tasks queue, the email_task URL it calls and the service account whose
+# OIDC token it sends. The queue's --max-dispatches-per-second is the SES send
+# rate for all instances together (see deploy.yaml).
+TASKS_QUEUE = os.getenv("EMAIL_TASKS_QUEUE")
+TASK_URL = os.getenv("EMAIL_TASK_URL")
+TASK_SERVICE_ACCOUNT = os.getenv("EMAIL_TASK_SERVICE_ACCOUNT")
+
+# SQLite file holding queued emails until SES accepts them (local outbox)
+OUTBOX_DB_PATH = os.getenv("EMAIL_OUTBOX_DB", os.path.join(tempfile.gettempdir(), "email_outbox.sqlite3"))
+
+# Our SES maximum send rate (messages per second). Sends never burst past
+# one second's worth, which SES would throttle.
+SEND_RATE = float(os.getenv("SES_MAX_SEND_RATE", "14"))
+SEND_BURST = max(1, int(SEND_RATE))
+
+# Worker threads draining the outbox
+WORKERS = int(os.getenv("EMAIL_OUTBOX_WORKERS", "2"))
+POLL_SECONDS = 1.0
+
+# Attempts per email before it is marked failed, and the first retry delay (doubled each attempt)
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+RETRY_SECONDS = float(os.getenv("EMAIL_RETRY_SECONDS", "5"))
+
+# SES error codes worth retrying; any other SES error is permanent
+TRANSIENT_ERRORS = {
+    "Throttling", "ThrottlingException", "TooManyRequestsException",
+    "ServiceUnavailable", "InternalFailure", "RequestTimeout",
+}
+
+# Email statuses
+QUEUED = "queued"
+SENDING = "sending"
+RETRYING = "retrying"
+SENT = "sent"
+FAILED = "failed"
+
+_outbox = None
+_outbox_lock = threading.Lock()
+_limiter = None
+
+class TokenBucket:
+    """
+    Rate limiter allowing rate operations per second with bursts up to capacity
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available and take them
+
+        More tokens than the capacity are taken a capacity's worth at a time.
+        """
+        while tokens > self.capacity:
+            self.acquire(self.capacity)
+            tokens -= self.capacity
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+def get_send_limiter():
+    """
+    Get the process-wide SES rate limiter
+
+    Everything sending through SES from this process takes from it, so the
+    outbox workers and a broadcast together keep to SEND_RATE.
+    """
+    global _limiter
+    with _outbox_lock:
+        if _limiter is None:
+            _limiter = TokenBucket(SEND_RATE, SEND_BURST)
+        return _limiter
+
+def is_transient(error):
+    """
+    Check whether an SES error is worth retrying
+
+    Errors without an SES error code (timeouts, connection resets) count as transient.
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return True
+    return response.get("Error", {}).get("Code") in TRANSIENT_ERRORS
+
+class Outbox:
+    """
+    Queue of emails in SQLite, sent by background workers in this process
+
+    Emails left sending by a previous process are retried when the outbox is
+    opened. The file and the rate limit are per machine, so this is for local
+    runs; Cloud Run uses CloudTasksOutbox.
+    """
+
+    def __init__(self, deliver, path=OUTBOX_DB_PATH):
+        self.deliver = deliver
+        self.bucket = get_send_limiter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS emails ("
+                "id TEXT PRIMARY KEY, dedupe_key TEXT UNIQUE, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                "next_attempt_at REAL NOT NULL, params TEXT NOT NULL, message_id TEXT, error TEXT, "
+                "created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            self._db.execute("UPDATE emails SET status = ? WHERE status = ?", (RETRYING, SENDING))
+        self._threads = [
+            threading.Thread(target=self._work, name=f"email-outbox-{number}", daemon=True)
+            for number in range(WORKERS)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, params, dedupe_key=None):
+        """
+        Queue an email
+
+        Args:
+            params: JSON-serializable keyword arguments for the deliver callable
+            dedupe_key: Optional key; an email already queued under it is not queued again
+
+        Returns:
+            ID of the queued email (the existing one for a repeated dedupe_key)
+        """
+        email_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO emails (id, dedupe_key, status, attempts, next_attempt_at, params, created_at, updated_at) "
+                "VALUES (?, ?, ?, 0, ?, ?, ?, ?)",
+                (email_id, dedupe_key, QUEUED, time.time(), json.dumps(params), now, now)
+            )
+            if dedupe_key is not None:
+                email_id = self._db.execute("SELECT id FROM emails WHERE dedupe_key = ?", (dedupe_key,)).fetchone()[0]
+        self._wake.set()
+        return email_id
+
+    def get(self, email_id):
+        """
+        Look up a queued email
+
+        Returns:
+            Dictionary with id, status, attempts, message_id, error and timestamps, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, attempts, message_id, error, created_at, updated_at FROM emails WHERE id = ?",
+                (email_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "status", "attempts", "message_id", "error", "created_at", "updated_at"), row))
+
+    def pending(self):
+        """
+        Count emails not yet sent or failed
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM emails WHERE status IN (?, ?, ?)", (QUEUED, SENDING, RETRYING)
+            ).fetchone()[0]
+
+    def _claim(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, attempts, params FROM emails WHERE status IN (?, ?) AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (QUEUED, RETRYING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE emails SET status = ? WHERE id = ?", (SENDING, row[0]))
+        return row[0], row[1] + 1, json.loads(row[2])
+
+    def _finish(self, email_id, attempts, status, message_id=None, error=None, next_attempt_at=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE emails SET status = ?, attempts = ?, message_id = ?, error = ?, "
+                "next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ? WHERE id = ?",
+                (status, attempts, message_id, error, next_attempt_at, datetime.now().isoformat(), email_id)
+            )
+
+    def _work(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            email_id, attempts, params = claimed
+            self.bucket.acquire()
+            try:
+                response = self.deliver(**params)
+            except Exception as e:
+                if is_transient(e) and attempts < MAX_ATTEMPTS:
+                    delay = RETRY_SECONDS * 2 ** (attempts - 1)
+                    self._finish(email_id, attempts, RETRYING, error=str(e), next_attempt_at=time.time() + delay)
+                    logging.warning(f"Email {email_id} attempt {attempts} failed, retrying in {delay:g} s: {e}")
+                else:
+                    self._finish(email_id, attempts, FAILED, error=str(e))
+                    logging.error(f"Email {email_id} failed after {attempts} attempts: {e}")
+                continue
+            self._finish(email_id, attempts, SENT, message_id=response.get("MessageId"))
+            logging.info(json.dumps({
+                "metric": "email_sent",
+                "id": email_id,
+                "message_id": response.get("MessageId"),
+                "attempts": attempts,
+            }))
+
+class CloudTasksOutbox:
+    """
+    Queue of emails in Cloud Tasks, which calls the email_task endpoint to send each one
+
+    Queued emails survive the instance that queued them. The queue's dispatch
+    rate keeps all instances together to the SES send rate, and its retry
+    settings back off throttled and other transient failures.
+    """
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def enqueue(self, params, dedupe_key=None):
+        """
+        Queue an email
+
+        Args:
+            params: JSON-serializable keyword arguments for the deliver callable
+            dedupe_key: Optional key; an email already queued under it is not queued again
+
+        Returns:
+            ID of the queued email, derived from dedupe_key when one is given
+        """
+        if dedupe_key is None:
+            email_id = str(uuid.uuid4())
+        else:
+            # Task names only allow letters, digits, - and _
+            email_id = hashlib.sha256(dedupe_key.encode("utf-8")).hexdigest()[:32]
+        cloud_tasks.create_http_task(
+            TASKS_QUEUE, TASK_URL, {"id": email_id, "params": params}, TASK_SERVICE_ACCOUNT, name=f"email-{email_id}"
+        )
+        return email_id
+
+    def verify_request(self, headers):
+        """
+        Check that a call to the email_task endpoint came from our Cloud Tasks queue
+        """
+        return cloud_tasks.verify_request(headers, TASK_URL, TASK_SERVICE_ACCOUNT)
+
+    def handle(self, email_id, params, attempts):
+        """
+        Send one email on behalf of a Cloud Tasks call
+
+        Raises transient SES errors, so the endpoint returns an error and Cloud
+        Tasks retries with backoff. Permanent errors are logged and not retried.
+
+        Args:
+            email_id: ID returned by enqueue
+            params: Keyword arguments for the deliver callable
+            attempts: Number of this attempt, counting from 1
+
+        Returns:
+            Dictionary with id, status, attempts, message_id and error
+        """
+        try:
+            response = self.deliver(**params)
+        except Exception as e:
+            if is_transient(e):
+                logging.warning(f"Email {email_id} attempt {attempts} failed, Cloud Tasks will retry: {e}")
+                raise
+            logging.error(f"Email {email_id} failed after {attempts} attempts: {e}")
+            return {"id": email_id, "status": FAILED, "attempts": attempts, "message_id": None, "error": str(e)}
+        logging.info(json.dumps({
+            "metric": "email_sent",
+            "id": email_id,
+            "message_id": response.get("MessageId"),
+            "attempts": attempts,
+        }))
+        return {"id": email_id, "status": SENT, "attempts": attempts, "message_id": response.get("MessageId"), "error": None}
+
+def get_outbox(deliver):
+    """
+    Get the process-wide outbox for the configured backend, starting local workers on first use
+
+    Args:
+        deliver: Callable that sends one email, called with the queued parameters
+
+    Returns:
+        Outbox or CloudTasksOutbox
+    """
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            if BACKEND == "cloud_tasks":
+                if not TASKS_QUEUE or not TASK_URL or not TASK_SERVICE_ACCOUNT:
+                    raise ValueError(
+                        "EMAIL_TASKS_QUEUE, EMAIL_TASK_URL and EMAIL_TASK_SERVICE_ACCOUNT must be set for the cloud_tasks outbox"
+                    )
+                _outbox = CloudTasksOutbox(deliver)
+            else:
+                if IN_CLOUD_RUN:
+                    logging.error("Email outbox is local on Cloud Run; queued emails are lost when this instance stops")
+                _outbox = Outbox(deliver)
+        return _outbox
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai_client import call_openai
+
+# Per endpoint: the primary model, the faster model hedged to once the primary has
+# taken hedge_after seconds, and the deadline after which the caller falls back.
+# Override with e.g. RSVP_MODEL, RSVP_HEDGE_MODEL, RSVP_HEDGE_AFTER_SECONDS, RSVP_DEADLINE_SECONDS.
+DEFAULT_POLICIES = {
+    "rsvp": {"model": "gpt-4", "hedge_model": "gpt-4o-mini", "hedge_after": 8.0, "deadline": 20.0},
+    "questions": {"model": "gpt-4", "hedge_model": "gpt-4o-mini", "hedge_after": 4.0, "deadline": 12.0},
+}
+
+# Calls in flight at once, including hedges and calls still finishing after losing
+MAX_WORKERS = int(os.getenv("GENERATION_WORKERS", "8"))
+
+# Winning paths
+PRIMARY = "primary"
+HEDGE = "hedge"
+FALLBACK = "fallback"
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+class DeadlineExceeded(TimeoutError):
+    """
+    No model produced a good answer before the endpoint's deadline
+    """
+
+def get_policy(endpoint):
+    """
+    Get the generation policy for an endpoint, with environment overrides applied
+
+    Returns:
+        Dictionary with model, hedge_model, hedge_after and deadline (seconds).
+        An empty hedge_model turns hedging off.
+    """
+    policy = dict(DEFAULT_POLICIES[endpoint])
+    prefix = endpoint.upper()
+    policy["model"] = os.getenv(f"{prefix}_MODEL", policy["model"])
+    policy["hedge_model"] = os.getenv(f"{prefix}_HEDGE_MODEL", policy["hedge_model"])
+    policy["hedge_after"] = float(os.getenv(f"{prefix}_HEDGE_AFTER_SECONDS", policy["hedge_after"]))
+    policy["deadline"] = float(os.getenv(f"{prefix}_DEADLINE_SECONDS", policy["deadline"]))
+    return policy
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="generation")
+        return _executor
+
+def _record(endpoint, path, model, started, hedged):
+    ms = round((time.perf_counter() - started) * 1000)
+    with _stats_lock:
+        counts = _stats.setdefault(endpoint, {PRIMARY: 0, HEDGE: 0, FALLBACK: 0})
+        counts[path] += 1
+    logging.info(json.dumps({
+        "metric": "generation",
+        "endpoint": endpoint,
+        "path": path,
+        "model": model,
+        "hedged": hedged,
+        "ms": ms,
+    }))
+
+def _close_if_stream(future):
+    # A losing streamed call is closed so its connection goes back to the pool
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if callable(close):
+            close()
+
+def generate(endpoint, is_good=None, with_path=False, **params):
+    """
+    Run a chat completion under the endpoint's latency policy
+
+    The primary model is called first. If it has not answered after
+    hedge_after seconds, the hedge model is called as well and the first good
+    answer wins. For streamed calls an answer is the start of the stream.
+    DeadlineExceeded is raised if neither has a good answer by the deadline,
+    so the caller can use its fallback. The winning path is logged as a
+    generation metric and counted in get_stats().
+
+    Args:
+        endpoint: Key in DEFAULT_POLICIES, e.g. "rsvp"
+        is_good: Optional check on a response; a response failing it does not win
+        with_path: Also return which path won, PRIMARY or HEDGE
+        **params: Arguments for the chat completion, without model
+
+    Returns:
+        The winning response, or a tuple of (response, path) with with_path
+    """
+    policy = get_policy(endpoint)
+    started = time.perf_counter()
+    deadline = started + policy["deadline"]
+    executor = _get_executor()
+
+    def call(model):
+        # Each call gets what is left of the deadline. With a hedge model the
+        # hedge stands in for a retry, so calls are not retried on their own.
+        return call_openai(
+            endpoint, "chat",
+            max_retries=0 if policy["hedge_model"] else None,
+            deadline=max(0.0, deadline - time.perf_counter()),
+            model=model,
+            **params
+        )
+
+    running = {executor.submit(call, policy["model"]): PRIMARY}
+    hedge_at = started + policy["hedge_after"] if policy["hedge_model"] else None
+    errors = []
+
+    while running:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        until = deadline if hedge_at is None else min(deadline, hedge_at)
+        done, _ = wait(running, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            path = running.pop(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                errors.append(f"{path}: {e}")
+                continue
+            if is_good is not None and not is_good(response):
+                errors.append(f"{path}: unusable response")
+                continue
+            for other in running:
+                other.add_done_callback(_close_if_stream)
+            model = policy["model"] if path == PRIMARY else policy["hedge_model"]
+            _record(endpoint, path, model, started, hedge_at is None and bool(policy["hedge_model"]))
+            return (response, path) if with_path else response
+
+        # Hedge once the primary is slow, or straight away if it already failed
+        if hedge_at is not None and (time.perf_counter() >= hedge_at or not running):
+            running[executor.submit(call, policy["hedge_model"])] = HEDGE
+            hedge_at = None
+
+    for other in running:
+        other.add_done_callback(_close_if_stream)
+    _record(endpoint, FALLBACK, None, started, hedge_at is None and bool(policy["hedge_model"]))
+    reason = "; ".join(errors) or f"no answer within {policy['deadline']:g} s"
+    raise DeadlineExceeded(f"{endpoint} generation failed: {reason}")
+
+def get_stats():
+    """
+    Get how often each path won, per endpoint
+
+    Returns:
+        Dictionary mapping endpoint to primary, hedge and fallback counts
+    """
+    with _stats_lock:
+        return {endpoint: dict(counts) for endpoint, counts in _stats.items()}
@@ -1,101 +1,159 @@
 import json
 import os
+import sys
 import logging
-from googleapiclient.discovery import build
-from google.auth import default
+from google_services import get_sheets_service, get_drive_service
+
+SPREADSHEET_ID = '1Hg5d-wXrxdsf9FgtH3h6Bq86w_ipr1akv_E_KbLFdYE'  # From the URL of your sheet
+
+def get_sheet_modified_time():
+    """Gets the last modified time of the people spreadsheet from Drive metadata
+    
+    Returns:
+        str: RFC 3339 modified time of the spreadsheet
+    """
+    metadata = get_drive_service().files().get(fileId=SPREADSHEET_ID, fields='modifiedTime').execute()
+    return metadata.get('modifiedTime')
+
+# Sheet layout: name, email, nickname, they call me, relationship, relationship level
+SHEET_NAME = 'Emails'
+FIRST_DATA_ROW = 2
+PAGE_SIZE = 1000  # Rows read per Sheets API call
+
+# Define relationship levels
+RELATIONSHIP_LEVELS = {
+    "1": "very good close friend i see often",
+    "2": "family, very close",
+    "3": "very good close friend i don't see very often",
+    "4": "good friend mostly connected through my softabll team",
+    "5": "friend through sullstice - mostly just see them there",
+    "6": "good friend but we haven't really stayed in touch",
+    "7": "friend - but more a friend of friends",
+    "8": "family, less close",
+    "9": "acquaintence, have only met a few times",
+    "10": "never met"
+}
+
+class Person:
+    """Compact record for one row of the people sheet
+    
+    Uses __slots__ instead of a per-person dict. Item access (person['name'])
+    is supported so records can be used wherever person dicts were before.
+    """
+    __slots__ = ('name', 'email', 'nickname', 'they_call_me', 'relationship', 'relationship_level')
+    
+    def __init__(self, name, email, nickname, they_call_me, relationship, relationship_level):
+        self.name = name
+        self.email = email
+        self.nickname = nickname
+        self.they_call_me = they_call_me
+        self.relationship = relationship
+        self.relationship_level = relationship_level
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self):
+        return {field: getattr(self, field) for field in Person.__slots__}
+    
+    def __repr__(self):
+        return f"Person({self.name!r}, {self.email!r})"
+
+def iter_sheet_rows(service):
+    """Reads every data row of the people sheet, one page at a time
+    
+    Args:
+        service: Google Sheets API service
+        
+    Yields:
+        list: Row values, padded to six columns
+    """
+    start = FIRST_DATA_ROW
+    while True:
+        end = start + PAGE_SIZE - 1
+        result = service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"{SHEET_NAME}!A{start}:F{end}",
+        ).execute()
+        rows = result.get('values', [])
+        
+        for row in rows:
+            # Pad any missing columns
+            yield row + [''] * (6 - len(row))
+        
+        # Trailing empty rows are not returned, so a short page is the last one
+        if len(rows) < PAGE_SIZE:
+            return
+        start = end + 1
 
 def get_people_from_sheet():
     """Gets people data directly from a Google Sheet
     
+    Reads the whole sheet with no row cap. People are stored once as Person
+    records; the name and email indexes both point at the same records.
+    
     Returns:
         tuple: (people_data, people_by_email, relationship_levels) - Dictionaries with people's details 
                indexed by name and email, and relationship level definitions
     """
-    
-    # Configure the connection
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-    SPREADSHEET_ID = '1Hg5d-wXrxdsf9FgtH3h6Bq86w_ipr1akv_E_KbLFdYE'  # From the URL of your sheet
-    RANGE_NAME = 'Emails!A2:F500'  # Adjust based on your data layout
-    
     try:
-        # Use default credentials from environment
-        logging.info("Sheet access: Using default credentials")
-        credentials, project = default(scopes=SCOPES)
-        logging.info(f"Using default GCP credentials for project: {project}")
+        # Use the shared service built from default credentials
+        service = get_sheets_service()
     except Exception as e:
         logging.error(f"Error with authentication: {e}")
         return {}, {}, {}
     
-    # Build the service with the appropriate credentials
-    service = build('sheets', 'v4', credentials=credentials)
+    # Process people data into dictionaries
+    people_data = {}
+    people_by_email = {}
+    people_count = 0
+    row_count = 0
     
-    # Test access to the API
     try:
-        metadata = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-        logging.info(f"Successfully connected to spreadsheet: {metadata.get('properties', {}).get('title')}")
+        for row in iter_sheet_rows(service):
+            row_count += 1
+            name, email, nickname, they_call_me, relationship, rel_level = (value.strip() for value in row[:6])
+            
+            # Skip rows where name is blank
+            if not name:
+                continue
+            
+            # Relationship text and levels repeat across many rows, so share one copy of each
+            person_info = Person(
+                name=name,
+                email=email,
+                nickname=nickname,
+                they_call_me=sys.intern(they_call_me),
+                relationship=sys.intern(relationship),
+                relationship_level=sys.intern(rel_level) if rel_level.isdigit() else '10'
+            )
+            
+            # Index by name (case insensitive)
+            people_data[name.lower()] = person_info
+            
+            # Also index by email for lookup
+            if email:
+                people_by_email[email.lower()] = person_info
+            
+            people_count += 1
     except Exception as e:
         logging.error(f"API access error: {str(e)}")
         return {}, {}, {}
-
-    # Call the Sheets API
-    sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME).execute()
-    rows = result.get('values', [])
     
-    if not rows:
+    if not people_count:
         logging.info('No data found.')
         return {}, {}, {}
     
-    # Define relationship levels
-    relationship_levels = {
-        "1": "very good close friend i see often",
-        "2": "family, very close",
-        "3": "very good close friend i don't see very often",
-        "4": "good friend mostly connected through my softabll team",
-        "5": "friend through sullstice - mostly just see them there",
-        "6": "good friend but we haven't really stayed in touch",
-        "7": "friend - but more a friend of friends",
-        "8": "family, less close",
-        "9": "acquaintence, have only met a few times",
-        "10": "never met"
-    }
-    
-    # Process people data into dictionaries
-    people_data = {}
-    people_by_email = {}
-    people_count = 0
-    
-    for row in rows:
-        # Pad any missing columns
-        padded_row = row + [''] * (6 - len(row))
-        name, email, nickname, they_call_me, relationship, rel_level = padded_row[:6]
-        
-        # Skip rows where name is blank
-        if not name.strip():
-            continue
-            
-        person_info = {
-            'name': name.strip(),
-            'email': email.strip(),
-            'nickname': nickname.strip(),
-            'they_call_me': they_call_me.strip(),
-            'relationship': relationship.strip(),
-            'relationship_level': rel_level.strip() if rel_level.strip().isdigit() else '10'
-        }
-        
-        # Index by name (case insensitive)
-        people_data[name.strip().lower()] = person_info
-        
-        # Also index by email for lookup
-        if email.strip():
-            people_by_email[email.strip().lower()] = person_info
-        
-        people_count += 1
-    
-    logging.info(f"Retrieved {len(rows)} total rows and added {people_count} people entries from Google Sheets")
+    logging.info(f"Retrieved {row_count} total rows and added {people_count} people entries from Google Sheets")
     
     # Return the dictionaries of people data and relationship levels
-    return people_data, people_by_email, relationship_levels
+    return people_data, people_by_email, RELATIONSHIP_LEVELS
 
 # For testing locally
 if __name__ == "__main__":
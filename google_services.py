@@ -0,0 +1,125 @@
+import logging
+import threading
+
+DOCS_SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
+SHEETS_SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+DRIVE_METADATA_SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
+
+# Process-wide caches of credentials and service objects, keyed by scopes and API
+_credentials = {}
+_services = {}
+_lock = threading.Lock()
+
+# httplib2.Http is not thread-safe, so every thread gets its own connection
+_thread_local = threading.local()
+
+def get_credentials(scopes):
+    """
+    Get default Google credentials for the given scopes, discovered once per process
+
+    The credentials are refreshed only when they are missing a token or have expired.
+
+    Args:
+        scopes: List of OAuth scopes
+
+    Returns:
+        google.auth credentials object
+    """
+    from google.auth import default
+    from google.auth.transport.requests import Request
+    
+    key = tuple(sorted(scopes))
+    with _lock:
+        credentials = _credentials.get(key)
+        if credentials is None:
+            credentials, project = default(scopes=list(key))
+            logging.info(f"Using default GCP credentials for project: {project}")
+            _credentials[key] = credentials
+        if not credentials.valid:
+            credentials.refresh(Request())
+    return credentials
+
+def _get_thread_http(credentials):
+    """
+    Get the calling thread's authorized HTTP connection for a set of credentials
+
+    Args:
+        credentials: google.auth credentials object
+
+    Returns:
+        google_auth_httplib2.AuthorizedHttp object
+    """
+    import google_auth_httplib2
+    import httplib2
+    
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+    http = connections.get(id(credentials))
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        connections[id(credentials)] = http
+    return http
+
+def get_service(api_name, api_version, scopes):
+    """
+    Get a cached Google API service object, building it on first use
+
+    Services are built from the discovery documents bundled with
+    google-api-python-client, so no discovery request goes over the network.
+    The service is safe to share between threads: each request it builds runs
+    on the calling thread's own authorized connection.
+
+    Args:
+        api_name: Name of the API, e.g. 'docs'
+        api_version: Version of the API, e.g. 'v1'
+        scopes: List of OAuth scopes
+
+    Returns:
+        Google API service object
+    """
+    key = (api_name, api_version, tuple(sorted(scopes)))
+    with _lock:
+        service = _services.get(key)
+    if service is not None:
+        return service
+
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    credentials = get_credentials(scopes)
+
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(_get_thread_http(credentials), *args, **kwargs)
+
+    service = build(
+        api_name,
+        api_version,
+        http=_get_thread_http(credentials),
+        requestBuilder=request_builder,
+        static_discovery=True,
+        cache_discovery=False,
+    )
+    with _lock:
+        # Another thread may have built the same service meanwhile; keep the first one
+        service = _services.setdefault(key, service)
+    logging.info(f"Built Google API service {api_name} {api_version}")
+    return service
+
+def get_docs_service():
+    """
+    Get the shared Google Docs API service
+    """
+    return get_service('docs', 'v1', DOCS_SCOPES)
+
+def get_sheets_service():
+    """
+    Get the shared Google Sheets API service
+    """
+    return get_service('sheets', 'v4', SHEETS_SCOPES)
+
+def get_drive_service():
+    """
+    Get the shared Google Drive API service (metadata only)
+    """
+    return get_service('drive', 'v3', DRIVE_METADATA_SCOPES)
@@ -31,7 +31,8 @@ def parse_document_content(doc_content):
             level = len(header_match.group(1))
             heading = header_match.group(2).strip()
             current_section = heading
-            sections[current_section] = []
+            # A repeated heading continues its earlier section instead of replacing it
+            sections.setdefault(current_section, [])
         else:
             sections[current_section].append(line)
     
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+
+class LocalBigQueryClient:
+    """
+    Stand-in for the BigQuery client's streaming inserts, for running offline
+
+    Rows are appended to one NDJSON file per table under a directory. Like
+    BigQuery, a row whose row ID was already inserted is dropped. Set
+    unavailable to True to make inserts raise, as if BigQuery were down, or
+    reject_next to make that many rows fail as invalid. As in BigQuery, a
+    call with an invalid row writes nothing, and its other rows are reported
+    as stopped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.unavailable = False
+        self.reject_next = 0
+        self._lock = threading.Lock()
+        self._row_ids = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, table):
+        return os.path.join(self.directory, f"{table}.ndjson")
+
+    def _known_row_ids(self, table):
+        if table not in self._row_ids:
+            self._row_ids[table] = {entry["row_id"] for entry in self._read(table) if entry.get("row_id")}
+        return self._row_ids[table]
+
+    def _read(self, table):
+        try:
+            with open(self._path(table), "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def insert_rows_json(self, table, json_rows, row_ids=None):
+        """
+        Append rows to a table
+
+        Args:
+            table: Table ID such as "guests.rsvp"
+            json_rows: List of row dictionaries
+            row_ids: Optional list of IDs used to drop duplicate rows
+
+        Returns:
+            List of per-row errors shaped like BigQuery's, empty on success
+        """
+        if self.unavailable:
+            raise ConnectionError("Local BigQuery stand-in is unavailable")
+        table = str(table)
+        row_ids = row_ids or [None] * len(json_rows)
+        with self._lock:
+            if self.reject_next > 0:
+                invalid = min(self.reject_next, len(json_rows))
+                self.reject_next -= invalid
+                return [
+                    {"index": index, "errors": [
+                        {"reason": "invalid", "message": "no such field: bogus."} if index < invalid
+                        else {"reason": "stopped", "message": ""}
+                    ]}
+                    for index in range(len(json_rows))
+                ]
+            known = self._known_row_ids(table)
+            with open(self._path(table), "a", encoding="utf-8") as f:
+                for row, row_id in zip(json_rows, row_ids):
+                    if row_id is not None:
+                        if row_id in known:
+                            continue
+                        known.add(row_id)
+                    f.write(json.dumps({"row_id": row_id, "row": row}) + "\n")
+        return []
+
+    def list_rows(self, table):
+        """
+        Read back every row inserted into a table
+
+        Returns:
+            List of row dictionaries in insertion order
+        """
+        with self._lock:
+            return [entry["row"] for entry in self._read(str(table))]
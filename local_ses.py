@@ -0,0 +1,104 @@
+import json
+import os
+import re
+import threading
+import uuid
+
+class LocalSESError(Exception):
+    """
+    Error shaped like botocore's ClientError, with the SES error code in response
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+class LocalSESClient:
+    """
+    Stand-in for the SES client, for running offline
+
+    Sent messages are appended to sent.ndjson under a directory and get a
+    random MessageId. Templates are kept in memory and rendered like SES
+    does, replacing {{field}} with the template data. Set throttle_next to
+    make that many sends fail with SES's Throttling error, or reject_next to
+    make them fail with MessageRejected.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.throttle_next = 0
+        self.reject_next = 0
+        self.templates = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _record(self, message):
+        with self._lock:
+            if self.throttle_next > 0:
+                self.throttle_next -= 1
+                raise LocalSESError("Throttling", "Maximum sending rate exceeded.")
+            if self.reject_next > 0:
+                self.reject_next -= 1
+                raise LocalSESError("MessageRejected", "Email address is not verified.")
+            message["MessageId"] = f"local-{uuid.uuid4()}"
+            with open(os.path.join(self.directory, "sent.ndjson"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(message) + "\n")
+            return message["MessageId"]
+
+    def send_email(self, **params):
+        return {"MessageId": self._record(dict(params))}
+
+    def create_template(self, Template):
+        with self._lock:
+            if Template["TemplateName"] in self.templates:
+                raise LocalSESError("AlreadyExists", f"Template {Template['TemplateName']} already exists.")
+            self.templates[Template["TemplateName"]] = dict(Template)
+        return {}
+
+    def update_template(self, Template):
+        with self._lock:
+            if Template["TemplateName"] not in self.templates:
+                raise LocalSESError("TemplateDoesNotExist", f"Template {Template['TemplateName']} does not exist.")
+            self.templates[Template["TemplateName"]] = dict(Template)
+        return {}
+
+    def send_bulk_templated_email(self, Source, Template, Destinations, DefaultTemplateData="{}", **params):
+        if len(Destinations) > 50:
+            raise LocalSESError("InvalidParameterValue", "Too many destinations: at most 50 per call.")
+        template = self.templates.get(Template)
+        if template is None:
+            raise LocalSESError("TemplateDoesNotExist", f"Template {Template} does not exist.")
+        status = []
+        for destination in Destinations:
+            data = dict(json.loads(DefaultTemplateData), **json.loads(destination.get("ReplacementTemplateData", "{}")))
+            render = lambda text: re.sub(r"{{\s*(\w+)\s*}}", lambda match: str(data.get(match.group(1), "")), text or "")
+            try:
+                message_id = self._record({
+                    "Source": Source,
+                    "Destination": destination["Destination"],
+                    "Message": {
+                        "Subject": {"Data": render(template.get("SubjectPart"))},
+                        "Body": {"Text": {"Data": render(template.get("TextPart"))}},
+                    },
+                    **params,
+                })
+                status.append({"Status": "Success", "MessageId": message_id})
+            except LocalSESError as e:
+                # Bulk sends report throttling per destination as AccountThrottled
+                code = e.response["Error"]["Code"]
+                status.append({"Status": "AccountThrottled" if code == "Throttling" else code, "Error": e.response["Error"]["Message"]})
+        return {"Status": status}
+
+    def list_sent(self):
+        """
+        Read back every message sent through the stand-in
+
+        Returns:
+            List of the send parameters, each with its MessageId
+        """
+        with self._lock:
+            try:
+                with open(os.path.join(self.directory, "sent.ndjson"), "r", encoding="utf-8") as f:
+                    return [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                return []
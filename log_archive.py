@@ -0,0 +1,135 @@
+import datetime
+import gzip
+import io
+import json
+import uuid
+
+# Request logs are stored as gzip-compressed NDJSON segments under UTC hour prefixes:
+#   request_logs/YYYY/MM/DD/HH/segment_<YYYYMMDDTHHMMSSffffff>_<id>.ndjson.gz
+FOLDER_NAME = "request_logs"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+def hour_prefix(moment):
+    """
+    Get the object prefix for all segments started in a given hour
+
+    Args:
+        moment: datetime within the hour
+
+    Returns:
+        String prefix ending in a slash
+    """
+    return f"{FOLDER_NAME}/{moment:%Y/%m/%d/%H}/"
+
+def day_prefix(day):
+    """
+    Get the object prefix for all segments started on a given day
+
+    Args:
+        day: date or datetime
+
+    Returns:
+        String prefix ending in a slash
+    """
+    return f"{FOLDER_NAME}/{day:%Y/%m/%d}/"
+
+def segment_name(started_at):
+    """
+    Build a unique object name for a new segment
+
+    Args:
+        started_at: UTC datetime of the first record in the segment
+
+    Returns:
+        String object name
+    """
+    return f"{hour_prefix(started_at)}segment_{started_at:%Y%m%dT%H%M%S%f}_{str(uuid.uuid4())[:8]}{SEGMENT_SUFFIX}"
+
+def encode_segment(records):
+    """
+    Encode records as a gzip-compressed NDJSON segment
+
+    Args:
+        records: Iterable of JSON-serializable dictionaries
+
+    Returns:
+        Bytes of the compressed segment
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        for record in records:
+            gz.write(json.dumps(record, default=str).encode("utf-8") + b"\n")
+    return buffer.getvalue()
+
+def read_segment(fileobj):
+    """
+    Stream records out of a gzip-compressed NDJSON segment
+
+    Args:
+        fileobj: Binary file object positioned at the start of the segment
+
+    Yields:
+        Record dictionaries in the order they were written
+    """
+    with gzip.GzipFile(fileobj=fileobj, mode="rb") as gz:
+        for line in gz:
+            if line.strip():
+                yield json.loads(line)
+
+def list_segments(bucket, prefix):
+    """
+    List segment blobs under a prefix in name (and therefore time) order
+
+    Args:
+        bucket: google.cloud.storage Bucket
+        prefix: Object prefix, e.g. from day_prefix or hour_prefix
+
+    Returns:
+        List of Blob objects
+    """
+    blobs = [blob for blob in bucket.list_blobs(prefix=prefix) if blob.name.endswith(SEGMENT_SUFFIX)]
+    return sorted(blobs, key=lambda blob: blob.name.rsplit("/", 1)[-1])
+
+def iter_records(bucket, prefix, record_type=None):
+    """
+    Stream all records from the segments under a prefix
+
+    Each segment is read with a single streaming GET.
+
+    Args:
+        bucket: google.cloud.storage Bucket
+        prefix: Object prefix, e.g. from day_prefix or hour_prefix
+        record_type: Only yield records of this type ("request" or "response")
+
+    Yields:
+        Record dictionaries
+    """
+    for blob in list_segments(bucket, prefix):
+        with blob.open("rb") as fileobj:
+            for record in read_segment(fileobj):
+                if record_type is None or record.get("type") == record_type:
+                    yield record
+
+def iter_day(bucket, day, record_type=None):
+    """
+    Stream all records logged on a given day
+
+    Args:
+        bucket: google.cloud.storage Bucket
+        day: UTC date or datetime
+        record_type: Only yield records of this type ("request" or "response")
+
+    Yields:
+        Record dictionaries
+    """
+    return iter_records(bucket, day_prefix(day), record_type)
+
+# For reading archives locally, e.g. python log_archive.py 2025-06-21
+if __name__ == "__main__":
+    import sys
+    from google.cloud import storage
+
+    day = datetime.date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else datetime.datetime.now(datetime.timezone.utc).date()
+    bucket = storage.Client().bucket("sullstice")
+    for record in iter_day(bucket, day):
+        print(json.dumps(record))
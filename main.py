@@ -1,17 +1,37 @@
+import time
+_import_started = time.perf_counter()
+
 import functions_framework
 from flask import Response
-from google.cloud import storage
 from flask import Response, Flask, request
 from flask_cors import CORS
 import json
 import datetime
 import uuid
 import logging
-from sullstice_ai import answer_question  # Import the answer_question function
+import os
+import request_logger
+import warmup
+import context_snapshot
 
 app = Flask(__name__)
 CORS(app)
 
+# Serve documents and people from the deploy-time snapshot until the live sources change
+if os.getenv("SULLSTICE_SNAPSHOT") != "False":
+    context_snapshot.load_snapshot()
+
+# Pre-populate caches and clients in the background while the instance starts
+if warmup.WARMUP_ENABLED:
+    warmup.start_warmup()
+
+# Endpoints that generate with OpenAI from the event documents and people directory
+WARMUP_FUNCTIONS = {"rsvp_task", "questions"}
+
+# Credentials never written to the request log; rsvp_task and email_task receive
+# Cloud Tasks' OIDC bearer token, which could be replayed until it expires
+REDACTED_HEADERS = {"authorization", "proxy-authorization", "x-serverless-authorization", "cookie"}
+
 def add_cors_headers(response, origin='*'):
     """
     Add CORS headers to a Flask response object
@@ -34,21 +54,10 @@ def hello_http(request):
     # Get the origin from request headers
     origin = request.headers.get('Origin', '*')
 
-    # Get a reference to the GCS bucket and folder
-    bucket_name = "sullstice"  # Replace with your bucket name
-    folder_name = "requests"
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-
-    # Generate a timestamp for the filename
+    # Generate a timestamp and ID shared by the request and response log records
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     short_uuid = str(uuid.uuid4())[:8]
-
-    # Create a filename with the timestamp
-    filename = f"request_{timestamp}_{short_uuid}.json"
-
-    # Construct the full path within the bucket
-    blob = bucket.blob(f"{folder_name}/{filename}")
+    request_id = f"{timestamp}_{short_uuid}"
 
     # Extract the function name from the request URL, ignoring query parameters
     path_without_params = request.path.split('?')[0]
@@ -57,17 +66,23 @@ def hello_http(request):
     # Define a dictionary mapping function names to modules
     functions = {
         "rsvp": "rsvp.main",  # Module name and function name
+        "rsvp_status": "rsvp.status",  # Processing status of a queued RSVP
+        "rsvp_task": "rsvp.run_task",  # Called by Cloud Tasks to process a queued RSVP
+        "email_task": "aws_email.run_task",  # Called by Cloud Tasks to send a queued email
         "questions": "questions.main",  # Updated to use questions.py main function
         "updated_event_details_html": "updated_details.main"  # New endpoint for updated event details HTML
     }
 
-    # Log the request details to the GCS bucket as early as possible
+    # Queue the request details for the background GCS writer as early as possible
     try:
         # Create a dictionary to hold the request data
         request_data = {
             "method": request.method,
             "path": request.path,
-            "headers": dict(request.headers),
+            "headers": {
+                name: "[redacted]" if name.lower() in REDACTED_HEADERS else value
+                for name, value in request.headers.items()
+            },
             "query_parameters": dict(request.args.to_dict()),
             "timestamp": timestamp
         }
@@ -76,14 +91,15 @@ def hello_http(request):
         if request.method == 'POST':
             request_data["json"] = request.get_json()
 
-        # Save the request data to the GCS bucket
-        blob.upload_from_string(
-            data=json.dumps(request_data),
-            content_type='application/json'
-        )
+        request_logger.log_record("request", request_id, request_data)
     except Exception as e:
-        # Log an error if saving the request fails
-        logging.error(f"Failed to log request to GCS: {str(e)}")
+        # Log an error if building the request record fails
+        logging.error(f"Failed to log request: {str(e)}")
+
+    # Requests that need the warmed documents, people and OpenAI client share the
+    # in-flight warm-up instead of repeating it; the other endpoints never wait on it
+    if function_name in WARMUP_FUNCTIONS:
+        warmup.wait_for_warmup()
 
     # Proceed with the rest of the function
     try:
@@ -115,14 +131,12 @@ def hello_http(request):
                 function = getattr(imported_module, function_name)
                 response = function(request)
 
-                folder_name = "responses"
-                try:
-                    filename = f"response_{timestamp}_{short_uuid}.json"
-                    blob = bucket.blob(f"{folder_name}/{filename}")
-                    blob.upload_from_string(json.dumps(response, indent=2))
-                except Exception as e:
-                    error_response = Response(json.dumps({"error": str(e)}), status=500, mimetype='application/json')
-                    return add_cors_headers(error_response, origin)
+                # Streamed responses are passed through as they are generated
+                if isinstance(response, Response):
+                    request_logger.log_record("response", request_id, {"streamed": True, "mimetype": response.mimetype})
+                    return add_cors_headers(response, origin)
+
+                request_logger.log_record("response", request_id, response)
 
                 json_response = Response(json.dumps(response), status=200, mimetype='application/json')
                 return add_cors_headers(json_response, origin)
@@ -131,4 +145,6 @@ def hello_http(request):
                 return add_cors_headers(error_response, origin)
     except Exception as e:
         error_response = Response(json.dumps({"error": str(e)}), status=500, mimetype='application/json')
-        return add_cors_headers(error_response, origin)
\ No newline at end of file
+        return add_cors_headers(error_response, origin)
+
+logging.info(f"main imported in {(time.perf_counter() - _import_started) * 1000:.0f} ms")
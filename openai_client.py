@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from clients import get_client
+
+# Seconds to open a connection and to wait for data on it
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+
+# Retries on 429 and 5xx responses, with jittered exponential backoff from RETRY_SECONDS
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+RETRY_SECONDS = float(os.getenv("OPENAI_RETRY_SECONDS", "0.5"))
+MAX_RETRY_SECONDS = 8.0
+
+# Pooled connections kept open to the API
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+_stats = {"calls": 0, "retries": 0, "errors": 0, "total_ms": 0}
+_stats_lock = threading.Lock()
+
+def _count(**amounts):
+    with _stats_lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+def _create_client():
+    import httpx
+    import openai
+    timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    return openai.OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        timeout=timeout,
+        # Retries are done here, so they can be jittered and recorded
+        max_retries=0,
+        http_client=httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        ),
+    )
+
+def get_openai_client():
+    """
+    Get the process-wide OpenAI client, whose connections are kept alive between calls
+    """
+    return get_client("openai", _create_client)
+
+def _retry_delay(error, attempt):
+    """
+    Pick how long to wait before retrying, or None if the error is not retryable
+    """
+    status = getattr(error, "status_code", None)
+    if status is None or (status != 429 and status < 500):
+        return None
+    # Full jitter, but never sooner than the server asked for
+    delay = random.uniform(0, min(MAX_RETRY_SECONDS, RETRY_SECONDS * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        delay = max(delay, min(MAX_RETRY_SECONDS, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+def call_openai(endpoint, operation, max_retries=None, deadline=None, **params):
+    """
+    Call the OpenAI API on the shared client, retrying 429 and 5xx responses
+
+    Each call is logged as an openai_call metric with its latency and
+    attempts. For streamed completions the latency is the time until the
+    stream starts.
+
+    Args:
+        endpoint: Name of the calling endpoint, e.g. "rsvp" or "questions"
+        operation: "chat" for chat completions or "embeddings"
+        max_retries: Retries allowed, defaults to MAX_RETRIES; 0 makes a single attempt
+        deadline: Optional seconds the whole call, retries included, may take.
+            Each attempt's timeout is the time left, and no retry starts that
+            could not finish in time.
+        **params: Arguments for the API call
+
+    Returns:
+        The API response (or stream)
+    """
+    client = get_openai_client()
+    create = client.chat.completions.create if operation == "chat" else client.embeddings.create
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    started = time.perf_counter()
+    ends_at = None if deadline is None else started + deadline
+    attempt = 0
+    while True:
+        if ends_at is not None:
+            params["timeout"] = max(0.001, ends_at - time.perf_counter())
+        try:
+            response = create(**params)
+            status = "ok"
+            break
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            # A retry that would start after the deadline is not worth making
+            if delay is not None and ends_at is not None and time.perf_counter() + delay >= ends_at:
+                delay = None
+            if delay is None or attempt >= max_retries:
+                status = type(e).__name__
+                _log_call(endpoint, operation, params.get("model"), started, attempt + 1, status)
+                raise
+            attempt += 1
+            _count(retries=1)
+            logging.warning(f"OpenAI {operation} call failed ({e}), retry {attempt} in {delay:.2f} s")
+            time.sleep(delay)
+    _log_call(endpoint, operation, params.get("model"), started, attempt + 1, status)
+    return response
+
+def _log_call(endpoint, operation, model, started, attempts, status):
+    ms = round((time.perf_counter() - started) * 1000)
+    _count(calls=1, total_ms=ms, errors=0 if status == "ok" else 1)
+    logging.info(json.dumps({
+        "metric": "openai_call",
+        "endpoint": endpoint,
+        "operation": operation,
+        "model": model,
+        "ms": ms,
+        "attempts": attempts,
+        "status": status,
+    }))
+
+def get_stats():
+    """
+    Get counters for OpenAI calls
+
+    Returns:
+        Dictionary with calls, retries, errors, total_ms and average_ms
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["average_ms"] = round(stats["total_ms"] / stats["calls"]) if stats["calls"] else 0
+    return stats
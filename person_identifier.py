@@ -1,6 +1,377 @@
-from data_loader import get_people_data
+import threading
+from collections import Counter
+from functools import lru_cache
+from data_loader import get_people_snapshot
 
-def identify_person(name_or_email, people_data, people_by_email):
+# Minimum score (0-1) for a fuzzy match to count as the same person
+MATCH_THRESHOLD = 0.85
+
+# Minimum similarity for each word of a name to match a word of the person's name on
+# its own, so relatives sharing a surname are not matched for each other
+TOKEN_MATCH_THRESHOLD = 0.8
+
+# How many n-gram candidates are ranked by edit distance
+MAX_CANDIDATES = 10
+
+# Index for the current people snapshot, rebuilt when a different snapshot is passed in
+_index_cache = {"snapshot": None, "index": None}
+_index_lock = threading.Lock()
+
+def _ngrams(token, n=3):
+    """
+    Get padded character n-grams of a token
+    
+    Args:
+        token: Lowercase string without spaces
+        n: Length of each n-gram
+        
+    Returns:
+        Set of n-gram strings
+    """
+    padded = " " * (n - 1) + token + " "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+def _edit_distance(a, b):
+    """
+    Compute the edit distance between two strings, counting a swap of two
+    adjacent characters (a common typo, "Micheal") as one edit
+    
+    Args:
+        a: First string
+        b: Second string
+        
+    Returns:
+        Integer number of single-character edits and adjacent swaps
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], before[j - 2] + 1)
+        before, previous = previous, current
+    return previous[-1]
+
+def _similarity(a, b, floor=0.0):
+    """
+    Normalized edit-distance similarity between two strings (1.0 is identical)
+    
+    Returns 0.0 without computing the distance when the length difference
+    alone rules out reaching the given floor.
+    """
+    if not a or not b:
+        return 0.0
+    longest = max(len(a), len(b))
+    if 1.0 - abs(len(a) - len(b)) / longest <= floor:
+        return 0.0
+    return 1.0 - _edit_distance(a, b) / longest
+
+def _person_keys(person_info):
+    """
+    Get the lowercase strings a person can be matched by
+    
+    Args:
+        person_info: Dictionary with person's info
+        
+    Returns:
+        Tuple of (whole keys, individual tokens)
+    """
+    name = person_info['name'].lower()
+    nickname = person_info['nickname'].lower()
+    email_local = person_info['email'].lower().split('@')[0]
+    
+    keys = [key for key in (name, nickname, email_local) if key]
+    tokens = set(name.split()) | set(nickname.split())
+    return keys, tokens
+
+def format_person_block(personalization):
+    """
+    Format the relationship block for the person who submitted the RSVP
+    
+    Args:
+        personalization: Dictionary with main person's data
+        
+    Returns:
+        String containing the relationship block
+    """
+    return f"""
+Relationship with {personalization['name']}:
+- They call me: {personalization['they_call_me']}
+- Nickname or how I refer to them: {personalization['nickname']}
+- Our relationship: {personalization['relationship']}
+- Relationship level (1-10 where 1 is closest): {personalization['relationship_level']}
+"""
+
+def format_guest_line(guest):
+    """
+    Format the relationship line for one guest
+    
+    Args:
+        guest: Dictionary with guest's data
+        
+    Returns:
+        String containing the guest line
+    """
+    return f"- {guest['name']} (nickname: {guest['nickname']}): {guest['relationship']}, level {guest['relationship_level']}\n"
+
+@lru_cache(maxsize=8)
+def _relationship_levels_text(relationship_levels_items):
+    return "\n".join([f"{level} = {description}" for level, description in relationship_levels_items])
+
+def format_relationship_levels(relationship_levels):
+    """
+    Format the relationship level descriptions, computed once per distinct set of levels
+    
+    Args:
+        relationship_levels: Dictionary mapping level to description
+        
+    Returns:
+        String with one "level = description" line per level
+    """
+    return _relationship_levels_text(tuple(relationship_levels.items()))
+
+def _build_profile(person_info):
+    """
+    Precompute the prompt fragments for a person in the directory
+    
+    Args:
+        person_info: Person record from the people sheet
+        
+    Returns:
+        Dictionary with the person's personalization and guest dictionaries,
+        each carrying its formatted prompt block or line
+    """
+    nickname = person_info['nickname'] if person_info['nickname'] else person_info['name'].split()[0]
+    personalization = {
+        'name': person_info['name'],
+        'nickname': nickname,
+        'they_call_me': person_info['they_call_me'] if person_info['they_call_me'] else 'Andrew',
+        'relationship': person_info['relationship'],
+        'relationship_level': person_info['relationship_level']
+    }
+    personalization['context_block'] = format_person_block(personalization)
+    
+    guest = {
+        'name': person_info['name'],
+        'nickname': nickname,
+        'relationship': person_info['relationship'],
+        'relationship_level': person_info['relationship_level']
+    }
+    guest['guest_line'] = format_guest_line(guest)
+    
+    return {"personalization": personalization, "guest": guest}
+
+def build_person_index(people_data, people_by_email):
+    """
+    Build a fuzzy lookup index over names, nicknames and emails
+    
+    Args:
+        people_data: Dictionary of people indexed by name
+        people_by_email: Dictionary of people indexed by email
+        
+    Returns:
+        Dictionary with the indexed people, their match keys, precomputed
+        prompt profiles and n-gram postings
+    """
+    people = list(people_data.values())
+    positions = {id(person_info): position for position, person_info in enumerate(people)}
+    keys = []
+    profiles = []
+    postings = {}
+    for position, person_info in enumerate(people):
+        profiles.append(_build_profile(person_info))
+        person_keys, person_tokens = _person_keys(person_info)
+        keys.append((person_keys, person_tokens))
+        grams = set()
+        for token in person_tokens.union(*(key.replace('.', ' ').split() for key in person_keys)):
+            grams |= _ngrams(token)
+        for gram in grams:
+            postings.setdefault(gram, []).append(position)
+    
+    return {
+        "people": people,
+        "keys": keys,
+        "profiles": profiles,
+        "postings": postings,
+        "by_name": {name: positions[id(person_info)] for name, person_info in people_data.items()},
+        "by_email": {email: positions[id(person_info)] for email, person_info in people_by_email.items() if id(person_info) in positions},
+    }
+
+def get_person_index(snapshot):
+    """
+    Get the person index for a people snapshot, building it once per snapshot
+    
+    Args:
+        snapshot: People snapshot from data_loader.get_people_snapshot
+        
+    Returns:
+        Person index dictionary
+    """
+    with _index_lock:
+        # Keeping the snapshot itself means a reloaded directory is never mistaken for the cached one
+        if _index_cache["snapshot"] is not snapshot:
+            people_data, people_by_email, _ = snapshot["data"]
+            _index_cache["index"] = build_person_index(people_data, people_by_email)
+            _index_cache["snapshot"] = snapshot
+        return _index_cache["index"]
+
+def _is_initial(token):
+    return len(token) == 1
+
+def _token_similarity(query_token, token):
+    """
+    Similarity between one query token and one name token, where an initial
+    (a single letter, e.g. the J of "J. Smith") matches any name token it starts
+    """
+    if _is_initial(query_token):
+        return 1.0 if token.startswith(query_token) else 0.0
+    return _similarity(query_token, token)
+
+def _score(query, query_tokens, person_keys, person_tokens, floor=0.0):
+    """
+    Score how well a query matches one person
+    
+    A name of several words is matched word by word: every word must match
+    one of the person's name words on its own (TOKEN_MATCH_THRESHOLD), and
+    the score is their average similarity. Comparing whole strings would let
+    "Jen Smith" match "Jon Smith" on the shared surname. Whole strings are
+    only compared for an email or a single word, against the name, nickname
+    and email. Token matching needs at least one token that is not an initial.
+    """
+    best = 0.0
+    if len(query_tokens) <= 1:
+        for key in person_keys:
+            best = max(best, _similarity(query, key, max(best, floor)))
+    
+    if person_tokens and query_tokens and not all(_is_initial(token) for token in query_tokens):
+        token_total = 0.0
+        for query_token in query_tokens:
+            token_score = max(_token_similarity(query_token, token) for token in person_tokens)
+            if token_score < TOKEN_MATCH_THRESHOLD:
+                return best
+            token_total += token_score
+        # Slightly prefer whole-string matches over token matches
+        best = max(best, 0.95 * token_total / len(query_tokens))
+    
+    return best
+
+def _find_position(name_or_email, index, fuzzy=True):
+    """
+    Find the index position of the best matching person for a name or email
+    
+    Args:
+        name_or_email: String with person's name or email
+        index: Person index from build_person_index
+        fuzzy: Whether to fall back to fuzzy matching when there is no exact match
+        
+    Returns:
+        Tuple of (position, score), with position None if nothing matches
+    """
+    if not name_or_email or not name_or_email.strip():
+        return None, 0.0
+    
+    query = name_or_email.strip().lower()
+    
+    # Try exact email and name matches
+    if '@' in query and query in index["by_email"]:
+        return index["by_email"][query], 1.0
+    if query in index["by_name"]:
+        return index["by_name"][query], 1.0
+    if not fuzzy:
+        return None, 0.0
+    
+    is_email = '@' in query
+    if is_email:
+        query = query.split('@')[0]
+    query_tokens = query.replace('.', ' ').split()
+    
+    # Collect candidates that share n-grams with the query
+    shared = Counter()
+    for token in query_tokens:
+        for gram in _ngrams(token):
+            shared.update(index["postings"].get(gram, ()))
+    
+    # An unknown email is only compared as a whole, never token by token
+    score_tokens = [] if is_email else query_tokens
+    
+    best_position, best_score = None, 0.0
+    for position, _ in shared.most_common(MAX_CANDIDATES):
+        person_keys, person_tokens = index["keys"][position]
+        score = _score(query, score_tokens, person_keys, person_tokens, best_score)
+        if score > best_score:
+            best_position, best_score = position, score
+    
+    if best_score < MATCH_THRESHOLD:
+        return None, best_score
+    return best_position, best_score
+
+def find_person(name_or_email, index):
+    """
+    Find the best matching person for a name or email
+    
+    Args:
+        name_or_email: String with person's name or email
+        index: Person index from build_person_index
+        
+    Returns:
+        Tuple of (person info, score), or (None, score) if nothing matches
+    """
+    position, score = _find_position(name_or_email, index)
+    if position is None:
+        return None, score
+    return index["people"][position], score
+
+def find_profile(name_or_email, index):
+    """
+    Find the precomputed prompt profile of the best matching person
+    
+    Args:
+        name_or_email: String with person's name or email
+        index: Person index from build_person_index
+        
+    Returns:
+        Profile dictionary from _build_profile, or None if nothing matches
+    """
+    position, _ = _find_position(name_or_email, index)
+    if position is None:
+        return None
+    return index["profiles"][position]
+
+def find_people(names_or_emails, index):
+    """
+    Resolve a list of names or emails in one call
+    
+    Args:
+        names_or_emails: Iterable of names or emails
+        index: Person index from build_person_index
+        
+    Returns:
+        List of (person info dictionary or None, score) tuples in input order
+    """
+    return [find_person(name_or_email, index) for name_or_email in names_or_emails]
+
+def find_profiles(names_or_emails, index):
+    """
+    Resolve a list of names or emails to precomputed prompt profiles in one call
+    
+    Args:
+        names_or_emails: Iterable of names or emails
+        index: Person index from build_person_index
+        
+    Returns:
+        List of profile dictionaries or None, in input order
+    """
+    return [find_profile(name_or_email, index) for name_or_email in names_or_emails]
+
+def identify_person(name_or_email, people_data, people_by_email, index=None):
     """
     Try to identify a person by name or email
     
@@ -8,30 +379,15 @@ def identify_person(name_or_email, people_data, people_by_email):
         name_or_email: String with person's name or email
         people_data: Dictionary of people indexed by name
         people_by_email: Dictionary of people indexed by email
+        index: Prebuilt person index, built from the dictionaries if not given
         
     Returns:
         Dictionary with person's info or None if not found
     """
-    if not name_or_email:
-        return None
-        
-    # Try exact email match
-    if '@' in name_or_email:
-        email = name_or_email.strip().lower()
-        if email in people_by_email:
-            return people_by_email[email]
-    
-    # Try name match
-    name = name_or_email.strip().lower()
-    if name in people_data:
-        return people_data[name]
-    
-    # Try partial name match (first name)
-    for person_name, person_info in people_data.items():
-        if name in person_name or person_name in name:
-            return person_info
-            
-    return None
+    if index is None:
+        index = build_person_index(people_data, people_by_email)
+    person_info, _ = find_person(name_or_email, index)
+    return person_info
 
 def build_person_context(rsvp_data):
     """
@@ -43,27 +399,32 @@ def build_person_context(rsvp_data):
     Returns:
         Tuple containing personalization dict, guest info list, and relationship levels
     """
-    # Get people data from sheet
-    people_data, people_by_email, relationship_levels = get_people_data()
+    # Get people data from the cached sheet snapshot
+    snapshot = get_people_snapshot()
+    if snapshot is None:
+        index = build_person_index({}, {})
+        relationship_levels = {}
+    else:
+        index = get_person_index(snapshot)
+        relationship_levels = snapshot["data"][2]
     
     # Extract RSVP information
     name = rsvp_data.get("name", "Guest")
     email = rsvp_data.get("email", "")
     other_guests = rsvp_data.get("other_guests", "")
     
-    # Try to identify the person who submitted the RSVP
-    person_info = identify_person(email, people_data, people_by_email) or identify_person(name, people_data, people_by_email)
+    # Try to identify the person who submitted the RSVP: an exact email, then
+    # an exact name, and only then the closer of the two fuzzy matches
+    position, _ = _find_position(email, index, fuzzy=False)
+    if position is None:
+        position, _ = _find_position(name, index, fuzzy=False)
+    if position is None:
+        position, _ = max(_find_position(email, index), _find_position(name, index), key=lambda match: match[1])
+    profile = index["profiles"][position] if position is not None else None
     
-    # Prepare personalized information
-    personalization = {}
-    if person_info:
-        personalization = {
-            'name': person_info['name'],
-            'nickname': person_info['nickname'] if person_info['nickname'] else person_info['name'].split()[0],
-            'they_call_me': person_info['they_call_me'] if person_info['they_call_me'] else 'Andrew',
-            'relationship': person_info['relationship'],
-            'relationship_level': person_info['relationship_level']
-        }
+    # Profiles are shared between requests, so they are never modified here
+    if profile:
+        personalization = profile["personalization"]
     else:
         # Default values if person not found
         personalization = {
@@ -73,28 +434,25 @@ def build_person_context(rsvp_data):
             'relationship': 'Friend',
             'relationship_level': '9'
         }
+        personalization['context_block'] = format_person_block(personalization)
         
     # Look up guests in the people database
     guest_info = []
     if other_guests:
-        guest_names = [g.strip() for g in other_guests.split(',')]
-        for guest_name in guest_names:
-            guest = identify_person(guest_name, people_data, people_by_email)
-            if guest:
-                guest_info.append({
-                    'name': guest['name'],
-                    'nickname': guest['nickname'] if guest['nickname'] else guest['name'].split()[0],
-                    'relationship': guest['relationship'],
-                    'relationship_level': guest['relationship_level']
-                })
+        guest_names = [g.strip() for g in other_guests.split(',') if g.strip()]
+        for guest_name, guest_profile in zip(guest_names, find_profiles(guest_names, index)):
+            if guest_profile:
+                guest_info.append(guest_profile["guest"])
             else:
                 # Guest not found in database
-                guest_info.append({
+                guest = {
                     'name': guest_name,
                     'nickname': guest_name.split()[0],
                     'relationship': 'Unknown',
                     'relationship_level': '10'
-                })
+                }
+                guest['guest_line'] = format_guest_line(guest)
+                guest_info.append(guest)
                 
     return personalization, guest_info, relationship_levels
 
@@ -110,22 +468,15 @@ def format_relationship_context(personalization, guest_info, relationship_levels
     Returns:
         Tuple containing relationship context and levels text
     """
-    # Build relationship levels description
-    relationship_levels_text = "\n".join([f"{level} = {description}" for level, description in relationship_levels.items()])
+    # Both parts are precomputed per directory snapshot, so this only joins strings
+    relationship_levels_text = format_relationship_levels(relationship_levels)
+    
+    relationship_context = personalization.get('context_block') or format_person_block(personalization)
     
-    # Add relationship context
-    relationship_context = f"""
-Relationship with {personalization['name']}:
-- They call me: {personalization['they_call_me']}
-- Nickname or how I refer to them: {personalization['nickname']}
-- Our relationship: {personalization['relationship']}
-- Relationship level (1-10 where 1 is closest): {personalization['relationship_level']}
-"""
-
     # Add guest relationship context
     if guest_info:
-        relationship_context += "\nRelationship with guests:\n"
-        for guest in guest_info:
-            relationship_context += f"- {guest['name']} (nickname: {guest['nickname']}): {guest['relationship']}, level {guest['relationship_level']}\n"
+        relationship_context += "\nRelationship with guests:\n" + "".join(
+            guest.get('guest_line') or format_guest_line(guest) for guest in guest_info
+        )
             
     return relationship_context, relationship_levels_text
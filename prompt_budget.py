@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+
+# Most tokens the variable parts of a prompt (RSVP, relationships, documents) may use together.
+# The fixed instructions add a few hundred more; GPT-4's window is 8k including the reply.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "5000"))
+
+# Part of the budget kept free for per-request text when sizing the shared document prefix
+REQUEST_TOKEN_RESERVE = int(os.getenv("PROMPT_REQUEST_TOKEN_RESERVE", "1000"))
+
+# Trimming order: parts with the highest number are cut first, priority 0 is never cut
+PRIORITIES = {
+    "rsvp_summary": 0,
+    "relationship_context": 0,
+    "relationship_levels": 0,
+    "question": 0,
+    "event_details": 1,
+    "current_lineup": 2,
+    "previous_event": 3,
+}
+
+TRIM_MARKER = "\n[... trimmed to fit the prompt size limit ...]\n"
+
+# tiktoken's BPE files, fetched at deploy time so they are never downloaded while serving
+BUNDLED_TIKTOKEN_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+
+# Characters per token when estimating without tiktoken
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_thread = None
+
+def _load_encoding():
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, estimating token counts: {e}")
+        _encoding = False
+
+def _get_encoding():
+    """
+    Get the cl100k_base encoding, or None while it is not available
+
+    With the BPE file in the bundled cache the encoding loads inline. Without
+    it tiktoken would download the file, so it is loaded on a background
+    thread instead and callers estimate until it is ready.
+    """
+    global _encoding_thread
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None and _encoding_thread is None:
+                if os.path.isdir(BUNDLED_TIKTOKEN_CACHE):
+                    os.environ.setdefault("TIKTOKEN_CACHE_DIR", BUNDLED_TIKTOKEN_CACHE)
+                if os.getenv("TIKTOKEN_CACHE_DIR"):
+                    _load_encoding()
+                else:
+                    _encoding_thread = threading.Thread(target=_load_encoding, name="tiktoken", daemon=True)
+                    _encoding_thread.start()
+    return _encoding or None
+
+def count_tokens(text):
+    """
+    Count model tokens in a piece of text
+
+    Uses tiktoken's cl100k_base encoding (GPT-4). If it cannot be loaded,
+    or is still loading, falls back to an estimate of four characters per token.
+
+    Args:
+        text: String to count
+
+    Returns:
+        Integer token count
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _cut_to_tokens(text, max_tokens):
+    """
+    Cut text to its first max_tokens tokens, wherever that falls
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max(0, max_tokens - 1) * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def _trim_to_tokens(text, max_tokens):
+    """
+    Cut text down to at most max_tokens, at a line boundary where possible
+
+    If even the first line does not fit, it is cut mid-line instead.
+
+    Args:
+        text: String to trim
+        max_tokens: Token limit, including the trim marker
+
+    Returns:
+        Trimmed string ending in TRIM_MARKER, or "" if not even the marker fits
+    """
+    room = max_tokens - count_tokens(TRIM_MARKER)
+    if room <= 0:
+        return ""
+    lines = text.split("\n")
+    kept = []
+    used = 0
+    for line in lines:
+        line_tokens = count_tokens(line + "\n")
+        if used + line_tokens > room:
+            break
+        kept.append(line)
+        used += line_tokens
+    if not kept:
+        return _cut_to_tokens(text, room) + TRIM_MARKER
+    return "\n".join(kept) + TRIM_MARKER
+
+def fit_prompt_parts(prompt_name, parts, budget=None, prefix_tokens=0):
+    """
+    Fit the variable parts of a prompt into the token budget and log the breakdown
+
+    Parts are trimmed lowest priority first (see PRIORITIES) until the total
+    fits. Priority 0 parts are always kept whole.
+
+    Args:
+        prompt_name: Name used in the log record, e.g. "rsvp_attending"
+        parts: Dictionary mapping part name to text
+        budget: Token budget, defaults to PROMPT_TOKEN_BUDGET
+        prefix_tokens: Tokens already used by a fixed prompt prefix, counted against the budget
+
+    Returns:
+        Dictionary with the same keys and the (possibly trimmed) texts
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    counts = {name: count_tokens(text) for name, text in parts.items()}
+    if prefix_tokens:
+        counts["prefix"] = prefix_tokens
+    fitted = dict(parts)
+    trimmed = {}
+
+    over = sum(counts.values()) - budget
+    for name in sorted(parts, key=lambda name: PRIORITIES.get(name, 1), reverse=True):
+        if over <= 0:
+            break
+        if PRIORITIES.get(name, 1) == 0 or not counts[name]:
+            continue
+        keep = max(0, counts[name] - over)
+        fitted[name] = _trim_to_tokens(parts[name], keep) if keep else ""
+        new_count = count_tokens(fitted[name])
+        trimmed[name] = counts[name] - new_count
+        over -= counts[name] - new_count
+        counts[name] = new_count
+
+    total = sum(counts.values())
+    logging.info(json.dumps({
+        "metric": "prompt_tokens",
+        "prompt": prompt_name,
+        "budget": budget,
+        "total": total,
+        "parts": counts,
+        "trimmed": trimmed,
+    }))
+    if total > budget:
+        logging.warning(f"{prompt_name} prompt is {total} tokens, over the {budget} token budget after trimming")
+    return fitted
@@ -1,5 +1,94 @@
 import logging
-from data_loader import load_event_details, load_previous_event, load_current_lineup
+import threading
+import retrieval
+from prompt_budget import fit_prompt_parts, count_tokens, PROMPT_TOKEN_BUDGET, REQUEST_TOKEN_RESERVE
+from data_loader import load_event_documents, get_documents_revision_key
+
+# Prompts are split into a static prefix (instructions and event documents) sent as the
+# system message, and a per-request suffix (person, RSVP, question) sent as the user
+# message. The rendered prefix is memoized per document revision so it stays
+# byte-identical between requests. OpenAI only reuses a cached prefix on models with
+# prompt caching (gpt-4o and later, not the gpt-4 default) and only from 1024 tokens,
+# so this takes effect once <ENDPOINT>_MODEL names such a model. The question prompt's
+# prefix is just QUESTION_INSTRUCTIONS when retrieval picks sections, which is too short.
+
+RSVP_ATTENDING_INSTRUCTIONS = """You are the host of Sullstice (Andrew Sullivan), writing a personalized RSVP response.
+
+You are responding to an RSVP for Sullstice, a multi-day camping event. Use a friendly, casual,
+and informative tone appropriate for the specific relationship with this person.
+
+Create two parts: An email subject line and a body.
+
+For the subject line:
+- Create a brief, personalized subject line related to their Sullstice RSVP
+- Include their name if appropriate
+- Keep it under 60 characters
+- Format it as "SUBJECT: Your subject line here"
+
+For the body:
+Write a personalized email response to the person who sent the RSVP, using their nickname, that:
+1. Shows genuine excitement about seeing them (and their guests) at Sullstice, with the tone matching our relationship and relationship level
+2. Confirms their RSVP details (arrival/departure days, camping preference, additional guests)
+2a. If they are arriving and departing same day, they aren't camping and we don't need to mention anything about camping or rv
+3. Addresses any notes or questions they included (if applicable)
+4. Provides relevant information from the event details based on their camping choice, arrival day, etc.
+5. If appropriate, mentions activities or performances from this year's lineup that might interest them
+5a. Tell them that the schedule is still being finalized and to check the website for updates
+6. If we're close (relationship level 1-3), include a personal touch or inside reference that feels authentic
+7. If it's someone I haven't seen in a while (level 3, 5, or 6), express that I'm looking forward to catching up
+8. If it's family, use an appropriate familial tone
+9. Sign off with the name they call me
+
+Format the body as "BODY: Your email body here"
+
+The response should be conversational, reflecting the actual relationship I have with this person. Make it sound like it was written by me, not by an AI."""
+
+RSVP_NOT_ATTENDING_INSTRUCTIONS = """You are the host of Sullstice (Andrew Sullivan), writing a personalized RSVP response.
+
+You are responding to an RSVP decline for Sullstice, a multi-day camping event. Use a friendly, casual,
+and understanding tone appropriate for the specific relationship with this person.
+
+Create two parts: An email subject line and a body.
+
+For the subject line:
+- Create a brief, personalized subject line acknowledging their Sullstice RSVP
+- Include their name if appropriate
+- Keep it under 60 characters
+- Format it as "SUBJECT: Your subject line here"
+
+For the body:
+Write a personalized email response to the person who sent the RSVP, using their nickname, that:
+1. Expresses understanding and appreciation that they took the time to RSVP even though they can't attend
+2. Conveys that they'll be missed this year
+3. Reminds them that Sullstice happens every year around the same time (Memorial Day weekend) and you hope to see them next year
+4. Addresses any notes or questions they included (if applicable)
+5. If we're close (relationship level 1-3), include a personal touch or inside reference that feels authentic
+6. If it's family, use an appropriate familial tone
+7. Sign off with the name they call me
+
+Format the body as "BODY: Your email body here"
+
+The response should be conversational, reflecting the actual relationship I have with this person. Make it sound like it was written by me, not by an AI."""
+
+QUESTION_INSTRUCTIONS = """You are a helpful assistant for Sullstice, a multi-day camping event.
+When answering questions:
+1. Prioritize information from the current year's details and lineup that are being pulled from live Google Docs
+2. If the current year's information doesn't fully address the question, you can reference how things worked in 2024, but clearly indicate that this is historical information and things might be different this year
+3. Be conversational and friendly in your tone
+4. Be concise but thorough
+5. If the question is about something not mentioned in any of the provided information, acknowledge this and suggest contacting Andrew directly at sullhouse@gmail.com"""
+
+# Documents each kind of prompt draws on
+PROMPT_DOCUMENTS = {
+    "rsvp_attending": ["event_details", "previous_event", "current_lineup"],
+    "rsvp_not_attending": ["event_details", "previous_event"],
+    "question": ["event_details", "previous_event", "current_lineup"],
+}
+
+# Rendered prefixes keyed by (prompt kind, document revision key, relationship levels text)
+_prefix_cache = {}
+_prefix_lock = threading.Lock()
+MAX_CACHED_PREFIXES = 16
 
 def format_rsvp_summary(rsvp_data):
     """
@@ -31,163 +120,178 @@ Notes: {notes}
 Questions: {questions}
 """
 
-def build_rsvp_attending_prompt(rsvp_data, personalization, relationship_context, relationship_levels_text):
+def _render_prefix(kind, documents, relationship_levels_text):
     """
-    Build prompt for OpenAI when the person is attending
+    Render the static prefix for a kind of prompt
     
     Args:
-        rsvp_data: Dictionary with RSVP information
-        personalization: Dictionary with person's info
-        relationship_context: String with relationship context
-        relationship_levels_text: String with relationship levels description
-        
+        kind: Key from PROMPT_DOCUMENTS
+        documents: Dictionary mapping document name to content
+        relationship_levels_text: String with relationship levels description, or None
+    
     Returns:
-        String containing the prompt
+        String containing the prefix
     """
-    # Get event information
-    event_details = load_event_details()
-    previous_event = load_previous_event()
-    current_lineup = load_current_lineup()
-    
-    # Format RSVP summary
-    rsvp_summary = format_rsvp_summary(rsvp_data)
-    
-    return f"""
-You are responding to an RSVP for Sullstice, a multi-day camping event. Use a friendly, casual, 
-and informative tone appropriate for the specific relationship with this person.
+    # Size the documents so the whole prompt stays in budget with room for the request
+    parts = fit_prompt_parts(f"{kind}_prefix", documents, budget=PROMPT_TOKEN_BUDGET - REQUEST_TOKEN_RESERVE)
 
-Here's information about the RSVP:
-{rsvp_summary}
+    if kind == "question":
+        if not any(parts.values()):
+            return QUESTION_INSTRUCTIONS
+        return f"""{QUESTION_INSTRUCTIONS}
 
-Important personal context to help personalize this response:
-{relationship_context}
+Here is information about Sullstice:
+
+GENERAL EVENT INFORMATION FOR THIS YEAR:
+{parts['event_details']}
+
+CURRENT YEAR'S LINEUP AND ACTIVITIES:
+{parts['current_lineup']}
+
+INFORMATION ABOUT LAST YEAR'S EVENT (2024) - Use this for reference if the question isn't clearly answered by current year information:
+{parts['previous_event']}
+"""
+
+    instructions = RSVP_ATTENDING_INSTRUCTIONS if kind == "rsvp_attending" else RSVP_NOT_ATTENDING_INSTRUCTIONS
+    prefix = f"""{instructions}
 
 Relationship level meanings:
 {relationship_levels_text}
 
 Here are the event details for reference:
-{event_details}
+{parts['event_details']}
 
 Information about the previous Sullstice event (2024):
-{previous_event}
-
+{parts['previous_event']}
+"""
+    if "current_lineup" in parts:
+        prefix += f"""
 Information about the current year's lineup and activities:
-{current_lineup}
+{parts['current_lineup']}
+"""
+    return prefix
 
-Create two parts: An email subject line and a body.
+def get_prompt_prefix(kind, relationship_levels_text=None):
+    """
+    Get the static prefix for a kind of prompt, rendered once per document revision
+    
+    Args:
+        kind: Key from PROMPT_DOCUMENTS
+        relationship_levels_text: String with relationship levels description (RSVP prompts)
+    
+    Returns:
+        String containing the prefix
+    """
+    names = PROMPT_DOCUMENTS[kind]
+    documents = load_event_documents(names)
+    revision_key = get_documents_revision_key(names, load=False)
+    if revision_key is None:
+        return _render_prefix(kind, documents, relationship_levels_text)
 
-For the subject line:
-- Create a brief, personalized subject line related to their Sullstice RSVP
-- Include their name if appropriate
-- Keep it under 60 characters
-- Format it as "SUBJECT: Your subject line here"
+    key = (kind, revision_key, relationship_levels_text)
+    with _prefix_lock:
+        prefix = _prefix_cache.get(key)
+    if prefix is None:
+        prefix = _render_prefix(kind, documents, relationship_levels_text)
+        with _prefix_lock:
+            if len(_prefix_cache) >= MAX_CACHED_PREFIXES:
+                _prefix_cache.clear()
+            _prefix_cache[key] = prefix
+    return prefix
 
-For the body:
-Write a personalized email response to {personalization['nickname']} that:
-1. Shows genuine excitement about seeing them (and their guests) at Sullstice, with the tone matching our relationship and relationship level
-2. Confirms their RSVP details (arrival/departure days, camping preference, additional guests)
-2a. If they are arriving and departing same day, they aren't camping and we don't need to mention anything about camping or rv
-3. Addresses any notes or questions they included (if applicable)
-4. Provides relevant information from the event details based on their camping choice, arrival day, etc.
-5. If appropriate, mentions activities or performances from this year's lineup that might interest them
-5a. Tell them that the schedule is still being finalized and to check the website for updates
-6. If we're close (relationship level 1-3), include a personal touch or inside reference that feels authentic
-7. If it's someone I haven't seen in a while (level 3, 5, or 6), express that I'm looking forward to catching up
-8. If it's family, use an appropriate familial tone
-9. Sign off with my name as {personalization['they_call_me']}
+def _build_rsvp_prompt(kind, rsvp_data, personalization, relationship_context, relationship_levels_text):
+    prefix = get_prompt_prefix(kind, relationship_levels_text)
 
-Format the body as "BODY: Your email body here"
+    # Per-request parts are never trimmed; this records their size against the budget
+    parts = fit_prompt_parts(kind, {
+        "rsvp_summary": format_rsvp_summary(rsvp_data),
+        "relationship_context": relationship_context,
+    }, prefix_tokens=count_tokens(prefix))
+
+    suffix = f"""
+Here's information about the RSVP:
+{parts['rsvp_summary']}
 
-The response should be conversational, reflecting the actual relationship I have with this person. Make it sound like it was written by me, not by an AI.
+Important personal context to help personalize this response:
+{parts['relationship_context']}
+
+Write the email to {personalization['nickname']} and sign off with my name as {personalization['they_call_me']}.
 """
+    return prefix, suffix
 
-def build_rsvp_not_attending_prompt(rsvp_data, personalization, relationship_context, relationship_levels_text):
+def build_rsvp_attending_prompt(rsvp_data, personalization, relationship_context, relationship_levels_text):
     """
-    Build prompt for OpenAI when the person is not attending
+    Build prompt for OpenAI when the person is attending
     
     Args:
         rsvp_data: Dictionary with RSVP information
         personalization: Dictionary with person's info
         relationship_context: String with relationship context
         relationship_levels_text: String with relationship levels description
-        
+    
     Returns:
-        String containing the prompt
+        Tuple of (static prefix for the system message, per-request suffix for the user message)
+    """
+    return _build_rsvp_prompt("rsvp_attending", rsvp_data, personalization, relationship_context, relationship_levels_text)
+
+def build_rsvp_not_attending_prompt(rsvp_data, personalization, relationship_context, relationship_levels_text):
     """
-    # Get event information
-    event_details = load_event_details()
-    previous_event = load_previous_event()
+    Build prompt for OpenAI when the person is not attending
     
-    # Format RSVP summary
-    rsvp_summary = format_rsvp_summary(rsvp_data)
+    Args:
+        rsvp_data: Dictionary with RSVP information
+        personalization: Dictionary with person's info
+        relationship_context: String with relationship context
+        relationship_levels_text: String with relationship levels description
     
-    return f"""
-You are responding to an RSVP decline for Sullstice, a multi-day camping event. Use a friendly, casual, 
-and understanding tone appropriate for the specific relationship with this person.
-
-Here's information about the RSVP:
-{rsvp_summary}
-
-Important personal context to help personalize this response:
-{relationship_context}
-
-Relationship level meanings:
-{relationship_levels_text}
-
-Here are the event details for reference:
-{event_details}
-
-Information about the previous Sullstice event (2024):
-{previous_event}
-
-Create two parts: An email subject line and a body.
-
-For the subject line:
-- Create a brief, personalized subject line acknowledging their Sullstice RSVP
-- Include their name if appropriate
-- Keep it under 60 characters
-- Format it as "SUBJECT: Your subject line here"
-
-For the body:
-Write a personalized email response to {personalization['nickname']} that:
-1. Expresses understanding and appreciation that they took the time to RSVP even though they can't attend
-2. Conveys that they'll be missed this year
-3. Reminds them that Sullstice happens every year around the same time (Memorial Day weekend) and you hope to see them next year
-4. Addresses any notes or questions they included (if applicable)
-5. If we're close (relationship level 1-3), include a personal touch or inside reference that feels authentic
-6. If it's family, use an appropriate familial tone
-7. Sign off with my name as {personalization['they_call_me']}
-
-Format the body as "BODY: Your email body here"
-
-The response should be conversational, reflecting the actual relationship I have with this person. Make it sound like it was written by me, not by an AI.
-"""
+    Returns:
+        Tuple of (static prefix for the system message, per-request suffix for the user message)
+    """
+    return _build_rsvp_prompt("rsvp_not_attending", rsvp_data, personalization, relationship_context, relationship_levels_text)
 
 def build_question_prompt(question):
     """
     Build prompt for answering a general question about Sullstice
     
+    When retrieval finds sections relevant to the question, only those go into
+    the prompt, in the per-request suffix. Otherwise the whole documents are
+    part of the cached prefix.
+    
     Args:
         question: String containing the question
-        
+    
     Returns:
-        String containing the prompt
+        Tuple of (static prefix for the system message, per-request suffix for the user message)
     """
-    # Load all available context
-    event_details = load_event_details()
-    previous_event = load_previous_event()
-    current_lineup = load_current_lineup()
-    
+    selected = None
+    if retrieval.ENABLED:
+        names = PROMPT_DOCUMENTS["question"]
+        documents = load_event_documents(names)
+        selected = retrieval.select_sections(question, documents, get_documents_revision_key(names, load=False))
+
+    if not selected:
+        prefix = get_prompt_prefix("question")
+        fit_prompt_parts("question", {"question": question}, prefix_tokens=count_tokens(prefix))
+        return prefix, f"Please answer this question: {question}"
+
+    # Keep the prompt within the token budget, trimming the least important documents first
+    parts = fit_prompt_parts("question", {
+        "question": question,
+        "event_details": selected["event_details"],
+        "current_lineup": selected["current_lineup"],
+        "previous_event": selected["previous_event"],
+    }, prefix_tokens=count_tokens(QUESTION_INSTRUCTIONS))
+
     # Combine context with preference for current year information
     context = f"""
 GENERAL EVENT INFORMATION FOR THIS YEAR:
-{event_details}
+{parts['event_details']}
 
 CURRENT YEAR'S LINEUP AND ACTIVITIES:
-{current_lineup}
+{parts['current_lineup']}
 
 INFORMATION ABOUT LAST YEAR'S EVENT (2024) - Use this for reference if the question isn't clearly answered by current year information:
-{previous_event}
+{parts['previous_event']}
 """
-    
-    return f"""Here is information about Sullstice:\n{context}\n\nPlease answer this question: {question}"""
+
+    return QUESTION_INSTRUCTIONS, f"""Here is information about Sullstice:\n{context}\n\nPlease answer this question: {question}"""
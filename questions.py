@@ -1,42 +1,96 @@
+import json
 import uuid
 from datetime import datetime
 from flask import Response
-from sullstice_ai import answer_question
-from google.cloud import bigquery
+from sullstice_ai import answer_question, stream_answer
+import bigquery_writer
 import aws_email  # Import AWS email module
 
-# Initialize BigQuery client
-bigquery_client = bigquery.Client()
-
 def store_question_in_bigquery(question, answer):
     """
-    Store question and answer in BigQuery
+    Queue a question and answer for the background BigQuery writer
     
     Args:
         question: String containing the question
         answer: String containing the answer
     """
-    try:
-        # Prepare data for insertion
-        row_data = {
-            "id": str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
-            "question": question,
-            "answer": answer
-        }
+    # Prepare data for insertion
+    row_data = {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.now().isoformat(),
+        "question": question,
+        "answer": answer
+    }
+    bigquery_writer.insert_row("guests.questions", row_data, row_id=row_data["id"])
+
+def record_question(question, answer):
+    """
+    Store a question and its answer and notify the administrator
+    
+    Args:
+        question: String containing the question
+        answer: String containing the full answer
+    """
+    # Store the question and answer in BigQuery
+    store_question_in_bigquery(question, answer)
+    
+    # Send email notification
+    email_subject = "Sullstice Question"
+    email_body = f"Question: {question}\n\nAnswer: {answer}"
+    
+    # Send email notification to administrator
+    aws_email.send_email(
+        subject=email_subject,
+        body=email_body,
+        recipient_email="sullhouse@gmail.com",
+        sender_email="sullstice-ai-assistant@sullstice.com",
+        reply_to_email="sullhouse@gmail.com"
+    )
+
+def wants_stream(request, request_json):
+    """
+    Check whether the client asked for a streamed answer
+    
+    Either "stream": true in the JSON body or an Accept: text/event-stream header.
+    """
+    if request_json.get('stream') is True:
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def stream_response(question):
+    """
+    Stream an answer to the client as Server-Sent Events
+    
+    Each piece of the answer is sent as a "token" event as soon as it arrives.
+    Once the answer is complete it is stored and emailed like a normal answer,
+    and a final "done" event carries the full text.
+    
+    Args:
+        question: String containing the question
         
-        # Define the table reference
-        table_ref = bigquery_client.dataset("guests").table("questions")
+    Returns:
+        Flask Response streaming text/event-stream
+    """
+    def events():
+        pieces = []
+        for piece in stream_answer(question):
+            pieces.append(piece)
+            yield f"event: token\ndata: {json.dumps({'token': piece})}\n\n"
         
-        # Insert the row
-        errors = bigquery_client.insert_rows_json(table_ref, [row_data])
+        answer = "".join(pieces).strip()
+        yield f"event: done\ndata: {json.dumps({'question': question, 'answer': answer, 'status': 'success'})}\n\n"
         
-        if errors:
-            print(f"Encountered errors while inserting row: {errors}")
-        else:
-            print("Question data inserted into BigQuery")
-    except Exception as e:
-        print(f"Error storing question in BigQuery: {str(e)}")
+        # Bookkeeping happens after the client has the whole answer
+        try:
+            record_question(question, answer)
+        except Exception as e:
+            print(f"Error recording streamed question: {str(e)}")
+    
+    return Response(
+        events(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 def main(request):
     """
@@ -46,7 +100,8 @@ def main(request):
         request: Flask request object
         
     Returns:
-        Dictionary with question and answer
+        Dictionary with question and answer, or a streaming Response when
+        the client asked for Server-Sent Events
     """
     
     try:
@@ -57,24 +112,15 @@ def main(request):
         if not question:
             return {"error": "No question provided", "status": "error"}
         
+        # Stream the answer as it is generated if the client asked for it
+        if wants_stream(request, request_json):
+            return stream_response(question)
+        
         # Get the answer using the answer_question function from sullstice_ai
         answer = answer_question(question)
         
-        # Store the question and answer in BigQuery
-        store_question_in_bigquery(question, answer)
-        
-        # Send email notification
-        email_subject = "Sullstice Question"
-        email_body = f"Question: {question}\n\nAnswer: {answer}"
-        
-        # Send email notification to administrator
-        aws_email.send_email(
-            subject=email_subject,
-            body=email_body,
-            recipient_email="sullhouse@gmail.com",
-            sender_email="sullstice-ai-assistant@sullstice.com",
-            reply_to_email="sullhouse@gmail.com"
-        )
+        # Store the question and answer and notify the administrator
+        record_question(question, answer)
         
         # Prepare response data
         response_data = {
@@ -0,0 +1,144 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import log_archive
+from background_writer import BackgroundWriter
+from clients import get_storage_client
+
+# GCS bucket for request/response logs; the segment layout lives in log_archive
+BUCKET_NAME = "sullstice"
+
+# Roll a segment when it holds this many records or its oldest record is this old.
+# Anything buffered is lost if the instance is killed, so both are kept small.
+FLUSH_MAX_RECORDS = int(os.getenv("REQUEST_LOG_FLUSH_RECORDS", "200"))
+FLUSH_MAX_SECONDS = float(os.getenv("REQUEST_LOG_FLUSH_SECONDS", "10"))
+
+# Records beyond this many waiting to be written are dropped instead of blocking requests.
+# Kept small enough that a full queue still drains in the shutdown grace period.
+QUEUE_MAX_RECORDS = int(os.getenv("REQUEST_LOG_QUEUE_SIZE", "2000"))
+
+_stats = {"logged": 0, "dropped": 0, "written": 0, "failed": 0}
+_stats_lock = threading.Lock()
+_bucket = None
+
+# Segment being collected by the writer thread: its records, when its first
+# record arrived (monotonic) and that record's UTC time, which picks the hour prefix
+_segment = {"records": [], "oldest": None, "started_at": None}
+
+def _get_bucket():
+    """
+    Get the GCS bucket for request logs, creating the storage client on first use
+    """
+    global _bucket
+    if _bucket is None:
+        _bucket = get_storage_client().bucket(BUCKET_NAME)
+    return _bucket
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+        return _stats[key]
+
+def _write_batch(records, started_at):
+    """
+    Upload a batch of records to GCS as one compressed NDJSON segment
+
+    Args:
+        records: List of record dictionaries
+        started_at: UTC datetime of the first record, which picks the hour prefix
+    """
+    blob = _get_bucket().blob(log_archive.segment_name(started_at))
+    try:
+        blob.upload_from_string(
+            data=log_archive.encode_segment(records),
+            content_type='application/gzip'
+        )
+        _count("written", len(records))
+    except Exception as e:
+        _count("failed", len(records))
+        logging.error(f"Failed to write {len(records)} request log records to GCS: {str(e)}")
+
+def _add_record(record):
+    """
+    Add a record to the segment, first writing the segment if the UTC hour changed
+
+    A segment never spans two hours, so every record lands under the hour
+    (and day) prefix it was logged in.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if _segment["records"] and log_archive.hour_prefix(now) != log_archive.hour_prefix(_segment["started_at"]):
+        _write_segment()
+    if not _segment["records"]:
+        _segment["oldest"] = time.monotonic()
+        _segment["started_at"] = now
+    _segment["records"].append(record)
+
+def _write_segment():
+    _write_batch(_segment["records"], _segment["started_at"])
+    _segment.update(records=[], oldest=None, started_at=None)
+
+def _write_due(flushing):
+    """
+    Roll the segment by size or age, or whenever flushing
+
+    Returns:
+        Seconds until the segment is due by age, or None if it is empty
+    """
+    if not _segment["records"]:
+        return None
+    age = time.monotonic() - _segment["oldest"]
+    if flushing or age >= FLUSH_MAX_SECONDS or len(_segment["records"]) >= FLUSH_MAX_RECORDS:
+        _write_segment()
+        return None
+    return FLUSH_MAX_SECONDS - age
+
+_writer = BackgroundWriter("request-logger", _add_record, _write_due, QUEUE_MAX_RECORDS)
+
+def log_record(record_type, request_id, data):
+    """
+    Queue a record for the background GCS writer without blocking
+
+    If the queue is full the record is dropped and counted in get_stats().
+
+    Args:
+        record_type: Kind of record, e.g. "request" or "response"
+        request_id: ID shared by a request and its response
+        data: JSON-serializable record content
+    """
+    record = {
+        "type": record_type,
+        "request_id": request_id,
+        "logged_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "data": data,
+    }
+    try:
+        _writer.put(record)
+        _count("logged")
+    except queue.Full:
+        dropped = _count("dropped")
+        if dropped % 100 == 1:
+            logging.warning(f"Request log queue full, {dropped} records dropped so far")
+
+def flush(timeout=None):
+    """
+    Write all queued records now and wait for the writer to finish them
+
+    Args:
+        timeout: Seconds to wait at most, or None to wait until done
+    """
+    _writer.flush(timeout)
+
+def get_stats():
+    """
+    Get counters for the request logger
+
+    Returns:
+        Dictionary with logged, dropped, written, failed and queued record counts
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queued"] = _writer.waiting()
+    return stats
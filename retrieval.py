@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from html_generator import parse_document_content
+from prompt_budget import count_tokens
+
+# How many sections go into a question prompt, and the most tokens they may use together
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "2000"))
+
+# Set SULLSTICE_RETRIEVAL=False to paste whole documents into question prompts
+ENABLED = os.getenv("SULLSTICE_RETRIEVAL") != "False"
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "can", "do", "does", "for", "from", "how", "i", "if",
+    "in", "is", "it", "me", "my", "of", "on", "or", "the", "there", "this", "to", "we", "what",
+    "when", "where", "which", "who", "will", "with", "you", "your",
+}
+
+# Index for the current document revision
+_index_cache = {"revision_key": None, "index": None}
+_lock = threading.Lock()
+
+def _stem(word):
+    # Fold simple plurals so "dogs" matches "dog" and "showers" matches "shower"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text):
+    """
+    Split text into lowercase, plural-folded search terms without stopwords
+    """
+    return [_stem(word) for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+
+def build_index(documents):
+    """
+    Chunk documents by section and build a BM25 index over the sections
+
+    Args:
+        documents: Dictionary mapping document name to markdown content
+
+    Returns:
+        Dictionary with the sections, their term counts, document frequencies and average length
+    """
+    sections = []
+    for doc_name, content in documents.items():
+        for position, (heading, lines) in enumerate(parse_document_content(content or "").items()):
+            if not lines:
+                continue
+            text = "\n".join(lines)
+            # Heading words count twice, since they say what the section is about
+            terms = Counter(tokenize(text) + 2 * tokenize(heading))
+            sections.append({
+                "doc": doc_name,
+                "position": position,
+                "heading": heading,
+                "text": text,
+                "terms": terms,
+                "length": sum(terms.values()),
+                "tokens": count_tokens(text),
+            })
+
+    document_frequency = Counter()
+    for section in sections:
+        document_frequency.update(section["terms"].keys())
+
+    return {
+        "sections": sections,
+        "document_frequency": document_frequency,
+        "average_length": (sum(section["length"] for section in sections) / len(sections)) if sections else 0,
+    }
+
+def get_index(documents, revision_key):
+    """
+    Get the section index for a document revision, building it once per revision
+
+    Args:
+        documents: Dictionary mapping document name to markdown content
+        revision_key: Key from data_loader.get_documents_revision_key, or None
+
+    Returns:
+        Index dictionary from build_index
+    """
+    if revision_key is None:
+        return build_index(documents)
+    with _lock:
+        if _index_cache["revision_key"] != revision_key:
+            _index_cache["index"] = build_index(documents)
+            _index_cache["revision_key"] = revision_key
+        return _index_cache["index"]
+
+def score_sections(query, index):
+    """
+    Score every section against a query with BM25
+
+    Args:
+        query: String containing the question
+        index: Index dictionary from build_index
+
+    Returns:
+        List of (score, section) tuples for sections that match at least one term
+    """
+    sections = index["sections"]
+    total = len(sections)
+    scored = []
+    query_terms = set(tokenize(query))
+    for section in sections:
+        score = 0.0
+        for term in query_terms:
+            frequency = section["terms"].get(term, 0)
+            if not frequency:
+                continue
+            df = index["document_frequency"][term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            norm = 1 - B + B * section["length"] / (index["average_length"] or 1)
+            score += idf * frequency * (K1 + 1) / (frequency + K1 * norm)
+        if score > 0:
+            scored.append((score, section))
+    return scored
+
+def select_sections(query, documents, revision_key=None, top_k=TOP_K, token_budget=TOKEN_BUDGET):
+    """
+    Pick the sections most relevant to a query within a token budget
+
+    Args:
+        query: String containing the question
+        documents: Dictionary mapping document name to markdown content
+        revision_key: Key the index is cached under, or None to build it fresh
+        top_k: Most sections to return
+        token_budget: Most tokens the returned sections may use together
+
+    Returns:
+        Dictionary mapping document name to the selected sections' markdown,
+        in document order, or None if no section matched the query or none
+        fits the budget, in which case the caller uses the full documents
+    """
+    index = get_index(documents, revision_key)
+    scored = score_sections(query, index)
+    if not scored:
+        return None
+
+    chosen = []
+    used = 0
+    for score, section in sorted(scored, key=lambda item: item[0], reverse=True):
+        if len(chosen) >= top_k:
+            break
+        if used + section["tokens"] > token_budget:
+            continue
+        chosen.append(section)
+        used += section["tokens"]
+
+    logging.info(f"Selected {len(chosen)} of {len(index['sections'])} sections ({used} tokens) for question")
+    if not chosen:
+        return None
+
+    selected = {name: "" for name in documents}
+    for section in sorted(chosen, key=lambda section: section["position"]):
+        heading = "" if section["heading"] == "main" else f"## {section['heading']}\n"
+        selected[section["doc"]] += f"{heading}{section['text']}\n\n"
+    return selected
@@ -1,11 +1,27 @@
 import aws_email
+import bigquery_writer
+import cloud_tasks
 import sullstice_ai
-from google.cloud import bigquery
+import json
+import logging
+import re
+import threading
+import time
 import uuid
 from datetime import datetime
+import rsvp_events
+import rsvp_queue
+from task_graph import run_graph
 
-# Initialize BigQuery client
-bigquery_client = bigquery.Client()
+ADMIN_EMAIL = "sullhouse@gmail.com"
+ASSISTANT_EMAIL = "sullstice-ai-assistant@sullstice.com"
+RSVP_RECEIVED = "RSVP received successfully"
+
+RSVP_FIELDS = ["can_attend", "name", "email", "other_guests", "arriving", "departing", "camping", "notes", "questions"]
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Longest a task waits for its lifecycle events to reach BigQuery before finishing
+EVENT_FLUSH_SECONDS = 10
 
 def store_rsvp_in_bigquery(rsvp_data):
     """
@@ -13,183 +29,283 @@ def store_rsvp_in_bigquery(rsvp_data):
     
     Args:
         rsvp_data: Dictionary containing RSVP information
-    """
-    try:
-        # Add timestamp and unique ID
-        rsvp_data["id"] = str(uuid.uuid4())
-        rsvp_data["timestamp"] = datetime.now().isoformat()
-        
-        # Define the table reference
-        table_ref = bigquery_client.dataset("guests").table("rsvp")
-        
-        # Insert the row
-        errors = bigquery_client.insert_rows_json(table_ref, [rsvp_data])
         
-        if errors:
-            print(f"Encountered errors while inserting row: {errors}")
-        else:
-            print("RSVP data inserted into BigQuery")
-    except Exception as e:
-        print(f"Error storing RSVP in BigQuery: {str(e)}")
-
-def update_rsvp_in_bigquery(rsvp_id, ai_response):
+    Returns:
+        True if the row was written
     """
-    Update the RSVP entry in BigQuery with the AI response
+    # Add timestamp and unique ID unless the submission already has them
+    rsvp_data.setdefault("id", str(uuid.uuid4()))
+    rsvp_data.setdefault("timestamp", datetime.now().isoformat())
     
-    Args:
-        rsvp_id: The unique ID of the RSVP entry
-        ai_response: The AI-generated response to update
-    """
-    try:
-        # Define the table reference
-        table_ref = bigquery_client.dataset("guests").table("rsvp")
-        
-        # Define the update query
-        query = f"""
-        UPDATE `{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`
-        SET ai_response = @ai_response
-        WHERE id = @rsvp_id
-        """
-        
-        # Execute the query with parameters
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("ai_response", "STRING", ai_response),
-                bigquery.ScalarQueryParameter("rsvp_id", "STRING", rsvp_id),
-            ]
-        )
-        query_job = bigquery_client.query(query, job_config=job_config)
-        query_job.result()  # Wait for the query to complete
-        print("RSVP entry updated with AI response in BigQuery")
-    except Exception as e:
-        print(f"Error updating RSVP in BigQuery: {str(e)}")
+    # Written before the step counts as done; the row ID lets BigQuery drop a duplicate from a retried task
+    return bigquery_writer.write_rows("guests.rsvp", [(rsvp_data, rsvp_data["id"])])
 
 def store_ai_response_in_bigquery(rsvp_id, status, email_subject, ai_response):
     """
-    Store the AI response in a separate BigQuery table
+    Store the AI response in the separate BigQuery response table
     
     Args:
         rsvp_id: The unique ID of the RSVP entry
         status: The status of the RSVP processing
         email_subject: The subject of the AI-generated email
         ai_response: The AI-generated response body
-    """
-    try:
-        # Prepare the data for insertion
-        ai_response_data = {
-            "id": rsvp_id,
-            "status": status,
-            "email_subject": email_subject,
-            "ai_response": ai_response,
-            "timestamp": datetime.now().isoformat(),
-        }
-        
-        # Define the table reference
-        table_ref = bigquery_client.dataset("guests").table("rsvp_ai_response")
         
-        # Insert the row
-        errors = bigquery_client.insert_rows_json(table_ref, [ai_response_data])
-        
-        if errors:
-            print(f"Encountered errors while inserting AI response: {errors}")
-        else:
-            print("AI response data inserted into BigQuery")
-    except Exception as e:
-        print(f"Error storing AI response in BigQuery: {str(e)}")
+    Returns:
+        True if the row was written
+    """
+    # Prepare the data for insertion
+    ai_response_data = {
+        "id": rsvp_id,
+        "status": status,
+        "email_subject": email_subject,
+        "ai_response": ai_response,
+        "timestamp": datetime.now().isoformat(),
+    }
+    return bigquery_writer.write_rows("guests.rsvp_ai_response", [(ai_response_data, rsvp_id)])
 
-def main(request):
-    if request.is_json:
-        # Get the JSON data
-        request_json = request.get_json()
-        
-        # Extract data from the request using the new format
-        can_attend = request_json.get("can_attend", "yes").lower()  # Normalize to lowercase
-        name = request_json.get("name", "Guest")
-        email = request_json.get("email", "")
-        other_guests = request_json.get("other_guests", "")
-        arriving = request_json.get("arriving", "")
-        departing = request_json.get("departing", "")
-        camping = request_json.get("camping", "")
-        notes = request_json.get("notes", "")
-        questions = request_json.get("questions", "")
-        
-        # Prepare the initial RSVP data
-        rsvp_data = {
-            "can_attend": can_attend,
-            "name": name,
-            "email": email,
-            "other_guests": other_guests,
-            "arriving": arriving,
-            "departing": departing,
-            "camping": camping,
-            "notes": notes,
-            "questions": questions,
-        }
-        
-        # Send an initial email with the RSVP details
-        initial_email_subject = f"New RSVP Received: {name}"
-        initial_email_body = (
-            f"RSVP Details:\n\n"
-            f"Name: {name}\n"
-            f"Email: {email}\n"
-            f"Can Attend: {can_attend}\n"
-            f"Other Guests: {other_guests}\n"
-            f"Arriving: {arriving}\n"
-            f"Departing: {departing}\n"
-            f"Camping: {camping}\n"
-            f"Notes: {notes}\n"
-            f"Questions: {questions}\n"
-        )
-        aws_email.send_email(
-            initial_email_subject,
-            initial_email_body,
-            "sullhouse@gmail.com",
-            None,  # No CC for the initial email
-            None,  # No Reply-To for the initial email
-            "sullstice-ai-assistant@sullstice.com"
-        )
-        
-        # Store the RSVP data in BigQuery (without AI response)
-        store_rsvp_in_bigquery(rsvp_data)
+def validate_rsvp(request_json):
+    """
+    Check an RSVP submission and normalize it into the stored fields
+    
+    Args:
+        request_json: Dictionary from the request body
         
+    Returns:
+        Tuple of (rsvp_data dictionary, None) or (None, error message)
+    """
+    rsvp_data = {field: str(request_json.get(field) or "").strip() for field in RSVP_FIELDS}
+    rsvp_data["can_attend"] = (rsvp_data["can_attend"] or "yes").lower()  # Normalize to lowercase
+    rsvp_data["name"] = rsvp_data["name"] or "Guest"
+    
+    if rsvp_data["can_attend"] not in ("yes", "no"):
+        return None, "can_attend must be yes or no"
+    return rsvp_data, None
+
+def send_admin_email(rsvp_data):
+    """
+    Notify the administrator of a new RSVP
+    
+    Returns:
+        Outbox entry, or None if the email could not be queued
+    """
+    initial_email_subject = f"New RSVP Received: {rsvp_data['name']}"
+    initial_email_body = (
+        f"RSVP Details:\n\n"
+        f"Name: {rsvp_data['name']}\n"
+        f"Email: {rsvp_data['email']}\n"
+        f"Can Attend: {rsvp_data['can_attend']}\n"
+        f"Other Guests: {rsvp_data['other_guests']}\n"
+        f"Arriving: {rsvp_data['arriving']}\n"
+        f"Departing: {rsvp_data['departing']}\n"
+        f"Camping: {rsvp_data['camping']}\n"
+        f"Notes: {rsvp_data['notes']}\n"
+        f"Questions: {rsvp_data['questions']}\n"
+    )
+    return aws_email.send_email(
+        initial_email_subject,
+        initial_email_body,
+        ADMIN_EMAIL,
+        None,  # No CC for the initial email
+        None,  # No Reply-To for the initial email
+        ASSISTANT_EMAIL,
+        dedupe_key=f"{rsvp_data['id']}:admin_email"
+    )
+
+def process_rsvp(task, save):
+    """
+    Do the work for a queued RSVP: notify, store, generate and send the reply
+    
+    The steps run as a dependency graph, so the admin email, the BigQuery
+    insert and the AI generation overlap, and the guest email goes out as soon
+    as the reply is generated. Steps that already succeeded on an earlier
+    attempt are skipped, so a retry does not send the same email twice or
+    regenerate the reply. Step errors are recorded on the task, and the
+    generated, emailed and failed lifecycle events are appended to BigQuery,
+    with a completed event for every attempt that ends without errors.
+    
+    Args:
+        task: Task dictionary from rsvp_queue, with the RSVP data as its payload
+        save: Callable that persists the task after each step
+    """
+    rsvp_data = dict(task["payload"])
+    result = task["result"]
+    lock = threading.Lock()
+    step_events = {"generate": rsvp_events.GENERATED, "guest_email": rsvp_events.EMAILED}
+    
+    def step(name, run):
+        def run_step():
+            if name in task["steps"]:
+                return
+            if not run():
+                raise RuntimeError(f"{name} failed")
+            with lock:
+                task["steps"].append(name)
+                save(task)
+            if name in step_events:
+                rsvp_events.record_event(rsvp_data["id"], step_events[name], task["attempts"], result.get("email_subject"))
+        return run_step
+    
+    def generate():
         # Use the AI module to generate a personalized response
-        ai_response = sullstice_ai.generate_rsvp_response(request_json)
-        
-        # Extract subject and body from the AI response
-        email_subject = ai_response.get("subject", "Sullstice RSVP")
-        email_body = ai_response.get("body", "")
-        
-        # Send the final confirmation email with the AI response
-        aws_email.send_email(
-            email_subject, 
-            email_body, 
-            email, 
-            "sullhouse@gmail.com",
-            "sullhouse@gmail.com",
-            "sullstice-ai-assistant@sullstice.com"
-        )
+        ai_response = sullstice_ai.generate_rsvp_response(rsvp_data)
+        with lock:
+            result["email_subject"] = ai_response.get("subject", "Sullstice RSVP")
+            result["ai_response"] = ai_response.get("body", "")
+        return True
+    
+    steps = {
+        "admin_email": ([], step("admin_email", lambda: send_admin_email(rsvp_data))),
+        # Store the RSVP data in BigQuery (without AI response)
+        "store_rsvp": ([], step("store_rsvp", lambda: store_rsvp_in_bigquery(dict(rsvp_data)))),
+        "generate": ([], step("generate", generate)),
+        # Store the AI response in the BigQuery response table
+        "store_ai_response": (["generate"], step("store_ai_response", lambda: store_ai_response_in_bigquery(
+            rsvp_data["id"], RSVP_RECEIVED, result["email_subject"], result["ai_response"]
+        ))),
+    }
+    
+    # Send the final confirmation email with the AI response, if there is an address to send it to
+    if EMAIL_PATTERN.match(rsvp_data["email"]):
+        steps["guest_email"] = (["generate"], step("guest_email", lambda: aws_email.send_email(
+            result["email_subject"],
+            result["ai_response"],
+            rsvp_data["email"],
+            ADMIN_EMAIL,
+            ADMIN_EMAIL,
+            ASSISTANT_EMAIL,
+            dedupe_key=f"{rsvp_data['id']}:guest_email"
+        )))
+    else:
+        logging.warning(f"RSVP {rsvp_data['id']} has no valid email address, not sending the reply")
+    
+    started = time.perf_counter()
+    _, errors, timings = run_graph(steps)
+    logging.info(json.dumps({
+        "metric": "rsvp_steps",
+        "id": rsvp_data["id"],
+        "ms": round((time.perf_counter() - started) * 1000),
+        "steps": timings,
+        "errors": errors,
+    }))
+    
+    with lock:
+        task["step_errors"] = errors
+    if errors:
+        message = "; ".join(f"{name}: {error}" for name, error in errors.items())
+        rsvp_events.record_event(rsvp_data["id"], rsvp_events.FAILED, task["attempts"], message)
+    else:
+        rsvp_events.record_event(rsvp_data["id"], rsvp_events.COMPLETED, task["attempts"], result.get("email_subject"))
+    
+    # Write the queued lifecycle events before the task reports its outcome
+    bigquery_writer.flush(EVENT_FLUSH_SECONDS)
+    if errors:
+        raise RuntimeError(message)
+
+def get_queue():
+    """
+    Get the task queue that processes RSVPs
+    """
+    return rsvp_queue.get_queue(process_rsvp)
+
+def main(request):
+    """
+    Accept an RSVP and queue it for processing
+    
+    The submission is validated and handed to the task queue, which persists
+    it before this returns. Emails and the AI reply follow in the background;
+    poll the rsvp_status endpoint with the returned ID to follow progress.
+    
+    Args:
+        request: Flask request object
         
-        # Store the AI response in the new BigQuery table
-        rsvp_id = rsvp_data.get("id")
-        store_ai_response_in_bigquery(rsvp_id, "RSVP received successfully", email_subject, email_body)
+    Returns:
+        Dictionary with the RSVP details, its ID and processing status
+    """
+    if not request.is_json:
+        # Handle non-JSON requests
+        return "Request is not a JSON object"
+    
+    rsvp_data, error = validate_rsvp(request.get_json())
+    if error:
+        return {"error": error, "status": "error"}
+    
+    rsvp_data["id"] = str(uuid.uuid4())
+    rsvp_data["timestamp"] = datetime.now().isoformat()
+    get_queue().enqueue(rsvp_data["id"], rsvp_data)
+    rsvp_events.record_event(rsvp_data["id"], rsvp_events.RECEIVED)
+    
+    # Return confirmation to API caller
+    response_json = {field: rsvp_data[field] for field in RSVP_FIELDS}
+    response_json.update({
+        "id": rsvp_data["id"],
+        "status": RSVP_RECEIVED,
+        "processing_status": rsvp_queue.QUEUED,
+    })
+    return response_json
+
+def status(request):
+    """
+    Report the processing status of an RSVP
+    
+    The task queue is asked first. RSVPs it does not know, such as those
+    processed by another instance's local queue, are looked up in the
+    latest-status view over the RSVP events.
+    
+    Args:
+        request: Flask request object with the RSVP ID in the "id" query parameter
         
-        # Return confirmation to API caller
-        response_json = {
-            "can_attend": can_attend,
-            "name": name,
-            "email": email,
-            "other_guests": other_guests,
-            "arriving": arriving,
-            "departing": departing,
-            "camping": camping,
-            "notes": notes,
-            "questions": questions,
-            "status": "RSVP received successfully",
-            "email_subject": email_subject,
-            "ai_response": email_body
+    Returns:
+        Dictionary with the status, attempts, completed steps and, once
+        generated, the reply's subject and body
+    """
+    rsvp_id = request.args.get("id", "")
+    if not rsvp_id:
+        return {"error": "Unknown RSVP id", "status": "error"}
+    task = get_queue().get(rsvp_id)
+    if task is None:
+        latest = rsvp_events.get_latest_status(rsvp_id)
+        if latest is None:
+            return {"error": "Unknown RSVP id", "status": "error"}
+        return {
+            "id": rsvp_id,
+            "processing_status": latest["status"],
+            "attempts": latest["attempt"],
+            "detail": latest["detail"],
+            "updated_at": latest["updated_at"],
         }
+    return {
+        "id": task["id"],
+        "processing_status": task["status"],
+        "attempts": task["attempts"],
+        "steps": task["steps"],
+        "error": task["error"],
+        "step_errors": task.get("step_errors", {}),
+        "email_subject": task["result"].get("email_subject"),
+        "ai_response": task["result"].get("ai_response"),
+        "updated_at": task["updated_at"],
+    }
 
-        return response_json
-    else:
-        # Handle non-JSON requests
-        return "Request is not a JSON object"
\ No newline at end of file
+def run_task(request):
+    """
+    Process a queued RSVP on behalf of Cloud Tasks
+    
+    Raises if the attempt failed or the token could not be checked, so Cloud
+    Tasks sees an error and retries. Calls without a valid OIDC token from the
+    queue's service account get a 401.
+    
+    Args:
+        request: Flask request object with {"id": rsvp_id} as JSON
+        
+    Returns:
+        Dictionary with the RSVP ID and its processing status
+    """
+    queue = get_queue()
+    if not isinstance(queue, rsvp_queue.CloudTasksQueue):
+        return {"error": "RSVP tasks are processed in-process", "status": "error"}
+    if not queue.verify_request(request.headers):
+        return cloud_tasks.unauthorized_response()
+    rsvp_id = (request.get_json(silent=True) or {}).get("id", "")
+    task = queue.handle(rsvp_id)
+    if task is None:
+        return {"error": "Unknown RSVP id", "status": "error"}
+    return {"id": rsvp_id, "processing_status": task["status"]}
@@ -0,0 +1,117 @@
+import sys
+from datetime import datetime
+import bigquery_writer
+
+# RSVP lifecycle changes are appended as events, never updated in place
+EVENTS_TABLE = "guests.rsvp_events"
+STATUS_VIEW = "guests.rsvp_status"
+
+RECEIVED = "received"
+GENERATED = "generated"
+EMAILED = "emailed"
+FAILED = "failed"
+# Every step is done; recorded by each attempt that ends without errors, so a
+# successful retry supersedes the failure an earlier attempt recorded
+COMPLETED = "completed"
+
+# Order of events at the same timestamp, so the latest status is deterministic
+EVENT_RANK = {RECEIVED: 1, GENERATED: 2, FAILED: 3, EMAILED: 4, COMPLETED: 5}
+
+# Partitioned by day and clustered by RSVP so a status lookup scans very little
+CREATE_EVENTS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS `{EVENTS_TABLE}` (
+  rsvp_id STRING NOT NULL,
+  event STRING NOT NULL,
+  attempt INT64,
+  detail STRING,
+  timestamp TIMESTAMP NOT NULL
+)
+PARTITION BY DATE(timestamp)
+CLUSTER BY rsvp_id
+"""
+
+CREATE_STATUS_VIEW_SQL = f"""
+CREATE OR REPLACE VIEW `{STATUS_VIEW}` AS
+SELECT rsvp_id, event AS status, attempt, detail, timestamp AS updated_at
+FROM `{EVENTS_TABLE}`
+WHERE TRUE
+QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY rsvp_id
+  ORDER BY timestamp DESC, CASE event {" ".join(f"WHEN '{event}' THEN {rank}" for event, rank in EVENT_RANK.items())} END DESC
+) = 1
+"""
+
+LATEST_STATUS_SQL = f"SELECT status, attempt, detail, updated_at FROM `{STATUS_VIEW}` WHERE rsvp_id = @rsvp_id"
+
+def record_event(rsvp_id, event, attempt=None, detail=None):
+    """
+    Queue a lifecycle event for an RSVP
+
+    Args:
+        rsvp_id: The unique ID of the RSVP entry
+        event: One of RECEIVED, GENERATED, EMAILED, FAILED or COMPLETED
+        attempt: Processing attempt the event happened in, if any
+        detail: Optional text such as the email subject or the error
+    """
+    row = {
+        "rsvp_id": rsvp_id,
+        "event": event,
+        "attempt": attempt,
+        "detail": detail,
+        "timestamp": datetime.now().isoformat(),
+    }
+    # One row per event and attempt, so a retried insert is de-duplicated
+    bigquery_writer.insert_row(EVENTS_TABLE, row, row_id=f"{rsvp_id}:{event}:{attempt or 0}")
+
+def _latest(rows):
+    return max(rows, key=lambda row: (row["timestamp"], EVENT_RANK.get(row["event"], 0)))
+
+def get_latest_status(rsvp_id):
+    """
+    Read the current status of an RSVP from its events
+
+    Args:
+        rsvp_id: The unique ID of the RSVP entry
+
+    Returns:
+        Dictionary with status, attempt, detail and updated_at, or None if there are no events
+    """
+    if bigquery_writer.LOCAL_DIR:
+        rows = [row for row in bigquery_writer.get_writer_client().list_rows(EVENTS_TABLE) if row["rsvp_id"] == rsvp_id]
+        if not rows:
+            return None
+        latest = _latest(rows)
+        return {"status": latest["event"], "attempt": latest["attempt"], "detail": latest["detail"], "updated_at": latest["timestamp"]}
+
+    from google.cloud import bigquery
+    from clients import get_bigquery_client
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("rsvp_id", "STRING", rsvp_id)]
+    )
+    rows = list(get_bigquery_client().query(LATEST_STATUS_SQL, job_config=job_config).result())
+    if not rows:
+        return None
+    row = rows[0]
+    return {
+        "status": row["status"],
+        "attempt": row["attempt"],
+        "detail": row["detail"],
+        "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+    }
+
+def create_schema():
+    """
+    Create the events table and the latest-status view if needed
+    """
+    from clients import get_bigquery_client
+    client = get_bigquery_client()
+    client.query(CREATE_EVENTS_TABLE_SQL).result()
+    client.query(CREATE_STATUS_VIEW_SQL).result()
+    print(f"Created {EVENTS_TABLE} and {STATUS_VIEW}")
+
+# Set up the table and view once per project: python rsvp_events.py --create
+if __name__ == "__main__":
+    if "--create" in sys.argv:
+        create_schema()
+    else:
+        print(CREATE_EVENTS_TABLE_SQL + ";\n" + CREATE_STATUS_VIEW_SQL + ";")
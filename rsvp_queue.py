@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+import cloud_tasks
+
+# Which queue runs RSVP processing: "local" (SQLite and a worker thread in this
+# process) or "cloud_tasks" (Cloud Tasks calls back into the rsvp_task endpoint).
+# Cloud Run (K_SERVICE is set) defaults to cloud_tasks: its /tmp is per-instance
+# memory, so a local queue would lose tasks and only its own instance could see them.
+IN_CLOUD_RUN = bool(os.getenv("K_SERVICE"))
+BACKEND = os.getenv("RSVP_QUEUE_BACKEND", "cloud_tasks" if IN_CLOUD_RUN else "local")
+
+# SQLite file for the local queue; ":memory:" keeps tasks in process only
+LOCAL_DB_PATH = os.getenv("RSVP_QUEUE_DB", os.path.join(tempfile.gettempdir(), "rsvp_queue.sqlite3"))
+POLL_SECONDS = 1.0
+
+# Attempts per task before it is marked failed, and the first retry delay (doubled each attempt)
+MAX_ATTEMPTS = int(os.getenv("RSVP_TASK_MAX_ATTEMPTS", "5"))
+RETRY_SECONDS = float(os.getenv("RSVP_TASK_RETRY_SECONDS", "10"))
+
+# Cloud Tasks queue ("projects/<project>/locations/<location>/queues/<queue>"), the
+# rsvp_task URL it calls and the service account whose OIDC token it sends, which
+# the rsvp_task endpoint checks
+TASKS_QUEUE = os.getenv("RSVP_TASKS_QUEUE")
+TASK_URL = os.getenv("RSVP_TASK_URL")
+TASK_SERVICE_ACCOUNT = os.getenv("RSVP_TASK_SERVICE_ACCOUNT")
+
+# Task records for the Cloud Tasks backend live in GCS so any instance can read them
+BUCKET_NAME = "sullstice"
+STATUS_FOLDER = "rsvp_status"
+
+# Task statuses
+QUEUED = "queued"
+PROCESSING = "processing"
+RETRYING = "retrying"
+DONE = "done"
+FAILED = "failed"
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def new_task(task_id, payload):
+    """
+    Create the record for a new task
+
+    Args:
+        task_id: Unique ID, also used to look the task up
+        payload: JSON-serializable dictionary the handler works on
+
+    Returns:
+        Task dictionary with status, attempts, completed steps, result and error
+    """
+    now = datetime.now().isoformat()
+    return {
+        "id": task_id,
+        "payload": payload,
+        "status": QUEUED,
+        "attempts": 0,
+        "steps": [],
+        "result": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+class TaskQueue:
+    """
+    Shared attempt bookkeeping for the queue backends
+
+    A handler is called as handler(task, save). It should record progress in
+    task["steps"] and task["result"] and call save(task) after each step, so a
+    retry can skip the steps that already succeeded. Raising marks the attempt
+    as failed.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def save(self, task):
+        raise NotImplementedError
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def enqueue(self, task_id, payload):
+        raise NotImplementedError
+
+    def run_task(self, task):
+        """
+        Run one attempt of a task and record the outcome
+
+        Args:
+            task: Task dictionary
+
+        Returns:
+            True if the task is finished (done or out of attempts), False if it should be retried
+        """
+        task["status"] = PROCESSING
+        task["attempts"] += 1
+        self.save(task)
+        started = time.perf_counter()
+        try:
+            self.handler(task, self.save)
+        except Exception as e:
+            task["error"] = str(e)
+            task["status"] = FAILED if task["attempts"] >= MAX_ATTEMPTS else RETRYING
+            self.save(task)
+            logging.error(f"RSVP task {task['id']} attempt {task['attempts']} failed: {e}")
+            return task["status"] == FAILED
+        task["status"] = DONE
+        task["error"] = None
+        self.save(task)
+        logging.info(json.dumps({
+            "metric": "rsvp_task",
+            "id": task["id"],
+            "attempts": task["attempts"],
+            "ms": round((time.perf_counter() - started) * 1000),
+        }))
+        return True
+
+class LocalQueue(TaskQueue):
+    """
+    Task queue in a SQLite file, worked by a background thread in this process
+
+    Suited to development and single-instance deployments with CPU allocated
+    outside requests. Tasks left processing by a previous process are retried
+    when the queue is opened.
+    """
+
+    def __init__(self, handler, path=LOCAL_DB_PATH):
+        super().__init__(handler)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, next_attempt_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._db.execute("UPDATE tasks SET status = ? WHERE status = ?", (RETRYING, PROCESSING))
+        self._thread = threading.Thread(target=self._work, name="rsvp-queue", daemon=True)
+        self._thread.start()
+
+    def save(self, task, next_attempt_at=None):
+        task["updated_at"] = datetime.now().isoformat()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tasks (id, status, next_attempt_at, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, data = excluded.data, "
+                "next_attempt_at = COALESCE(?, tasks.next_attempt_at)",
+                (task["id"], task["status"], next_attempt_at or time.time(), json.dumps(task), next_attempt_at)
+            )
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def enqueue(self, task_id, payload):
+        self.save(new_task(task_id, payload), next_attempt_at=time.time())
+        self._wake.set()
+
+    def _claim(self):
+        """
+        Take the next due task, marking it processing so no other worker picks it up
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, data FROM tasks WHERE status IN (?, ?) AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (QUEUED, RETRYING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE tasks SET status = ? WHERE id = ?", (PROCESSING, row[0]))
+        return json.loads(row[1])
+
+    def _work(self):
+        while True:
+            task = self._claim()
+            if task is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            try:
+                if not self.run_task(task):
+                    delay = RETRY_SECONDS * 2 ** (task["attempts"] - 1)
+                    self.save(task, next_attempt_at=time.time() + delay)
+            except Exception as e:
+                # Bookkeeping itself failed; leave the task for the next start-up
+                logging.error(f"RSVP queue worker error on {task['id']}: {e}")
+
+class CloudTasksQueue(TaskQueue):
+    """
+    Task queue on Cloud Tasks, with task records in GCS
+
+    Each task is an HTTP call to the rsvp_task endpoint carrying the task ID.
+    Cloud Tasks retries the call with backoff while the endpoint returns an
+    error, so retry timing is configured on the Cloud Tasks queue.
+    """
+
+    def _blob(self, task_id):
+        from clients import get_storage_client
+        return get_storage_client().bucket(BUCKET_NAME).blob(f"{STATUS_FOLDER}/{task_id}.json")
+
+    def save(self, task):
+        task["updated_at"] = datetime.now().isoformat()
+        self._blob(task["id"]).upload_from_string(json.dumps(task), content_type="application/json")
+
+    def get(self, task_id):
+        blob = self._blob(task_id)
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+
+    def enqueue(self, task_id, payload):
+        self.save(new_task(task_id, payload))
+        # Naming the task after the RSVP makes a repeated enqueue a no-op
+        cloud_tasks.create_http_task(TASKS_QUEUE, TASK_URL, {"id": task_id}, TASK_SERVICE_ACCOUNT, name=f"rsvp-{task_id}")
+
+    def verify_request(self, headers):
+        """
+        Check that a call to the rsvp_task endpoint came from our Cloud Tasks queue
+        """
+        return cloud_tasks.verify_request(headers, TASK_URL, TASK_SERVICE_ACCOUNT)
+
+    def handle(self, task_id):
+        """
+        Run one attempt of a task on behalf of a Cloud Tasks call
+
+        Raises when the attempt failed and should be retried, so the endpoint
+        returns an error and Cloud Tasks schedules another call.
+
+        Returns:
+            The task dictionary, or None if there is no such task
+        """
+        task = self.get(task_id)
+        if task is None or task["status"] in (DONE, FAILED):
+            return task
+        if not self.run_task(task):
+            raise RuntimeError(f"RSVP task {task_id} will be retried: {task['error']}")
+        return task
+
+def get_queue(handler):
+    """
+    Get the process-wide RSVP task queue for the configured backend
+
+    Args:
+        handler: Callable run for each task, see TaskQueue
+
+    Returns:
+        LocalQueue or CloudTasksQueue
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if BACKEND == "cloud_tasks":
+                if not TASKS_QUEUE or not TASK_URL or not TASK_SERVICE_ACCOUNT:
+                    raise ValueError(
+                        "RSVP_TASKS_QUEUE, RSVP_TASK_URL and RSVP_TASK_SERVICE_ACCOUNT must be set for the cloud_tasks queue"
+                    )
+                _queue = CloudTasksQueue(handler)
+            else:
+                if IN_CLOUD_RUN:
+                    logging.error("RSVP queue is local on Cloud Run; tasks are lost when this instance stops")
+                _queue = LocalQueue(handler)
+        return _queue
@@ -0,0 +1,64 @@
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+
+# Total seconds the flush callbacks may take on shutdown. Cloud Run sends
+# SIGTERM and kills the instance 10 seconds later, so this leaves some slack.
+SHUTDOWN_FLUSH_SECONDS = float(os.getenv("SHUTDOWN_FLUSH_SECONDS", "7"))
+
+_callbacks = []
+_lock = threading.Lock()
+_installed = False
+_previous_handler = None
+
+def _run_callbacks():
+    """
+    Call each registered callback with the time left in the shutdown budget
+    """
+    deadline = time.monotonic() + SHUTDOWN_FLUSH_SECONDS
+    with _lock:
+        callbacks = list(_callbacks)
+    for callback in callbacks:
+        try:
+            callback(max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            logging.error(f"Shutdown callback {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+def _handle_sigterm(signum, frame):
+    _run_callbacks()
+    # Hand over to whoever handled SIGTERM before us, e.g. the gunicorn worker
+    if callable(_previous_handler):
+        _previous_handler(signum, frame)
+    elif _previous_handler != signal.SIG_IGN:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+def _install():
+    global _installed, _previous_handler
+    if _installed:
+        return
+    _installed = True
+    atexit.register(_run_callbacks)
+    try:
+        _previous_handler = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError:
+        # Signal handlers can only be set from the main thread; exits still run the callbacks
+        logging.warning("Could not install SIGTERM handler outside the main thread")
+
+def on_shutdown(callback):
+    """
+    Run a callback when the instance shuts down, on SIGTERM as well as at exit
+
+    atexit handlers do not run when Cloud Run stops an instance with SIGTERM,
+    so background writers register their flush here instead.
+
+    Args:
+        callback: Callable taking the seconds it may take at most
+    """
+    with _lock:
+        _callbacks.append(callback)
+        _install()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import subprocess
+import sys
+
+def measure_import_times(module="main"):
+    """
+    Import a module in a fresh interpreter with -X importtime and parse the results
+
+    Args:
+        module: Name of the module to import
+
+    Returns:
+        List of (module name, self microseconds, cumulative microseconds) tuples
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        # Lines look like: "import time:       123 |        456 |   package.module"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+def summarize_by_package(timings):
+    """
+    Total the self time of every imported module by its top-level package
+
+    Args:
+        timings: List from measure_import_times
+
+    Returns:
+        List of (package, microseconds, module count) tuples, slowest first
+    """
+    totals = {}
+    for name, self_us, _ in timings:
+        package = name.split(".")[0]
+        total, count = totals.get(package, (0, 0))
+        totals[package] = (total + self_us, count + 1)
+    return sorted(((package, total, count) for package, (total, count) in totals.items()),
+                  key=lambda row: row[1], reverse=True)
+
+def format_report(timings, top=20):
+    """
+    Format an import-time report
+
+    Args:
+        timings: List from measure_import_times
+        top: Number of packages to list
+
+    Returns:
+        String containing the report
+    """
+    packages = summarize_by_package(timings)
+    total_us = sum(total for _, total, _ in packages)
+
+    lines = [f"Total import time: {total_us / 1000:.1f} ms across {len(timings)} modules", ""]
+    lines.append(f"{'package':<32}{'ms':>10}{'share':>8}{'modules':>9}")
+    for package, package_us, count in packages[:top]:
+        share = package_us / total_us * 100 if total_us else 0
+        lines.append(f"{package:<32}{package_us / 1000:>10.1f}{share:>7.1f}%{count:>9}")
+    return "\n".join(lines)
+
+# Run locally or in CI to track cold-start import cost, e.g. python startup_report.py --top 15
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize python -X importtime per package")
+    parser.add_argument("module", nargs="?", default="main", help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=20, help="Number of packages to show")
+    args = parser.parse_args()
+
+    print(format_report(measure_import_times(args.module), args.top))
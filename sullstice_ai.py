@@ -1,7 +1,9 @@
 import os
-import openai
+import json
 import logging
 import re
+import answer_cache
+from generation_policy import PRIMARY, generate
 from person_identifier import build_person_context, format_relationship_context
 from prompt_builder import build_rsvp_attending_prompt, build_rsvp_not_attending_prompt, build_question_prompt
 
@@ -10,9 +12,31 @@ def get_openai_api_key():
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         logging.warning("OPENAI_API_KEY environment variable not set. OpenAI functions will fail.")
-    openai.api_key = api_key
     return api_key
 
+def has_content(response):
+    """Check that a chat completion has a non-empty answer"""
+    return bool(response.choices and (response.choices[0].message.content or "").strip())
+
+def record_usage(endpoint, usage):
+    """
+    Log token usage for an OpenAI call, including prompt tokens served from the provider's prompt cache
+
+    Args:
+        endpoint: Name of the calling endpoint, e.g. "rsvp" or "questions"
+        usage: Usage object from a completion response, or None
+    """
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    logging.info(json.dumps({
+        "metric": "openai_usage",
+        "endpoint": endpoint,
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+        "completion_tokens": usage.completion_tokens,
+    }))
+
 def generate_rsvp_response(rsvp_data):
     """
     Generate a personalized response to an RSVP using OpenAI
@@ -34,11 +58,11 @@ def generate_rsvp_response(rsvp_data):
 
     # Build appropriate prompt based on attendance
     if can_attend:
-        prompt = build_rsvp_attending_prompt(
+        prefix, prompt = build_rsvp_attending_prompt(
             rsvp_data, personalization, relationship_context, relationship_levels_text
         )
     else:
-        prompt = build_rsvp_not_attending_prompt(
+        prefix, prompt = build_rsvp_not_attending_prompt(
             rsvp_data, personalization, relationship_context, relationship_levels_text
         )
 
@@ -49,16 +73,19 @@ def generate_rsvp_response(rsvp_data):
             raise ValueError("OpenAI API key is not set. Please set the OPENAI_API_KEY environment variable.")
         
         # Call OpenAI API
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-4",  # Upgrade to GPT-4 for better personalization
+        # The policy hedges to a faster model when GPT-4 is slow and raises at the deadline,
+        # which falls through to the templated response below
+        response = generate(
+            "rsvp",
+            is_good=has_content,
             messages=[
-                {"role": "system", "content": f"You are the host of Sullstice. Your name is {personalization['they_call_me']} (Andrew Sullivan), writing a personalized RSVP response."},
+                {"role": "system", "content": prefix},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1000,
             temperature=0.7,
         )
+        record_usage("rsvp", response.usage)
         
         # Extract and parse the generated response
         ai_response = response.choices[0].message.content.strip()
@@ -125,6 +152,9 @@ Remember that we do this event every summer solstice, so hopefully you can join
             "body": body
         }
 
+NO_API_KEY_ANSWER = "I couldn't access the necessary information to answer your question. Please email sullhouse@gmail.com for assistance."
+FALLBACK_ANSWER = "I couldn't find specific information about that. Please email sullhouse@gmail.com for more details."
+
 def answer_question(question):
     """
     Generate a specific answer to a question about Sullstice
@@ -139,31 +169,92 @@ def answer_question(question):
     api_key = get_openai_api_key()
     if not api_key:
         logging.warning("OPENAI_API_KEY environment variable not set. OpenAI functions will fail.")
-        return "I couldn't access the necessary information to answer your question. Please email sullhouse@gmail.com for assistance."
+        return NO_API_KEY_ANSWER
+    
+    # Reuse an answer to the same or a near-identical question about the same documents
+    cached_answer, cache_context = answer_cache.lookup(question)
+    if cached_answer:
+        return cached_answer
     
     # Build the prompt using the function from prompt_builder
-    prompt = build_question_prompt(question)
+    prefix, prompt = build_question_prompt(question)
         
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-4",  # Upgraded to GPT-4 for better question answering
+        response, path = generate(
+            "questions",
+            is_good=has_content,
+            with_path=True,
             messages=[
-                {"role": "system", "content": """You are a helpful assistant for Sullstice, a multi-day camping event. 
-When answering questions:
-1. Prioritize information from the current year's details and lineup that are being pulled from live Google Docs
-2. If the current year's information doesn't fully address the question, you can reference how things worked in 2024, but clearly indicate that this is historical information and things might be different this year
-3. Be conversational and friendly in your tone
-4. Be concise but thorough
-5. If the question is about something not mentioned in any of the provided information, acknowledge this and suggest contacting Andrew directly at sullhouse@gmail.com"""},
+                {"role": "system", "content": prefix},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=500,
             temperature=0.5,
         )
+        record_usage("questions", response.usage)
         
-        return response.choices[0].message.content.strip()
+        answer = response.choices[0].message.content.strip()
+        # Only the primary model's answers are cached; a hedge answer is served once
+        if path == PRIMARY:
+            answer_cache.store(question, answer, cache_context)
+        return answer
     
     except Exception as e:
         logging.error(f"Error generating answer to question: {e}")
-        return "I couldn't find specific information about that. Please email sullhouse@gmail.com for more details."
+        return FALLBACK_ANSWER
+
+def stream_answer(question):
+    """
+    Generate an answer to a question about Sullstice, yielding text as it arrives
+    
+    Args:
+        question: String containing the question
+        
+    Yields:
+        Strings containing consecutive pieces of the answer
+    """
+    api_key = get_openai_api_key()
+    if not api_key:
+        logging.warning("OPENAI_API_KEY environment variable not set. OpenAI functions will fail.")
+        yield NO_API_KEY_ANSWER
+        return
+    
+    cached_answer, cache_context = answer_cache.lookup(question)
+    if cached_answer:
+        yield cached_answer
+        return
+    
+    prefix, prompt = build_question_prompt(question)
+    
+    pieces = []
+    try:
+        # A hedged stream wins by starting first
+        stream, path = generate(
+            "questions",
+            with_path=True,
+            messages=[
+                {"role": "system", "content": prefix},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=500,
+            temperature=0.5,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        
+        for chunk in stream:
+            # The final chunk carries usage and no choices
+            if chunk.usage:
+                record_usage("questions", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        
+        if path == PRIMARY:
+            answer_cache.store(question, "".join(pieces).strip(), cache_context)
+    
+    except Exception as e:
+        logging.error(f"Error streaming answer to question: {e}")
+        # Only fall back if the client has not already received part of an answer
+        if not pieces:
+            yield FALLBACK_ANSWER
@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Most steps running at once across all graphs in this process
+MAX_WORKERS = int(os.getenv("TASK_GRAPH_WORKERS", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="task-graph")
+        return _executor
+
+def _timed(run):
+    started = time.perf_counter()
+    value = run()
+    return value, round((time.perf_counter() - started) * 1000)
+
+def run_graph(steps):
+    """
+    Run steps as soon as the steps they depend on have succeeded
+
+    Independent steps run concurrently on a shared, bounded executor. A step
+    that raises is recorded as an error, and the steps that depend on it are
+    skipped; the other steps still run.
+
+    Args:
+        steps: Dictionary mapping step name to (list of dependency names, callable with no arguments)
+
+    Returns:
+        Tuple of (results, errors, timings): dictionaries mapping step name to
+        its return value, its error message, and its duration in milliseconds
+    """
+    results = {}
+    errors = {}
+    timings = {}
+    pending = dict(steps)
+    running = {}
+    executor = _get_executor()
+
+    while pending or running:
+        for name, (depends_on, run) in list(pending.items()):
+            failed = [dependency for dependency in depends_on if dependency in errors]
+            if failed:
+                errors[name] = f"skipped because {', '.join(failed)} failed"
+                del pending[name]
+            elif all(dependency in results for dependency in depends_on):
+                running[executor.submit(_timed, run)] = name
+                del pending[name]
+
+        if not running:
+            # Nothing can start: the remaining steps depend on unknown steps
+            for name in pending:
+                errors[name] = "skipped because its dependencies never ran"
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name], timings[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e) or type(e).__name__
+                logging.error(f"Step {name} failed: {e}")
+
+    return results, errors, timings
@@ -0,0 +1,53 @@
+import time
+from background_writer import BackgroundWriter
+
+def make_writer(due_after=None):
+    """
+    Writer that buffers items and writes them on flush, or due_after seconds after the first
+    """
+    buffered = []
+    written = []
+    first = []
+
+    def add(item):
+        if not buffered:
+            first[:] = [time.monotonic()]
+        buffered.append(item)
+
+    def write(flushing):
+        if not buffered:
+            return None
+        age = time.monotonic() - first[0]
+        if flushing or (due_after is not None and age >= due_after):
+            written.append(list(buffered))
+            buffered.clear()
+            return None
+        return None if due_after is None else due_after - age
+
+    return BackgroundWriter("test-writer", add, write, 100), written
+
+def test_flush_writes_everything_queued():
+    writer, written = make_writer()
+    for item in range(3):
+        writer.put(item)
+
+    writer.flush(5)
+
+    assert written == [[0, 1, 2]]
+    assert writer.waiting() == 0
+
+def test_writer_wakes_up_when_a_batch_is_due():
+    writer, written = make_writer(due_after=0.1)
+    writer.put("a")
+
+    time.sleep(0.5)
+
+    assert written == [["a"]]
+
+def test_flush_before_anything_is_queued_returns_at_once():
+    writer, _ = make_writer()
+    started = time.monotonic()
+
+    writer.flush(5)
+
+    assert time.monotonic() - started < 0.1
@@ -0,0 +1,112 @@
+import json
+import os
+import pytest
+import bigquery_writer
+import clients
+from local_bigquery import LocalBigQueryClient
+
+TABLE = "guests.test_rows"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    Point the writer at a fresh local stand-in and spill directory, with no retry delays
+    """
+    local = LocalBigQueryClient(str(tmp_path / "bigquery"))
+    monkeypatch.setitem(clients._clients, "bigquery_local", local)
+    monkeypatch.setattr(bigquery_writer, "LOCAL_DIR", str(tmp_path / "bigquery"))
+    monkeypatch.setattr(bigquery_writer, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(bigquery_writer, "RETRY_SECONDS", 0)
+    monkeypatch.setattr(bigquery_writer, "MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(bigquery_writer, "REPLAY_SECONDS", 3600)
+    yield local
+    # Leave the shared writer thread idle before the settings are restored
+    local.unavailable = False
+    bigquery_writer.flush(5)
+    bigquery_writer._spill_pending = False
+
+def spilled_files():
+    try:
+        return [name for name in os.listdir(bigquery_writer.SPILL_DIR) if name.endswith(".ndjson")]
+    except FileNotFoundError:
+        return []
+
+def dead_lettered_rows():
+    directory = os.path.join(bigquery_writer.SPILL_DIR, bigquery_writer.DEAD_LETTER_FOLDER)
+    rows = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            rows.extend(json.loads(line) for line in f if line.strip())
+    return rows
+
+def replay_now(monkeypatch):
+    monkeypatch.setattr(bigquery_writer, "REPLAY_SECONDS", 0)
+    bigquery_writer.flush(5)
+    monkeypatch.setattr(bigquery_writer, "REPLAY_SECONDS", 3600)
+
+def test_write_rows_retries_a_failed_insert(client, monkeypatch):
+    insert = client.insert_rows_json
+
+    def fail_once(*args, **kwargs):
+        monkeypatch.setattr(client, "insert_rows_json", insert)
+        raise ConnectionError("BigQuery is down")
+
+    monkeypatch.setattr(client, "insert_rows_json", fail_once)
+    retried = bigquery_writer.get_stats()["retried"]
+
+    assert bigquery_writer.write_rows(TABLE, [({"id": "a"}, "a")])
+    assert client.list_rows(TABLE) == [{"id": "a"}]
+    assert bigquery_writer.get_stats()["retried"] == retried + 1
+
+def test_write_rows_leaves_unwritten_rows_to_the_caller(client):
+    client.unavailable = True
+
+    assert not bigquery_writer.write_rows(TABLE, [({"id": "a"}, "a")])
+    assert spilled_files() == []
+
+def test_write_rows_dead_letters_invalid_rows_without_retrying(client):
+    client.reject_next = 1
+    dead_lettered = bigquery_writer.get_stats()["dead_lettered"]
+
+    assert not bigquery_writer.write_rows(TABLE, [({"id": "bad"}, "bad"), ({"id": "good"}, "good")])
+    # The row BigQuery only stopped because of the invalid one goes in on the retry
+    assert client.list_rows(TABLE) == [{"id": "good"}]
+    assert [row["row_id"] for row in dead_lettered_rows()] == ["bad"]
+    assert bigquery_writer.get_stats()["dead_lettered"] == dead_lettered + 1
+
+def test_unwritten_rows_are_spilled_and_replayed(client, monkeypatch):
+    client.unavailable = True
+    bigquery_writer.insert_row(TABLE, {"id": "a"}, row_id="a")
+    bigquery_writer.insert_row(TABLE, {"id": "b"}, row_id="b")
+    bigquery_writer.flush(5)
+
+    assert len(spilled_files()) == 1
+    assert client.list_rows(TABLE) == []
+
+    client.unavailable = False
+    replay_now(monkeypatch)
+
+    assert spilled_files() == []
+    assert client.list_rows(TABLE) == [{"id": "a"}, {"id": "b"}]
+
+def test_replay_dead_letters_rows_rejected_for_good(client, monkeypatch):
+    client.unavailable = True
+    bigquery_writer.insert_row(TABLE, {"id": "bad"}, row_id="bad")
+    bigquery_writer.insert_row(TABLE, {"id": "good"}, row_id="good")
+    bigquery_writer.flush(5)
+    assert len(spilled_files()) == 1
+
+    client.unavailable = False
+    client.reject_next = 1
+    replay_now(monkeypatch)
+    # The stopped row is spilled again on its own and goes in on the next replay
+    replay_now(monkeypatch)
+
+    assert spilled_files() == []
+    assert client.list_rows(TABLE) == [{"id": "good"}]
+    assert [row["row_id"] for row in dead_lettered_rows()] == ["bad"]
+
+    # Nothing is left to come back on later replays
+    replay_now(monkeypatch)
+    assert spilled_files() == []
+    assert client.list_rows(TABLE) == [{"id": "good"}]
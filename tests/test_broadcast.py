@@ -0,0 +1,68 @@
+import pytest
+import aws_email
+import bigquery_writer
+import broadcast
+import clients
+from local_bigquery import LocalBigQueryClient
+from local_ses import LocalSESClient
+
+@pytest.fixture
+def rsvps(tmp_path, monkeypatch):
+    """
+    Local BigQuery and SES stand-ins, with broadcast checkpoints in a temporary directory
+    """
+    local = LocalBigQueryClient(str(tmp_path / "bigquery"))
+    monkeypatch.setitem(clients._clients, "bigquery_local", local)
+    monkeypatch.setattr(bigquery_writer, "LOCAL_DIR", str(tmp_path / "bigquery"))
+    monkeypatch.setitem(clients._clients, "ses_local", LocalSESClient(str(tmp_path / "ses")))
+    monkeypatch.setattr(aws_email, "SES_LOCAL_DIR", str(tmp_path / "ses"))
+    monkeypatch.setattr(broadcast, "LOCAL_DIR", str(tmp_path / "broadcasts"))
+    return local
+
+def rsvp(email, can_attend, timestamp, arriving="Friday"):
+    return {
+        "name": email.split("@")[0].title(),
+        "email": email,
+        "can_attend": can_attend,
+        "arriving": arriving,
+        "departing": "Sunday",
+        "camping": "Yes",
+        "timestamp": timestamp,
+    }
+
+def test_guest_who_changed_their_rsvp_is_matched_on_the_latest_one(rsvps):
+    rsvps.insert_rows_json("guests.rsvp", [
+        rsvp("jon@example.com", "Yes", "2026-06-01T10:00:00"),
+        rsvp("jon@example.com", "No", "2026-06-05T10:00:00"),
+        rsvp("ann@example.com", "No", "2026-06-01T10:00:00"),
+        rsvp("ANN@example.com", "Yes", "2026-06-05T10:00:00"),
+    ])
+
+    attending = [attendee["email"] for attendee in broadcast.iter_attendees("yes")]
+    declined = [attendee["email"] for attendee in broadcast.iter_attendees("no")]
+
+    assert attending == ["ANN@example.com"]
+    assert declined == ["jon@example.com"]
+
+def test_arrival_filter_uses_the_latest_rsvp(rsvps):
+    rsvps.insert_rows_json("guests.rsvp", [
+        rsvp("jon@example.com", "Yes", "2026-06-01T10:00:00", arriving="Friday"),
+        rsvp("jon@example.com", "Yes", "2026-06-05T10:00:00", arriving="Saturday"),
+    ])
+
+    assert list(broadcast.iter_attendees("yes", "friday")) == []
+    assert [attendee["arriving"] for attendee in broadcast.iter_attendees("yes", "saturday")] == ["Saturday"]
+
+def test_broadcast_skips_guests_who_no_longer_attend(rsvps):
+    rsvps.insert_rows_json("guests.rsvp", [
+        rsvp("jon@example.com", "Yes", "2026-06-01T10:00:00"),
+        rsvp("jon@example.com", "No", "2026-06-05T10:00:00"),
+        rsvp("ann@example.com", "Yes", "2026-06-01T10:00:00"),
+    ])
+    broadcast.save_template("update", "Hi {{name}}", "See you {{arriving}}")
+
+    summary = broadcast.run_broadcast("update-1", "update")
+
+    sent = aws_email.get_ses_client().list_sent()
+    assert summary["sent"] == 1
+    assert [message["Destination"]["ToAddresses"] for message in sent] == [["ann@example.com"]]
@@ -0,0 +1,113 @@
+import time
+import pytest
+import email_outbox
+from local_ses import LocalSESClient, LocalSESError
+
+@pytest.fixture
+def ses(tmp_path, monkeypatch):
+    """
+    Local SES stand-in, with short retry delays and polling
+    """
+    monkeypatch.setattr(email_outbox, "RETRY_SECONDS", 0.2)
+    monkeypatch.setattr(email_outbox, "POLL_SECONDS", 0.01)
+    monkeypatch.setattr(email_outbox, "WORKERS", 1)
+    return LocalSESClient(str(tmp_path / "ses"))
+
+@pytest.fixture
+def outbox(ses, tmp_path):
+    return email_outbox.Outbox(lambda **params: ses.send_email(**params), str(tmp_path / "outbox.sqlite3"))
+
+def email(recipient="guest@example.com"):
+    return {"Source": "sullhouse@sullstice.com", "Destination": {"ToAddresses": [recipient]}}
+
+def wait_until_done(outbox, email_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = outbox.get(email_id)
+        if status["status"] in (email_outbox.SENT, email_outbox.FAILED):
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"Email {email_id} still {status['status']} after {timeout} s")
+
+def test_throttled_email_is_retried_with_backoff(outbox, ses):
+    ses.throttle_next = 2
+    started = time.monotonic()
+
+    status = wait_until_done(outbox, outbox.enqueue(email()))
+
+    assert status["status"] == email_outbox.SENT
+    assert status["attempts"] == 3
+    assert status["message_id"].startswith("local-")
+    # Retried after 0.2 s and then 0.4 s
+    assert time.monotonic() - started >= 0.6
+    assert len(ses.list_sent()) == 1
+
+def test_rejected_email_is_not_retried(outbox, ses):
+    ses.reject_next = 1
+
+    status = wait_until_done(outbox, outbox.enqueue(email()))
+
+    assert status["status"] == email_outbox.FAILED
+    assert status["attempts"] == 1
+    assert "MessageRejected" in status["error"]
+    assert ses.list_sent() == []
+
+def test_throttled_email_fails_after_max_attempts(outbox, ses, monkeypatch):
+    monkeypatch.setattr(email_outbox, "MAX_ATTEMPTS", 2)
+    ses.throttle_next = 5
+
+    status = wait_until_done(outbox, outbox.enqueue(email()))
+
+    assert status["status"] == email_outbox.FAILED
+    assert status["attempts"] == 2
+    assert "Throttling" in status["error"]
+
+def test_repeated_dedupe_key_is_sent_once(outbox, ses):
+    first = outbox.enqueue(email(), dedupe_key="rsvp-1:guest_email")
+    second = outbox.enqueue(email(), dedupe_key="rsvp-1:guest_email")
+
+    assert first == second
+    assert wait_until_done(outbox, first)["status"] == email_outbox.SENT
+    assert len(ses.list_sent()) == 1
+
+def test_token_bucket_keeps_to_its_rate():
+    bucket = email_outbox.TokenBucket(20, 2)
+    started = time.monotonic()
+
+    for _ in range(6):
+        bucket.acquire()
+
+    # Two tokens burst, the other four come at 20 per second
+    assert time.monotonic() - started >= 0.19
+
+def test_cloud_tasks_outbox_raises_throttling_for_a_retry(ses):
+    outbox = email_outbox.CloudTasksOutbox(lambda **params: ses.send_email(**params))
+    ses.throttle_next = 1
+
+    with pytest.raises(LocalSESError):
+        outbox.handle("email-1", email(), 1)
+    status = outbox.handle("email-1", email(), 2)
+
+    assert status["status"] == email_outbox.SENT
+    assert status["attempts"] == 2
+
+def test_cloud_tasks_outbox_drops_rejected_email(ses):
+    outbox = email_outbox.CloudTasksOutbox(lambda **params: ses.send_email(**params))
+    ses.reject_next = 1
+
+    status = outbox.handle("email-1", email(), 1)
+
+    assert status["status"] == email_outbox.FAILED
+    assert ses.list_sent() == []
+
+def test_token_bucket_takes_more_than_its_capacity_in_steps():
+    bucket = email_outbox.TokenBucket(20, 2)
+    started = time.monotonic()
+
+    bucket.acquire(6)
+
+    assert time.monotonic() - started >= 0.19
+
+def test_outbox_shares_the_send_limiter(outbox):
+    assert outbox.bucket is email_outbox.get_send_limiter()
+    assert outbox.bucket.capacity <= email_outbox.SEND_RATE
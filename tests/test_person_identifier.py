@@ -0,0 +1,42 @@
+import pytest
+from get_people_from_sheet import Person
+from person_identifier import build_person_index, find_person
+
+@pytest.fixture
+def index():
+    people = [
+        Person("Jon Smith", "jon.smith@example.com", "Jonny", "Andrew", "Cousin", "3"),
+        Person("Michael Brown", "mbrown@example.com", "Mike", "Drew", "College friend", "4"),
+        Person("Sarah Lee", "sarah@example.com", "", "", "Neighbour", "6"),
+    ]
+    people_data = {person.name.lower(): person for person in people}
+    people_by_email = {person.email.lower(): person for person in people}
+    return build_person_index(people_data, people_by_email)
+
+def matched_name(query, index):
+    person, _ = find_person(query, index)
+    return person.name if person else None
+
+@pytest.mark.parametrize("query", ["Dan Smith", "Ann Smith", "Tom Smith", "Jen Smith"])
+def test_relative_sharing_a_surname_is_not_matched(query, index):
+    assert matched_name(query, index) is None
+
+def test_unknown_email_sharing_a_surname_is_not_matched(index):
+    assert matched_name("dan.smith@example.org", index) is None
+
+@pytest.mark.parametrize("query, name", [
+    ("Jon Smith", "Jon Smith"),
+    ("jon smith ", "Jon Smith"),
+    ("Jon Smyth", "Jon Smith"),
+    ("J. Smith", "Jon Smith"),
+    ("Jonny Smith", "Jon Smith"),
+    ("Micheal Brown", "Michael Brown"),
+    ("Mike Brown", "Michael Brown"),
+    ("jon.smith@example.org", "Jon Smith"),
+    ("Sarah", "Sarah Lee"),
+])
+def test_close_spellings_still_match(query, name, index):
+    assert matched_name(query, index) == name
+
+def test_initials_alone_do_not_match(index):
+    assert matched_name("J. S.", index) is None
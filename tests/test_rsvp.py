@@ -0,0 +1,62 @@
+import pytest
+import aws_email
+import bigquery_writer
+import clients
+import rsvp
+import rsvp_events
+import rsvp_queue
+import sullstice_ai
+from local_bigquery import LocalBigQueryClient
+
+@pytest.fixture
+def sent(tmp_path, monkeypatch):
+    """
+    Local BigQuery stand-in and a recorded send_email, with the AI reply stubbed
+    """
+    local = LocalBigQueryClient(str(tmp_path / "bigquery"))
+    monkeypatch.setitem(clients._clients, "bigquery_local", local)
+    monkeypatch.setattr(bigquery_writer, "LOCAL_DIR", str(tmp_path / "bigquery"))
+    monkeypatch.setattr(bigquery_writer, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(sullstice_ai, "generate_rsvp_response", lambda rsvp_data: {"subject": "See you there", "body": "Hi"})
+    sent = []
+
+    def send_email(subject, body, recipient_email, *args, **kwargs):
+        sent.append(recipient_email)
+        return {"OutboxId": str(len(sent))}
+
+    monkeypatch.setattr(aws_email, "send_email", send_email)
+    yield sent
+    bigquery_writer.flush(5)
+
+def new_task():
+    rsvp_data, _ = rsvp.validate_rsvp({"name": "Jon Smith", "email": "jon@example.com", "can_attend": "Yes"})
+    rsvp_data["id"] = "rsvp-1"
+    task = rsvp_queue.new_task("rsvp-1", rsvp_data)
+    task["attempts"] = 1
+    return task
+
+def test_successful_attempt_records_completed(sent):
+    task = new_task()
+
+    rsvp.process_rsvp(task, lambda task: None)
+
+    assert rsvp_events.get_latest_status("rsvp-1")["status"] == rsvp_events.COMPLETED
+    assert sorted(sent) == sorted([rsvp.ADMIN_EMAIL, "jon@example.com"])
+
+def test_successful_retry_supersedes_the_failure(sent, monkeypatch):
+    task = new_task()
+    store_ai_response = rsvp.store_ai_response_in_bigquery
+    monkeypatch.setattr(rsvp, "store_ai_response_in_bigquery", lambda *args: False)
+
+    with pytest.raises(RuntimeError):
+        rsvp.process_rsvp(task, lambda task: None)
+    assert rsvp_events.get_latest_status("rsvp-1")["status"] == rsvp_events.FAILED
+
+    # The retry only has the response row left to write, which records no step event
+    monkeypatch.setattr(rsvp, "store_ai_response_in_bigquery", store_ai_response)
+    task["attempts"] = 2
+    rsvp.process_rsvp(task, lambda task: None)
+
+    status = rsvp_events.get_latest_status("rsvp-1")
+    assert status["status"] == rsvp_events.COMPLETED
+    assert status["attempt"] == 2
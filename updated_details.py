@@ -1,7 +1,6 @@
 import logging
 import os
 import json
-import boto3
 from data_loader import load_updated_event_details
 from html_generator import generate_details_html
 from flask import Response
@@ -57,6 +56,7 @@ def upload_to_s3(html_content, file_path='details.html'):
         bucket_name = 'sullstice.com'  # Replace with your actual bucket name
         
         # Initialize S3 client
+        import boto3
         s3_client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key,
@@ -95,6 +95,7 @@ def create_cloudfront_invalidation(paths=['/details.html']):
         aws_access_key, aws_secret_key, aws_region, cloudfront_distrubution_id = get_aws_credentials()
         
         # Initialize CloudFront client
+        import boto3
         cloudfront_client = boto3.client(
             'cloudfront',
             aws_access_key_id=aws_access_key,
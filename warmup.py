@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Opt in by setting SULLSTICE_WARMUP=True on the deployment
+WARMUP_ENABLED = os.getenv("SULLSTICE_WARMUP") == "True"
+
+# Longest a request waits on an in-flight warm-up before doing the work itself
+WARMUP_WAIT_SECONDS = float(os.getenv("SULLSTICE_WARMUP_WAIT_SECONDS", "20"))
+
+_thread = None
+_done = threading.Event()
+_lock = threading.Lock()
+_results = {}
+
+def _run_step(name, step):
+    """
+    Run one warm-up step, recording its duration and any error
+    """
+    started = time.perf_counter()
+    try:
+        step()
+        _results[name] = {"ms": round((time.perf_counter() - started) * 1000), "ok": True}
+    except Exception as e:
+        _results[name] = {"ms": round((time.perf_counter() - started) * 1000), "ok": False, "error": str(e)}
+        logging.warning(f"Warm-up step {name} failed: {e}")
+
+def _warm_people():
+    from data_loader import get_people_snapshot
+    from person_identifier import get_person_index
+
+    snapshot = get_people_snapshot()
+    if snapshot is not None:
+        get_person_index(snapshot)
+
+def _warm_documents():
+    from data_loader import load_event_documents, load_updated_event_details
+
+    load_event_documents()
+    load_updated_event_details()
+
+def _warm_openai():
+    from openai_client import get_openai_client
+
+    if os.environ.get("OPENAI_API_KEY"):
+        get_openai_client()
+
+def _warm_clients():
+    from aws_email import get_ses_client
+    from clients import get_bigquery_client, get_storage_client
+
+    get_bigquery_client()
+    get_storage_client()
+    get_ses_client()
+
+def _run():
+    started = time.perf_counter()
+    try:
+        from google_services import get_docs_service, get_sheets_service
+
+        _run_step("google_services", lambda: (get_docs_service(), get_sheets_service()))
+        _run_step("documents", _warm_documents)
+        _run_step("people", _warm_people)
+        _run_step("openai", _warm_openai)
+        _run_step("clients", _warm_clients)
+    finally:
+        _done.set()
+        # Structured log line so warm-up duration can be charted as a log-based metric
+        logging.info(json.dumps({
+            "metric": "warmup_duration_ms",
+            "value": round((time.perf_counter() - started) * 1000),
+            "steps": _results,
+        }))
+
+def start_warmup():
+    """
+    Start the warm-up in a background thread, at most once per process
+
+    Pre-populates the document and people caches and creates the API clients
+    so the first RSVP or question on a new instance does not pay for them.
+    """
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+            _thread.start()
+
+def wait_for_warmup(timeout=None):
+    """
+    Block until an in-flight warm-up finishes
+
+    Returns immediately if warm-up was never started or has finished.
+
+    Args:
+        timeout: Seconds to wait at most, defaults to WARMUP_WAIT_SECONDS
+
+    Returns:
+        True if no warm-up is still running when this returns
+    """
+    if _thread is None or _done.is_set():
+        return True
+    return _done.wait(WARMUP_WAIT_SECONDS if timeout is None else timeout)
+
+def get_warmup_status():
+    """
+    Get the state and per-step results of the warm-up
+
+    Returns:
+        Dictionary with started, done and steps
+    """
+    return {"started": _thread is not None, "done": _done.is_set(), "steps": dict(_results)}